@@ -1,40 +1,234 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, Request, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
+import asyncio
 import os
 import uuid
 from werkzeug.utils import secure_filename
-from groclake.modellake import ModelLake
-from groclake.vectorlake import VectorLake
-import PyPDF2
-import docx
-import traceback
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from chat_rules import CHAT_MATCHER, first_rule
+from chat_templates import render_cache_stats, render_structured, structured_intent
+from dialogue import DialogueState
+from lab_values import REFERENCE_RANGES, scan_lab_report, format_lab_value
+from report_store import UploadStore, AnalysisCache, UploadError
+import extraction
+from lazy import LazyObject, on_warm_up, warm_up
+from prompt_builder import MapReduceAnalyzer, report_messages
+from model_client import ModelClient, ModelUnavailableError
+from fake_modellake import FakeModelLake
+from session_store import SessionStore
+from sqlite_store import SQLiteDatabase, SQLiteUserStore, SQLiteSessionStore
+from streaming import SSE_HEADERS, sse_event, stream_sections
+from structured_log import setup_logging, get_logger
+from rate_limit import RateLimiter, MemoryBucketStore, SQLiteBucketStore, AdmissionGate
+from response_cache import ResponseCache
+from jobs import LocalJobQueue, MemoryJobStore, SQLiteJobStore, QueueFullError, FINISHED_STAGES
+import metrics
+from metrics import REGISTRY, stage_timer, record_response
 
-app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
+# Routes live on a blueprint so create_app() can build the app; the model clients,
+# parsers and retrieval index below are created on first use (or by warm_up())
+api = Blueprint('api', __name__)
+
+# Logging goes through a queue to a background writer; tokens and PHI are redacted
+setup_logging()
+log = get_logger('app')
+# Fraction of high-volume per-request events that are logged
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 0.1))
 
 # Set Groclake credentials
 os.environ['GROCLAKE_API_KEY'] = '013d407166ec4fa56eb1e1f8cbe183b9'
 os.environ['GROCLAKE_ACCOUNT_ID'] = '3838e00de26b4f0c6e8e84d7ea89e566'
 
-# Initialize Groclake
-modellake = ModelLake()
-vectorlake = VectorLake()
+def make_modellake():
+    # MODELLAKE=fake uses a local stand-in for development
+    if os.environ.get('MODELLAKE') == 'fake':
+        return FakeModelLake()
+    from groclake.modellake import ModelLake
+    return ModelLake()
+
+
+def make_vectorlake():
+    from groclake.vectorlake import VectorLake
+    return VectorLake()
+
+
+# Initialize Groclake lazily; a slow client start-up then runs inside the first
+# call's deadline instead of blocking the import
+modellake = LazyObject('modellake', make_modellake)
+vectorlake = LazyObject('vectorlake', make_vectorlake)
 
-# In a real app, you would use a database
-users_db = {}
-sessions = {}
-conversation_history = {}  # Store conversation history for each session
+# Answers to repeated and near-identical prompts are served from process memory;
+# RESPONSE_CACHE=off sends every prompt to ModelLake
+if os.environ.get('RESPONSE_CACHE', 'on').lower() in ('0', 'off', 'false', 'no'):
+    response_cache = None
+else:
+    response_cache = ResponseCache.from_env()
+
+# Every model call goes through this client for deadlines, retries and the circuit breaker
+model_client = ModelClient.from_env(modellake, os.environ['GROCLAKE_ACCOUNT_ID'], response_cache=response_cache)
+REGISTRY.register(model_client.latency)
+
+# SESSION_BACKEND=sqlite keeps users, sessions and history in a shared SQLite
+# database so several worker processes can serve the same tokens
+if os.environ.get('SESSION_BACKEND') == 'sqlite':
+    database = SQLiteDatabase(os.environ.get('DATABASE_PATH', 'medassist.db'))
+    users_db = SQLiteUserStore(database)  # The migrations add the default test user
+    sessions = SQLiteSessionStore.from_env(database)
+else:
+    # Add a default user for testing
+    users_db = {
+        "test": {"password": "test123"}
+    }
+    # Sessions expire when idle and are capped in number; each keeps a bounded ring
+    # buffer of recent chat turns
+    sessions = SessionStore.from_env()
+conversation_history = sessions.history  # Store conversation history for each session
+dialogue_states = sessions.dialogue  # Topic, pending questions and answers of each chat
 UPLOAD_FOLDER = 'uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-# Add a default user for testing
-users_db = {
-    "test": {"password": "test123"}
-}
+# Uploads are stored by content hash; extracted text and analyses are cached by it.
+# The type is sniffed from the content and each type has its own size cap. Old
+# uploads are swept after UPLOAD_TTL or beyond UPLOAD_STORE_MAX_BYTES
+upload_store = UploadStore.from_env(UPLOAD_FOLDER, type_limits={
+    file_type: int(os.environ[f'UPLOAD_MAX_{file_type.upper()}_BYTES'])
+    for file_type in ('pdf', 'docx', 'txt') if f'UPLOAD_MAX_{file_type.upper()}_BYTES' in os.environ
+})
+
+
+class UploadRequest(Request):
+    """Spools uploaded files into the upload folder, so storing one is a rename rather than a second copy"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return upload_store.spool()
+
+    def close(self):
+        super().close()
+        upload_store.discard_spooled(self.__dict__.get('files'))
+
+
+analysis_cache = AnalysisCache(
+    os.path.join(UPLOAD_FOLDER, '.cache'),
+    max_memory_bytes=int(os.environ.get('ANALYSIS_CACHE_MEMORY_BYTES', 32 * 1024 * 1024)),
+    max_disk_bytes=int(os.environ.get('ANALYSIS_CACHE_DISK_BYTES', 512 * 1024 * 1024)),
+)
+
+# Reports over PROMPT_TOKEN_BUDGET are analyzed chunk by chunk and merged (map-reduce);
+# chunk summaries are cached by content hash. REPORT_MAP_REDUCE=0 sends only the
+# retrieved excerpts in one call instead
+report_analyzer = MapReduceAnalyzer(
+    model_client, analysis_cache,
+    token_budget=int(os.environ.get('PROMPT_TOKEN_BUDGET', 3000)),
+    chunk_tokens=int(os.environ.get('CHUNK_TOKEN_BUDGET', 1500)),
+    max_workers=int(os.environ.get('MAP_CONCURRENCY', 4)),
+)
+REPORT_MAP_REDUCE = os.environ.get('REPORT_MAP_REDUCE', '1').lower() in ('1', 'true', 'yes')
+
+# Long reports get matching reference notes, and excerpts about flagged values when
+# not using map-reduce. RETRIEVAL=vectorlake serves the notes from VectorLake, off disables it
+RETRIEVAL = os.environ.get('RETRIEVAL', 'local')
+
+
+def make_retriever():
+    import retrieval  # pulls in NumPy
+    embedder = retrieval.HashingEmbedder()
+    if RETRIEVAL == 'vectorlake':
+        return retrieval.VectorLakeRetriever(vectorlake, embedder, vectorlake_id=os.environ.get('VECTORLAKE_ID'))
+    reference_index = retrieval.load_reference_index(embedder, cache_dir=os.path.join(UPLOAD_FOLDER, '.index'))
+    return retrieval.LocalRetriever(embedder, reference_index)
+
+
+retriever = LazyObject('retriever', make_retriever) if RETRIEVAL != 'off' else None
+
+
+@on_warm_up
+def push_reference_corpus():
+    """Push the reference corpus to VectorLake when no VECTORLAKE_ID is configured"""
+    if RETRIEVAL == 'vectorlake':
+        retriever.push_reference_corpus()
+
+
+def make_report_classifier():
+    import report_types  # pulls in NumPy
+    return report_types.ReportTypeClassifier.from_env()
+
+
+# Report types for the rule-based analysis, scored together in one pass over the text
+report_classifier = LazyObject('report_classifier', make_report_classifier)
+on_warm_up(extraction.load_parsers)
+on_warm_up(REFERENCE_RANGES.arrays)
+
+# Background report analysis; JOB_STORE=sqlite shares job status between processes
+if os.environ.get('JOB_STORE') == 'sqlite':
+    job_store = SQLiteJobStore(os.environ.get('JOB_DB', os.path.join(UPLOAD_FOLDER, 'jobs.db')))
+else:
+    job_store = MemoryJobStore()
+report_jobs = LocalJobQueue(
+    job_store,
+    max_workers=int(os.environ.get('ANALYSIS_CONCURRENCY', 4)),
+    max_pending=int(os.environ.get('ANALYSIS_MAX_PENDING', 64)),
+)
+
+# Multi-file uploads: documents are extracted in the extraction process pool and
+# analyzed on a bounded thread pool
+REPORT_BATCH_MAX_FILES = int(os.environ.get('REPORT_BATCH_MAX_FILES', 20))
+batch_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('REPORT_BATCH_CONCURRENCY', 4)),
+                                    thread_name_prefix='report-batch')
+
+# Per-session token buckets for chat and report requests; RATE_LIMIT_STORE=sqlite
+# shares them between worker processes and RATE_LIMIT=off disables them
+if os.environ.get('RATE_LIMIT', 'on').lower() in ('0', 'off', 'false', 'no'):
+    rate_limiter = None
+elif os.environ.get('RATE_LIMIT_STORE') == 'sqlite':
+    rate_limiter = RateLimiter.from_env(
+        SQLiteBucketStore(os.environ.get('RATE_LIMIT_DB', os.path.join(UPLOAD_FOLDER, 'ratelimit.db'))))
+else:
+    rate_limiter = RateLimiter.from_env(MemoryBucketStore())
+
+# New report work is shed with 503 while the ModelLake or extraction queue is full
+admission_gate = AdmissionGate(retry_after=int(os.environ.get('ADMISSION_RETRY_AFTER', 5)))
+admission_gate.watch('modellake', model_client.pending, int(os.environ.get('ADMISSION_MAX_MODEL_PENDING', 256)))
+admission_gate.watch('extraction', extraction.pending, int(os.environ.get('ADMISSION_MAX_EXTRACT_PENDING', 64)))
+
+
+def admission_check(token, budget, cost=1, shed=True):
+    """Return a Rejection when the request has to be refused, else None
+
+    Report requests are shed first while a queue is full (unless shed=False),
+    then cost is charged to the session's budget.
+    """
+    if budget == 'report' and shed:
+        rejection = admission_gate.check()
+        if rejection:
+            log.info("request_shed", budget=budget)
+            return rejection
+    if rate_limiter is None or cost <= 0:
+        return None
+    rejection = rate_limiter.check(token, budget, cost)
+    if rejection:
+        log.info("request_rate_limited", budget=budget, retry_after=rejection.retry_after)
+    return rejection
+
+
+def rejection_response(rejection):
+    response = jsonify({"error": rejection.error})
+    response.status_code = rejection.status_code
+    response.headers['Retry-After'] = str(rejection.retry_after)
+    return response
+
+@api.app_errorhandler(413)
+def request_too_large(e):
+    return jsonify({"error": "Upload is too large"}), 413
+
+
+@api.app_errorhandler(UploadError)
+def upload_rejected(e):
+    return jsonify({"error": str(e)}), e.status_code
 
 # Authentication functions - shared between both features
-@app.route('/api/register', methods=['POST'])
+@api.route('/api/register', methods=['POST'])
 def register():
     data = request.json
     username = data.get('username')
@@ -49,7 +243,7 @@ def register():
     users_db[username] = {"password": password}
     return jsonify({"message": "User registered successfully"}), 201
 
-@app.route('/api/login', methods=['POST'])
+@api.route('/api/login', methods=['POST'])
 def login():
     data = request.json
     username = data.get('username')
@@ -67,8 +261,7 @@ def login():
     # Initialize conversation history for this session
     conversation_history[session_id] = []
     
-    print(f"Login successful for user: {username}, session: {session_id}")
-    print(f"Active sessions: {sessions}")
+    log.info("login", username=username, session_id=session_id)
     
     return jsonify({"message": "Login successful", "token": session_id}), 200
 
@@ -88,23 +281,14 @@ class GeneralQueryHandler:
     @staticmethod
     def handle_chat(token, user_question):
         """Process a chat message and return response"""
-        # Get conversation history or initialize if empty
-        session_history = conversation_history.get(token, [])
+        # The dialogue state replaces a scan of the history; it is advanced once per turn
+        dialogue_state = dialogue_states.get(token) or DialogueState()
+        found = CHAT_MATCHER.scan(user_question.lower())
+        rule = None
         
         # Check if this is a structured response from the interactive UI
-        is_structured_response = False
-        structured_answers = {}
-        
-        # Look for structured answer pattern: "Question: Answer"
-        if "\n\n" in user_question:
-            sections = user_question.split("\n\n")
-            is_structured_response = True
-            
-            # Parse each question-answer pair
-            for section in sections:
-                if ":" in section:
-                    q_part, a_part = section.split(":", 1)
-                    structured_answers[q_part.strip()] = a_part.strip()
+        structured_answers = GeneralQueryHandler.parse_structured_answers(user_question)
+        is_structured_response = structured_answers is not None
         
         # System prompt for medical assistant with improved handling for structured answers
         system_content = """You are an empathetic medical assistant conducting an interactive diagnosis.
@@ -128,39 +312,36 @@ class GeneralQueryHandler:
             system_content += "\n\nThe user has provided responses to your previous questions in a structured format. Please acknowledge each response and provide appropriate follow-up based on the answers."
         
         try:
-            print("Creating fallback response for chat message...")
+            log.debug("chat_rule_based", structured=is_structured_response)
             
             # Check for rule-based response
-            if is_structured_response:
-                answer = GeneralQueryHandler.generate_structured_response(structured_answers)
-            else:
-                answer = GeneralQueryHandler.generate_rule_based_response(user_question, session_history)
+            with stage_timer('rules'):
+                if is_structured_response:
+                    answer = GeneralQueryHandler.generate_structured_response(structured_answers)
+                else:
+                    rule = GeneralQueryHandler.select_rule(found, dialogue_state)
+                    answer = rule.response
             
-            # Print details about the response for debugging
-            print(f"User question: '{user_question}'")
-            print(f"Response length: {len(answer)}")
-            print(f"Response preview: {answer[:100]}...")
+            # Details about the response for debugging; the question text is redacted by default
+            log.info("chat_response", sample=LOG_SAMPLE_RATE, question=user_question, response_length=len(answer))
             
             # Check for empty responses (which would cause client-side errors)
             if not answer or len(answer.strip()) < 10:
-                print("Warning: Generated response is empty or too short. Using generic response.")
+                log.warning("chat_response_too_short", response_length=len(answer))
                 answer = (
                     "I understand your question about health concerns. To provide more specific guidance, "
                     "could you please share more details about your symptoms, such as when they started "
                     "and any factors that seem to improve or worsen them? This will help me give you more relevant information."
                 )
             
-            # Update conversation history
-            session_history.append({"type": "question", "content": user_question})
-            session_history.append({"type": "answer", "content": answer})
-            conversation_history[token] = session_history
+            # Update conversation history and the dialogue state
+            GeneralQueryHandler.record_turn(token, user_question, answer, found, rule)
             
             # Return response without indicating fallback to maintain user confidence
             return {"message": answer, "is_fallback": False}
             
         except Exception as e:
-            print(f"Error in chat endpoint: {str(e)}")
-            print(traceback.format_exc())
+            log.exception("chat_error", error=str(e))
             
             # Final fallback response
             if is_structured_response:
@@ -179,361 +360,95 @@ class GeneralQueryHandler:
                 )
             
             # Still update conversation history
-            session_history.append({"type": "question", "content": user_question})
-            session_history.append({"type": "answer", "content": fallback_response})
-            conversation_history[token] = session_history
+            GeneralQueryHandler.record_turn(token, user_question, fallback_response, found, None)
             
             return {"message": fallback_response, "is_fallback": True}
 
+    @staticmethod
+    def parse_structured_answers(user_question):
+        """Return the {question: answer} pairs of a structured reply, or None for a free-text message"""
+        # Look for structured answer pattern: "Question: Answer"
+        if "\n\n" not in user_question:
+            return None
+        
+        # Parse each question-answer pair
+        structured_answers = {}
+        for section in user_question.split("\n\n"):
+            if ":" in section:
+                q_part, a_part = section.split(":", 1)
+                structured_answers[q_part.strip()] = a_part.strip()
+        return structured_answers
+
     @staticmethod
     def generate_structured_response(structured_answers):
         """Generate responses to structured answers from the interactive UI"""
-        # Check for fever-related questions
-        fever_questions = [q for q in structured_answers.keys() if 'fever' in q.lower()]
-        if fever_questions:
-            temp_reading = None
-            other_symptoms = False
-            duration = None
-            
-            for question in structured_answers:
-                answer = structured_answers[question]
-                
-                if 'temperature' in question.lower():
-                    temp_reading = answer
-                elif 'other symptoms' in question.lower():
-                    if answer.lower() not in ['no', 'none', 'not really']:
-                        other_symptoms = True
-                elif 'long' in question.lower() or 'duration' in question.lower():
-                    duration = answer
-            
-            # Generate a response based on the fever information
-            response = "Thank you for providing those details about your fever. "
-            
-            if temp_reading:
-                if any(high_temp in temp_reading.lower() for high_temp in ['102', '103', '104', '105']):
-                    response += f"A temperature of {temp_reading} is considered a high fever. "
-                    if duration and 'today' in duration.lower():
-                        response += "Even though it just started today, this temperature is concerning and should be monitored closely. "
-                    else:
-                        response += "This is concerning, especially if it has persisted. "
-                    response += "I recommend contacting a healthcare provider soon. "
-                elif any(mild_temp in temp_reading.lower() for mild_temp in ['99', '100']):
-                    response += f"A temperature of {temp_reading} is considered a low-grade fever. "
-                    if duration and 'today' in duration.lower():
-                        response += "Since it just started today, you can monitor it for now. "
-                    else:
-                        response += "It's generally not a major concern but worth monitoring. "
-                else:
-                    response += f"Based on the temperature reading of {temp_reading}, "
-            
-            if other_symptoms:
-                response += "The presence of other symptoms alongside your fever could indicate an infection or illness. "
-                response += "Have you noticed if anything specific triggers or worsens these symptoms? "
-            else:
-                response += "A fever without other symptoms might be your body's initial response to an infection. "
-                response += "Are you staying hydrated and getting enough rest? "
-            
-            response += "\nFor fever management, you can:\n"
-            response += "1. Stay well-hydrated with water or electrolyte drinks\n"
-            response += "2. Rest as much as possible\n"
-            response += "3. Use appropriate over-the-counter fever reducers like acetaminophen if needed\n\n"
-            response += "Please remember that I'm providing general information and not medical advice. If your fever exceeds 103°F (39.4°C), persists for more than three days, or is accompanied by severe symptoms, please seek medical attention."
-            
-            return response
-        
-        # Check for stomach-related questions
-        stomach_questions = [q for q in structured_answers.keys() if any(term in q.lower() for term in ['stomach', 'pain', 'digest'])]
-        if stomach_questions:
-            duration = None
-            pattern = None
-            triggers = None
-            
-            for question in structured_answers:
-                answer = structured_answers[question]
-                
-                if 'long' in question.lower() or 'duration' in question.lower():
-                    duration = answer
-                elif 'constant' in question.lower() or 'come and go' in question.lower():
-                    pattern = answer
-                elif 'food' in question.lower() or 'trigger' in question.lower():
-                    triggers = answer
-            
-            # Generate a response based on the stomach information
-            response = "Thank you for providing those details about your stomach pain. "
-            
-            if duration:
-                if any(short_term in duration.lower() for short_term in ['today', 'day', 'just started']):
-                    response += "Since the pain just started recently, it could be related to something you ate or a brief digestive issue. "
-                elif any(long_term in duration.lower() for long_term in ['week', 'month', 'year']):
-                    response += "The fact that you've been experiencing this pain for some time suggests it may be a chronic condition. It would be important to consult with a gastroenterologist. "
-            
-            if pattern:
-                if 'constant' in pattern.lower():
-                    response += "Constant pain that doesn't subside is worth discussing with a healthcare provider as it might indicate inflammation or irritation. "
-                elif 'come' in pattern.lower() and 'go' in pattern.lower():
-                    response += "Pain that comes and goes is common with various digestive issues like gas, indigestion, or even conditions like IBS. "
-                elif 'after' in pattern.lower() and ('eat' in pattern.lower() or 'food' in pattern.lower() or 'meal' in pattern.lower()):
-                    response += "Pain that occurs after eating could be related to food sensitivities, gastritis, or other digestive processes. "
-            
-            if triggers:
-                if any(food in triggers.lower() for food in ['spicy', 'fatty', 'fried']):
-                    response += "Spicy and fatty foods commonly trigger digestive discomfort for many people. Limiting these foods could help reduce symptoms. "
-                elif any(food in triggers.lower() for food in ['dairy', 'milk', 'cheese', 'lactose']):
-                    response += "Discomfort after consuming dairy might suggest lactose intolerance. You might consider trying lactose-free alternatives. "
-            
-            response += "\nBased on what you've shared, here are some general recommendations:\n"
-            response += "1. Keep a food diary to identify potential trigger foods\n"
-            response += "2. Consider smaller, more frequent meals rather than large ones\n"
-            response += "3. Stay hydrated throughout the day\n"
-            response += "4. Avoid lying down immediately after eating\n\n"
-            response += "Would you like me to provide more specific information about managing stomach discomfort? Remember, persistent or severe symptoms should always be evaluated by a healthcare professional."
-            
-            return response
-        
-        # Generic response for other structured answers
-        response = "Thank you for providing those detailed answers. This information helps me understand your situation better. "
-        response += "Based on what you've shared, it seems you're experiencing "
-        
-        # Try to identify what they're describing from the questions
-        condition_terms = []
-        for question in structured_answers.keys():
-            for term in ["pain", "ache", "discomfort", "fever", "cough", "headache", "rash", "nausea"]:
-                if term in question.lower() and term not in condition_terms:
-                    condition_terms.append(term)
-        
-        if condition_terms:
-            response += f"{', '.join(condition_terms)}. "
-        else:
-            response += "some health concerns. "
-        
-        response += "Could you share if anything seems to improve or worsen your symptoms? Understanding these patterns can help provide more relevant information."
-        
-        return response
+        # Answers that reduce to the same intent share one rendered reply
+        return render_structured(structured_intent(structured_answers))
 
     @staticmethod
-    def generate_rule_based_response(user_question, session_history):
-        """Generate a rule-based response when ML services fail"""
-        user_question_lower = user_question.lower()
-        
-        # Check if this is a direct question from a health category selection
-        from_category = False
-        if len(user_question_lower) < 100 and "?" in user_question_lower:
-            # This might be a direct question from a category
-            from_category = True
-        
-        # Handle health category based questions with more consistent formatting
-        health_categories = {
-            # Respiratory questions
-            "cough": "I understand you're asking about a cough. To provide the most helpful information:\n\n1. How long have you been coughing?\n2. Is your cough dry or productive (bringing up mucus)?\n3. Have you noticed any specific triggers for your cough?",
-            "breathing": "I understand you're having breathing concerns. To better understand your situation:\n\n1. When did you first notice difficulty breathing?\n2. Does it happen during specific activities or all the time?\n3. Have you experienced this before?",
-            "shortness of breath": "I understand you're experiencing shortness of breath. Let me help you better:\n\n1. When did this shortness of breath start?\n2. Does it occur at rest, with activity, or both?\n3. Is it associated with any other symptoms like chest pain or dizziness?",
-            
-            # Digestive questions
-            "stomach": "About your stomach concern, I'd like to understand more:\n\n1. How long have you been experiencing this discomfort?\n2. Is the pain constant or does it come and go?\n3. Have you noticed any connection to eating certain foods?",
-            "nausea": "Regarding your nausea, to help you better:\n\n1. How long have you been feeling nauseated?\n2. Have you vomited or just felt nauseated?\n3. Have you identified any triggers for this feeling?",
-            "acid reflux": "About your acid reflux concern:\n\n1. How often do you experience acid reflux symptoms?\n2. Do you notice them at any particular time (after meals, when lying down)?\n3. Have you tried any remedies so far?",
-            
-            # Neurological questions
-            "headache": "To help with your headache concern:\n\n1. How long have you been experiencing these headaches?\n2. Where in your head do you feel the pain?\n3. How would you rate the intensity from 1-10?",
-            "migraine": "Regarding your migraine question:\n\n1. How frequently do you experience migraines?\n2. Do you notice any warning signs before they start?\n3. What triggers have you identified, if any?",
-            "dizziness": "About your dizziness concern:\n\n1. When did you first notice feeling dizzy?\n2. Would you describe it more as lightheadedness or a spinning sensation?\n3. Is it constant or does it come in episodes?",
-            
-            # Skin questions
-            "rash": "Regarding your rash question:\n\n1. Where on your body is the rash located?\n2. How long have you had this rash?\n3. Is it itchy, painful, or neither?",
-            "itchy skin": "About your itchy skin:\n\n1. How long have you been experiencing itchiness?\n2. Is it limited to one area or all over your body?\n3. Have you noticed any visible changes to your skin?",
-            "eczema": "Regarding your eczema question:\n\n1. Which parts of your body are affected?\n2. How long have you been dealing with this?\n3. Have you identified any triggers that worsen your symptoms?",
-            
-            # Musculoskeletal questions
-            "joint pain": "About your joint pain:\n\n1. Which joints are affected?\n2. How long have you been experiencing this pain?\n3. Does anything seem to improve or worsen the pain?",
-            "back pain": "Regarding your back pain:\n\n1. Where exactly in your back is the pain located?\n2. How long have you been experiencing it?\n3. Would you describe the pain as sharp, dull, or aching?",
-            "muscle": "About your muscle concern:\n\n1. Which muscles are affected?\n2. How long have you been experiencing this issue?\n3. Is the discomfort constant or only during certain activities?"
-        }
-        
+    def record_turn(token, user_question, answer, found, rule):
+        """Append the turn to the history and advance the session's dialogue state"""
+        conversation_history.extend(token, [
+            {"type": "question", "content": user_question},
+            {"type": "answer", "content": answer},
+        ])
+        # Advanced in place under the store's lock, so concurrent turns of one session both apply
+        dialogue_states.update(token, lambda state: state.advance(found, rule, answer))
+
+    @staticmethod
+    def select_rule(found, dialogue_state):
+        """Pick the rule that answers a message, given its scanned keywords"""
         # If this is a direct question from a category example, return a structured response
-        for key, response in health_categories.items():
-            if key in user_question_lower:
-                return response
+        category_rule = first_rule(found, 'category')
+        if category_rule:
+            return category_rule
         
-        # Check previous exchanges to see if this is a follow-up answer to questions
-        answered_questions = False
-        contains_specific_answers = False
+        # Generate more diagnostic responses when the user answers the questions we asked;
+        # earlier answers and the topic count towards the rule's keywords
+        if dialogue_state.is_follow_up(found):
+            follow_up_rule = first_rule(dialogue_state.context(found), 'follow_up')
+            if follow_up_rule:
+                return follow_up_rule
         
-        if len(session_history) >= 2:
-            last_bot_message = None
-            last_user_message = session_history[-1]["content"] if session_history[-1]["type"] == "question" else None
-            
-            # Find the last bot message that contains questions
-            for i in range(len(session_history)-1, -1, -1):
-                if session_history[i]["type"] == "answer" and any(q in session_history[i]["content"] for q in ["1.", "2.", "3.", "how long", "rate the pain"]):
-                    last_bot_message = session_history[i]["content"]
-                    break
-            
-            # If we found a message with questions and the user's reply has specific answers
-            if last_bot_message and last_user_message:
-                contains_specific_answers = any(term in last_user_message.lower() for term in 
-                    ["just started", "day", "week", "month", "constant", "comes and goes",
-                     "yes", "no", "mild", "moderate", "severe", "spicy", "dairy"])
-            
-            # If we detect a user has answered our questions with specific details
-            if contains_specific_answers:
-                answered_questions = True
-        
-        # Generate more diagnostic responses when users have answered questions
-        if answered_questions:
-            # Common diagnostic pathways based on symptoms
-            if 'stomach' in user_question_lower or 'digest' in user_question_lower:
-                if 'day' in user_question_lower or 'just started' in user_question_lower:
-                    if 'after' in user_question_lower and ('meal' in user_question_lower or 'eating' in user_question_lower):
-                        return (
-                            "Based on what you've shared about your stomach pain being recent and occurring after meals, "
-                            "this suggests you may be experiencing indigestion or possibly gastritis. Indigestion is common "
-                            "and can be triggered by certain foods, eating too quickly, or stress.\n\n"
-                            "Here are some approaches that might help:\n"
-                            "1. Try eating smaller, more frequent meals\n"
-                            "2. Avoid spicy, fatty, or acidic foods temporarily\n"
-                            "3. Consider over-the-counter antacids for temporary relief\n\n"
-                            "If the pain is severe, persistent beyond a few days, or accompanied by fever, vomiting, or blood in stool, "
-                            "please seek medical attention promptly."
-                        )
-                    else:
-                        return (
-                            "Based on your description of recent stomach discomfort, there are several potential causes including "
-                            "gastritis, food intolerance, or a mild stomach virus. Since this is a recent onset, it may resolve on its own "
-                            "with basic care.\n\n"
-                            "I recommend:\n"
-                            "1. Staying hydrated with clear fluids\n"
-                            "2. Eating bland foods like rice, toast, or bananas\n"
-                            "3. Resting and monitoring your symptoms\n\n"
-                            "If symptoms worsen, persist beyond 48 hours, or if you develop fever or vomiting, please consult a healthcare provider."
-                        )
-                elif any(term in user_question_lower for term in ['week', 'month', 'chronic', 'long time']):
-                    return (
-                        "The stomach pain you've been experiencing for an extended period could indicate a chronic condition "
-                        "such as irritable bowel syndrome (IBS), gastroesophageal reflux disease (GERD), or food sensitivities. "
-                        "Persistent symptoms should be evaluated by a healthcare provider.\n\n"
-                        "In the meantime, consider:\n"
-                        "1. Keeping a food diary to identify potential trigger foods\n"
-                        "2. Managing stress through relaxation techniques\n"
-                        "3. Avoiding alcohol, caffeine, and spicy foods\n\n"
-                        "Given the chronic nature of your symptoms, I strongly recommend scheduling an appointment with a "
-                        "gastroenterologist for proper diagnosis and treatment."
-                    )
-            
-            elif 'headache' in user_question_lower or 'migraine' in user_question_lower:
-                if any(term in user_question_lower for term in ['severe', '8', '9', '10']):
-                    return (
-                        "The severe headache you've described is concerning. Based on your description, this could be a migraine "
-                        "or tension headache, but severe headaches can sometimes indicate more serious conditions.\n\n"
-                        "For immediate relief:\n"
-                        "1. Rest in a dark, quiet room\n"
-                        "2. Apply a cold compress to your forehead or neck\n"
-                        "3. Consider appropriate over-the-counter pain relievers if not contraindicated for you\n\n"
-                        "Given the severity you've described, I recommend consulting with a healthcare provider soon, especially if this "
-                        "is a new or 'worst headache of your life' or if accompanied by fever, stiff neck, or confusion."
-                    )
-                else:
-                    return (
-                        "Based on your description, you appear to be experiencing a tension-type headache or mild migraine. "
-                        "These are common and often triggered by stress, dehydration, poor sleep, or eye strain.\n\n"
-                        "Here are some strategies that might help:\n"
-                        "1. Ensure you're staying hydrated throughout the day\n"
-                        "2. Take regular breaks from screens and practice the 20-20-20 rule (every 20 minutes, look at something 20 feet away for 20 seconds)\n"
-                        "3. Practice relaxation techniques like deep breathing or gentle neck stretches\n"
-                        "4. Consider over-the-counter pain relievers if appropriate for you\n\n"
-                        "If these headaches become more frequent or severe, please consult a healthcare provider."
-                    )
-            
-            elif 'fever' in user_question_lower:
-                if any(term in user_question_lower for term in ['102', '103', '104']):
-                    return (
-                        "With a temperature reading this high (over 102°F), you're experiencing a significant fever that requires attention. "
-                        "This level of fever suggests your body is fighting an infection, which could be viral or bacterial.\n\n"
-                        "Immediate steps to take:\n"
-                        "1. Stay well-hydrated with water or electrolyte drinks\n"
-                        "2. Use appropriate fever-reducing medication (acetaminophen or ibuprofen) if not contraindicated for you\n"
-                        "3. Rest and monitor your temperature\n\n"
-                        "A fever this high warrants medical attention, especially if it persists for more than 24 hours or is accompanied by "
-                        "severe headache, rash, confusion, persistent vomiting, or difficulty breathing. Please contact a healthcare provider today."
-                    )
-                else:
-                    return (
-                        "Based on what you've shared, you have a low-grade fever. This is often your body's natural response to fighting "
-                        "a mild infection, most commonly viral.\n\n"
-                        "Here's what I recommend:\n"
-                        "1. Rest and get plenty of fluids\n"
-                        "2. Monitor your temperature over the next 24-48 hours\n"
-                        "3. Use acetaminophen or ibuprofen as directed if you're uncomfortable\n\n"
-                        "If your fever persists beyond 3 days, rises above 102°F (39°C), or is accompanied by severe symptoms like difficulty "
-                        "breathing or confusion, please seek medical care promptly."
-                    )
-        
-        # If not a follow-up or no specific symptoms matched, check for common symptoms in the query
-        if 'stomach' in user_question_lower and any(word in user_question_lower for word in ['ache', 'pain', 'hurt', 'issue']):
-            return (
-                "I understand you're experiencing stomach pain. This can be caused by various factors "
-                "including indigestion, gas, or more serious conditions. To help me understand better:\n\n"
-                "1. How long have you been experiencing this pain?\n"
-                "2. Is it constant or does it come and go?\n"
-                "3. Have you noticed any specific foods triggering it?\n\n"
-                "While I can provide some general guidance, it's important to consult with a healthcare provider "
-                "if the pain is severe, persistent, or accompanied by other concerning symptoms."
-            )
-        elif 'head' in user_question_lower and any(word in user_question_lower for word in ['ache', 'pain', 'hurt', 'migraine']):
-            return (
-                "I'm sorry to hear you're dealing with a headache. Headaches can have various causes including stress, "
-                "dehydration, lack of sleep, or eye strain. To better understand your situation:\n\n"
-                "1. How long have you had this headache?\n"
-                "2. How would you rate the pain from 1-10?\n"
-                "3. Have you tried any remedies already?\n\n"
-                "Remember, while I can offer general information, persistent or severe headaches should be evaluated by a healthcare professional."
-            )
-        elif 'fever' in user_question_lower:
-            return (
-                "I see you've mentioned having a fever. Fevers are often your body's natural response to infection. "
-                "To help me understand your situation better:\n\n"
-                "1. What is your temperature reading?\n"
-                "2. Are you experiencing any other symptoms alongside the fever?\n"
-                "3. How long have you had the fever?\n\n"
-                "While I can provide general guidance, please remember that I'm not a substitute for professional medical advice, "
-                "especially for fevers that are high, persistent, or accompanied by other concerning symptoms."
-            )
-        elif 'cough' in user_question_lower or 'cold' in user_question_lower or 'flu' in user_question_lower:
-            return (
-                "I understand you're experiencing respiratory symptoms. These could be related to a cold, flu, or other "
-                "respiratory conditions. To better understand your specific situation:\n\n"
-                "1. How long have you been experiencing these symptoms?\n"
-                "2. Is your cough dry or productive (producing mucus)?\n"
-                "3. Do you have other symptoms like fever, body aches, or fatigue?\n\n"
-                "While I can provide general information, these symptoms can vary widely in cause and treatment, so consulting "
-                "with a healthcare provider is recommended for proper diagnosis and care."
-            )
-        else:
-            # For any other query, return a generic response
-            return (
-                "Thank you for sharing your health concern. To help me understand your situation better and provide more relevant information, could you please:\n\n"
-                "1. Tell me more about when these symptoms started?\n"
-                "2. Describe any specific patterns or triggers you've noticed?\n"
-                "3. Mention any remedies you've already tried?\n\n"
-                "While I'm here to provide health information, please remember that I cannot replace professional medical advice. "
-                "If your symptoms are severe, persistent, or concerning, I'd recommend consulting with a healthcare provider."
-            )
+        # If not a follow-up or no specific symptoms matched, check for common symptoms in the query;
+        # the last symptom rule always fires and carries the generic response
+        return first_rule(found, 'symptom')
+
+    @staticmethod
+    def generate_rule_based_response(user_question, dialogue_state):
+        """Generate a rule-based response when ML services fail"""
+        # One pass over the message finds every keyword the rules care about
+        found = CHAT_MATCHER.scan(user_question.lower())
+        return GeneralQueryHandler.select_rule(found, dialogue_state).response
 
     # ...existing code...
 
-@app.route('/api/chat', methods=['POST'])
+@api.route('/api/chat', methods=['POST'])
 def chat():
     token = request.headers.get('Authorization')
-    print(f"Received chat request with token: {token}")
+    log.debug("chat_request", token=token)
     
     if not GeneralQueryHandler.verify_token(token):
         return jsonify({"error": "Unauthorized"}), 401
     
+    rejection = admission_check(token, 'chat')
+    if rejection:
+        return rejection_response(rejection)
+    
     data = request.json
     user_question = data.get('message')
     
     if not user_question or not user_question.strip():
         return jsonify({"error": "Empty message"}), 400
     
+    # Errors still return 200 to allow frontend to handle gracefully
+    result = chat_result(token, user_question)
+    with stage_timer('serialize'):
+        return jsonify(result)
+
+
+def chat_result(token, user_question):
+    """Run a chat turn and return the response dict, never raising"""
     try:
         result = GeneralQueryHandler.handle_chat(token, user_question)
         # Double-check that we have a valid response
@@ -544,21 +459,58 @@ def chat():
         if not result['message'] or len(result['message'].strip()) < 10:
             result['message'] = "I understand your question. Could you provide more details about your symptoms so I can better assist you?"
         
-        return jsonify(result)
+        record_response('chat', result.get('is_fallback', False))
+        return result
     except Exception as e:
-        print(f"Unhandled error in chat endpoint: {str(e)}")
-        print(traceback.format_exc())
-        return jsonify({
+        log.exception("chat_endpoint_error", error=str(e))
+        record_response('chat', True)
+        return {
             "message": "I understand your question but am having trouble processing it right now. Could you try rephrasing or asking a different health question?",
             "is_fallback": True,
             "error": True  # Flag to indicate error state to the frontend
-        }), 200  # Still return 200 to allow frontend to handle gracefully
+        }
+
+
+@api.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Same as /api/chat, but the reply is sent section by section as SSE events"""
+    token = request.headers.get('Authorization')
+    
+    if not GeneralQueryHandler.verify_token(token):
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    rejection = admission_check(token, 'chat')
+    if rejection:
+        return rejection_response(rejection)
+    
+    data = request.json
+    user_question = data.get('message')
+    
+    if not user_question or not user_question.strip():
+        return jsonify({"error": "Empty message"}), 400
+    
+    def generate():
+        result = chat_result(token, user_question)
+        yield from stream_sections(result['message'], result['is_fallback'])
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=SSE_HEADERS)
 
 
 #############################################################################
 # MEDICAL REPORT MODULE - Everything related to report analysis
 #############################################################################
 
+# System prompt for report analysis
+REPORT_SYSTEM_PROMPT = """You are a medical assistant analyzing medical reports. Follow these guidelines:
+1. Identify key metrics and test results
+2. Compare results with normal ranges when available
+3. Highlight any abnormal findings
+4. Organize information in a structured way
+5. Avoid making definitive diagnostic statements
+6. Always remind that this is not a substitute for professional medical interpretation
+7. Be factual and objective in your analysis
+"""
+
 class MedicalReportHandler:
     @staticmethod
     def verify_token(token):
@@ -568,127 +520,67 @@ class MedicalReportHandler:
         return True
         
     @staticmethod
-    def extract_text_from_file(file):
-        """Extract text content from various file formats"""
-        filename = file.filename
-        file_extension = filename.split('.')[-1].lower()
-        
-        if file_extension == 'pdf':
-            reader = PyPDF2.PdfReader(file)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-            return text
-        elif file_extension in ['doc', 'docx']:
-            doc = docx.Document(file)
-            text = "\n".join([para.text for para in doc.paragraphs])
-            return text
-        elif file_extension in ['txt']:
-            return file.read().decode('utf-8')
-        else:
+    def extract_text_from_file(file_path, stream=None):
+        """Extract text content from various file formats
+
+        Pages are fed to the stream (report_analyzer.stream()) as they are
+        extracted, so a long report's chunks are summarized during extraction.
+        """
+        if stream is None:
+            return extraction.extract_text_from_file(file_path)
+        pieces = MedicalReportHandler.iter_text_from_file(file_path)
+        if pieces is None:
             return None
+        for piece in pieces:
+            stream.feed(piece)
+        return stream.text()
+
+    @staticmethod
+    def iter_text_from_file(file_path):
+        """Yield text page by page so analysis can start before extraction ends"""
+        return extraction.iter_text_from_file(file_path)
 
     @staticmethod
-    def generate_report_analysis(extracted_text, filename):
-        """Generate a structured analysis of a medical report when ML services fail"""
+    def generate_report_analysis(extracted_text, filename, report_types=None):
+        """Generate a structured analysis of a medical report when ML services fail
+
+        report_types are the report's ReportLabels when the caller has classified it already.
+        """
         # Convert text to lowercase for easier matching
         text_lower = extracted_text.lower()
         
         # Prepare a response structure
         analysis = f"## Medical Report Analysis: {filename}\n\n"
         
-        # Try to detect the type of report
-        report_type = "Unknown"
-        if any(term in text_lower for term in ["cbc", "complete blood count", "wbc", "rbc", "hemoglobin", "hematocrit"]):
-            report_type = "Blood Test"
-        elif any(term in text_lower for term in ["urine", "urinalysis"]):
-            report_type = "Urinalysis"
-        elif any(term in text_lower for term in ["glucose", "hba1c", "blood sugar"]):
-            report_type = "Glucose/Diabetes Test"
-        elif any(term in text_lower for term in ["cholesterol", "hdl", "ldl", "triglycerides", "lipid"]):
-            report_type = "Lipid Panel"
-        elif any(term in text_lower for term in ["x-ray", "xray", "radiograph"]):
-            report_type = "X-Ray Report"
-        elif any(term in text_lower for term in ["mri", "magnetic resonance"]):
-            report_type = "MRI Report"
-        elif any(term in text_lower for term in ["ct scan", "cat scan"]):
-            report_type = "CT Scan"
-        elif any(term in text_lower for term in ["ultrasound", "sonogram", "doppler"]):
-            report_type = "Ultrasound"
-        elif any(term in text_lower for term in ["ecg", "ekg", "electrocardiogram"]):
-            report_type = "ECG/EKG"
+        # Detect the type of report; a combined panel gets every type it covers
+        if report_types is None:
+            report_types = report_classifier.classify(text_lower)
+        report_type = ", ".join(label for label, _ in report_types) or "Unknown"
         
         analysis += f"**Report Type**: {report_type}\n\n"
         
-        # Look for common patterns in medical reports
-        # 1. Find values with units and compare to normal ranges if possible
-        values_found = []
-        # Check for common test patterns like "Test: Value Unit (Range)"
-        import re
-        
-        # Look for these common tests and extract values
-        common_tests = {
-            # Blood tests
-            "hemoglobin": {"unit": "g/dL", "normal": "12-16 g/dL (females), 13.5-17.5 g/dL (males)"},
-            "hematocrit": {"unit": "%", "normal": "36-48% (females), 41-50% (males)"},
-            "rbc": {"unit": "million/μL", "normal": "4.2-5.4 million/μL (females), 4.7-6.1 million/μL (males)"},
-            "wbc": {"unit": "cells/μL", "normal": "4,500-11,000 cells/μL"},
-            "platelets": {"unit": "/μL", "normal": "150,000-450,000/μL"},
-            
-            # Lipid panel
-            "cholesterol": {"unit": "mg/dL", "normal": "<200 mg/dL"},
-            "ldl": {"unit": "mg/dL", "normal": "<100 mg/dL"},
-            "hdl": {"unit": "mg/dL", "normal": ">40 mg/dL (males), >50 mg/dL (females)"},
-            "triglycerides": {"unit": "mg/dL", "normal": "<150 mg/dL"},
-            
-            # Liver function
-            "alt": {"unit": "U/L", "normal": "7-56 U/L"},
-            "ast": {"unit": "U/L", "normal": "5-40 U/L"},
-            
-            # Kidney function
-            "creatinine": {"unit": "mg/dL", "normal": "0.6-1.2 mg/dL (males), 0.5-1.1 mg/dL (females)"},
-            "bun": {"unit": "mg/dL", "normal": "7-20 mg/dL"},
-            "egfr": {"unit": "mL/min", "normal": ">60 mL/min"},
-            
-            # Glucose
-            "glucose": {"unit": "mg/dL", "normal": "70-99 mg/dL (fasting)"},
-            "hba1c": {"unit": "%", "normal": "< 5.7%"},
-            
-            # Thyroid
-            "tsh": {"unit": "μIU/mL", "normal": "0.4-4.0 μIU/mL"},
-            "t4": {"unit": "μg/dL", "normal": "4.5-12 μg/dL"},
-            "t3": {"unit": "ng/dL", "normal": "80-200 ng/dL"}
-        }
-        
-        # Try to extract test results for common tests
-        for test, info in common_tests.items():
-            # Look for test name followed by numbers
-            pattern = rf'{test}\D*(\d+\.?\d*)'
-            matches = re.findall(pattern, text_lower, re.IGNORECASE)
-            if matches:
-                values_found.append(f"**{test.upper()}**: {matches[0]} {info['unit']} (Normal range: {info['normal']})")
+        # Look for common patterns in medical reports: one pass finds every known
+        # test value (with its unit) and every abnormality phrase
+        lab_scan = scan_lab_report(text_lower)
         
-        if values_found:
+        # 1. Values with units, compared to normal ranges where the units allow it
+        if lab_scan.values:
             analysis += "### Detected Values:\n"
-            for value in values_found:
-                analysis += f"- {value}\n"
+            for lab_value in lab_scan.values:
+                analysis += f"- {format_lab_value(lab_value)}\n"
             analysis += "\n"
         
-        # Look for terms indicating abnormality
-        abnormal_terms = ["abnormal", "high", "low", "elevated", "decreased", "positive", "negative", 
-                           "out of range", "reference range", "critical"]
-        
+        # 2. Terms indicating abnormality
         abnormal_findings = []
-        for term in abnormal_terms:
-            # Find instances where abnormal terms appear
-            pattern = rf'(\w+\s*\w*)\s*(?:is|was|were|appears?|shows?)\s*{term}'
-            matches = re.findall(pattern, text_lower)
-            abnormal_findings.extend(matches)
+        for finding in lab_scan.findings:
+            phrase = finding.phrase.strip().capitalize()
+            if phrase not in abnormal_findings:  # Remove duplicates, keep report order
+                abnormal_findings.append(phrase)
         
         if abnormal_findings:
             analysis += "### Potential Abnormal Findings:\n"
-            for finding in set(abnormal_findings):  # Using set to remove duplicates
-                analysis += f"- {finding.strip().capitalize()}\n"
+            for finding in abnormal_findings:
+                analysis += f"- {finding}\n"
             analysis += "\n"
         
         # Add recommendations
@@ -703,120 +595,514 @@ class MedicalReportHandler:
         
         return analysis
 
+    @staticmethod
+    def run_model_analysis(extracted_text, system_content, stream=None):
+        """Analyze with ModelLake in one call, or chunk by chunk when over the token budget
+
+        stream is the ReportStream the text was extracted into, if any.
+        """
+        if report_analyzer.fits(extracted_text):
+            with stage_timer('model'):
+                return model_client.chat_complete(report_messages(system_content, extracted_text))
+        
+        context = None
+        if retriever is not None:
+            with stage_timer('retrieve'):
+                context = retriever.context(extracted_text)
+        references = context.references if context else ()
+        
+        if REPORT_MAP_REDUCE or context is None:
+            with stage_timer('map_reduce'):
+                return report_analyzer.analyze(extracted_text, system_content, references, stream)
+        
+        excerpts = "\n...\n".join(chunk.text for chunk in context.excerpts)
+        with stage_timer('model'):
+            return model_client.chat_complete(report_messages(system_content, excerpts, references))
+
+    @staticmethod
+    def store_upload(file):
+        """Save an upload under its content hash; return (filename, digest, file_path)"""
+        filename = secure_filename(file.filename)
+        with stage_timer('upload'):
+            digest, file_path = upload_store.save(file, filename)
+        return filename, digest, file_path
+
     @staticmethod
     def analyze_report(token, file):
         """Process a report analysis request and return response"""
         if not file or file.filename == '':
             return {"error": "No file selected"}, 400
         
-        # Save the file
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
+        # Save the file under its content hash, hashing while it streams to disk
+        filename, digest, file_path = MedicalReportHandler.store_upload(file)
+        return MedicalReportHandler.analyze_stored_report(filename, digest, file_path)
+
+    @staticmethod
+    def analyze_stored_report(filename, digest, file_path, progress=None, extracted_text=None):
+        """Extract and analyze a stored upload; progress(stage) reports job stages
+
+        Pass extracted_text when the caller has already extracted the file.
+        """
+        if progress is None:
+            progress = lambda stage: None
+        
+        # A repeat upload of the same content reuses the earlier model analysis
+        cached_analysis = MedicalReportHandler.cached_analysis(digest)
+        if cached_analysis is not None:
+            return cached_analysis, 200
         
         # Extract text from the file
-        file.seek(0)  # Reset file pointer to beginning
-        try:
-            extracted_text = MedicalReportHandler.extract_text_from_file(file)
-        except Exception as e:
-            print(f"Error extracting text: {str(e)}")
-            print(traceback.format_exc())
-            return {"error": f"Error extracting text from file: {str(e)}"}, 400
+        stream = None
+        if extracted_text is None:
+            extracted_text = analysis_cache.get(digest, 'text')
+        if extracted_text is None:
+            # Map-reduce can start on the first chunks of a long report while later pages are extracted
+            if REPORT_MAP_REDUCE or retriever is None:
+                stream = report_analyzer.stream()
+            try:
+                with stage_timer('extract'):
+                    extracted_text = MedicalReportHandler.extract_text_from_file(file_path, stream)
+            except Exception as e:
+                if stream is not None:
+                    stream.cancel()
+                return MedicalReportHandler.extraction_failed(filename, e)
+            
+            if extracted_text:
+                analysis_cache.put(digest, 'text', extracted_text)
         
         if not extracted_text:
             return {"error": "Could not extract text from file"}, 400
-        
-        # System prompt for report analysis
-        system_content = """You are a medical assistant analyzing medical reports. Follow these guidelines:
-        1. Identify key metrics and test results
-        2. Compare results with normal ranges when available
-        3. Highlight any abnormal findings
-        4. Organize information in a structured way
-        5. Avoid making definitive diagnostic statements
-        6. Always remind that this is not a substitute for professional medical interpretation
-        7. Be factual and objective in your analysis
-        """
-        
-        # Build the prompt for the model
-        conversation_messages = [
-            {"role": "system", "content": system_content},
-            {"role": "user", "content": f"Here's a medical report to analyze: {extracted_text}\n\nPlease analyze this report and provide a summary of key findings."}
-        ]
+        progress('extracted')
         
         # Get response from ModelLake or use rule-based fallback
         try:
-            # First try ModelLake
+            # First try ModelLake; an open circuit breaker fails fast
             try:
-                print("Sending report analysis request to ModelLake...")
-                response = modellake.chat_complete({
-                    "groc_account_id": os.environ['GROCLAKE_ACCOUNT_ID'],
-                    "messages": conversation_messages
-                })
-                
-                print(f"ModelLake report analysis response: {response}")
-                
-                # Check if we got a valid response
-                if response and isinstance(response, dict) and len(response) > 0:
-                    if 'answer' in response and response['answer']:
-                        analysis = response['answer']
-                    else:
-                        # Try other fields
-                        for field in ['content', 'text', 'response']:
-                            if field in response and response[field]:
-                                analysis = response[field]
-                                break
-                        else:
-                            # If no text field, check for any string value
-                            for key, value in response.items():
-                                if isinstance(value, str) and value:
-                                    analysis = value
-                                    break
-                            else:
-                                # If still nothing, use rule-based analysis
-                                raise ValueError("No usable content in ModelLake response")
-                else:
-                    # Empty or invalid response
-                    raise ValueError("Empty or invalid ModelLake response")
+                progress('analyzing')
+                log.debug("modellake_report_request", text_length=len(extracted_text))
+                analysis = MedicalReportHandler.run_model_analysis(extracted_text, REPORT_SYSTEM_PROMPT, stream)
+                return MedicalReportHandler.model_result(digest, analysis)
                     
-                return {"analysis": analysis, "is_fallback": False}, 200
-                    
-            except Exception as e:
-                print(f"ModelLake failed, using rule-based analysis: {str(e)}")
+            except ModelUnavailableError as e:
+                log.warning("modellake_fallback", error=str(e))
                 # Use rule-based analysis as fallback
-                analysis = MedicalReportHandler.generate_report_analysis(extracted_text, filename)
-                return {"analysis": analysis, "is_fallback": True}, 200
+                return MedicalReportHandler.fallback_result(extracted_text, filename)
                 
         except Exception as e:
-            print(f"Error in report analysis: {str(e)}")
-            print(traceback.format_exc())
+            log.exception("report_analysis_error", error=str(e))
+            if stream is not None:
+                stream.cancel()
             
             # Ultimate fallback
-            analysis = MedicalReportHandler.generate_report_analysis(extracted_text, filename)
-            return {"analysis": analysis, "is_fallback": True}, 200
+            return MedicalReportHandler.fallback_result(extracted_text, filename)
+
+    @staticmethod
+    async def analyze_stored_report_async(filename, digest, file_path):
+        """analyze_stored_report for the ASGI app
+
+        Extraction runs in the extraction process pool and the model call is
+        awaited, so a request waiting on either holds no thread.
+        """
+        cached_analysis = await asyncio.to_thread(MedicalReportHandler.cached_analysis, digest)
+        if cached_analysis is not None:
+            return cached_analysis, 200
+        
+        extracted_text = await asyncio.to_thread(analysis_cache.get, digest, 'text')
+        if extracted_text is None:
+            try:
+                with stage_timer('extract'):
+                    extracted_text = await asyncio.wrap_future(extraction.submit_document(file_path))
+            except Exception as e:
+                return MedicalReportHandler.extraction_failed(filename, e)
+            
+            if extracted_text:
+                await asyncio.to_thread(analysis_cache.put, digest, 'text', extracted_text)
+        
+        if not extracted_text:
+            return {"error": "Could not extract text from file"}, 400
+        
+        try:
+            try:
+                log.debug("modellake_report_request", text_length=len(extracted_text))
+                analysis = await MedicalReportHandler.run_model_analysis_async(extracted_text, REPORT_SYSTEM_PROMPT)
+                return await asyncio.to_thread(MedicalReportHandler.model_result, digest, analysis)
+                    
+            except ModelUnavailableError as e:
+                log.warning("modellake_fallback", error=str(e))
+                return MedicalReportHandler.fallback_result(extracted_text, filename)
+                
+        except Exception as e:
+            log.exception("report_analysis_error", error=str(e))
+            return MedicalReportHandler.fallback_result(extracted_text, filename)
+
+    @staticmethod
+    async def run_model_analysis_async(extracted_text, system_content):
+        """run_model_analysis with the single-call case awaited on the async client"""
+        if report_analyzer.fits(extracted_text):
+            with stage_timer('model'):
+                return await model_client.chat_complete_async(report_messages(system_content, extracted_text))
+        
+        # Long reports go through retrieval and the map-reduce thread pool
+        return await asyncio.to_thread(MedicalReportHandler.run_model_analysis, extracted_text, system_content)
+
+    @staticmethod
+    def cached_analysis(digest):
+        """The model analysis of an earlier upload with the same content, if any"""
+        cached_analysis = analysis_cache.get(digest, 'analysis')
+        if cached_analysis is not None:
+            record_response('report', False)
+        return cached_analysis
+
+    @staticmethod
+    def extraction_failed(filename, error):
+        """Called from the except block, so the traceback is logged"""
+        log.exception("extract_error", filename=filename, error=str(error))
+        return {"error": f"Error extracting text from file: {str(error)}"}, 400
+
+    @staticmethod
+    def model_result(digest, analysis):
+        log.info("modellake_report_response", response_length=len(analysis))
+        
+        result = {"analysis": analysis, "is_fallback": False}
+        # Only model answers are cached, so a later upload can still reach ModelLake
+        analysis_cache.put(digest, 'analysis', result)
+        record_response('report', False)
+        return result, 200
+
+    @staticmethod
+    def fallback_result(extracted_text, filename):
+        """Rule-based analysis used when ModelLake is unavailable"""
+        with stage_timer('fallback'):
+            report_types = report_classifier.classify(extracted_text)
+            analysis = MedicalReportHandler.generate_report_analysis(extracted_text, filename, report_types)
+        record_response('report', True)
+        return {"analysis": analysis, "is_fallback": True,
+                "report_types": [label._asdict() for label in report_types]}, 200
+
+
+def queue_report_job(token, filename, digest, file_path):
+    """Queue a stored upload for background analysis; return (body, status code)"""
+    try:
+        job_id = report_jobs.submit(token, MedicalReportHandler.analyze_stored_report,
+                                    filename, digest, file_path)
+    except QueueFullError as e:
+        return {"error": str(e)}, 503
+    return {
+        "job_id": job_id,
+        "status": "uploaded",
+        "status_url": f"/api/analyze-report/{job_id}",
+        "result_url": f"/api/analyze-report/{job_id}/result"
+    }, 202
 
 
 # Update endpoints to use the handler classes
 
-@app.route('/api/analyze-report', methods=['POST'])
+@api.route('/api/analyze-report', methods=['POST'])
 def analyze_report():
     token = request.headers.get('Authorization')
-    print(f"Received report analysis request with token: {token}")
+    log.debug("report_request", token=token)
     
     if not MedicalReportHandler.verify_token(token):
         return jsonify({"error": "Unauthorized"}), 401
     
+    # Checked before the upload is read
+    rejection = admission_check(token, 'report')
+    if rejection:
+        return rejection_response(rejection)
+    
     if 'file' not in request.files:
         return jsonify({"error": "No file provided"}), 400
     
     file = request.files['file']
     
+    # ?async=1 queues the analysis and returns a job id straight away
+    if request.args.get('async', '').lower() in ('1', 'true', 'yes'):
+        if file.filename == '':
+            return jsonify({"error": "No file selected"}), 400
+        filename, digest, file_path = MedicalReportHandler.store_upload(file)
+        body, status_code = queue_report_job(token, filename, digest, file_path)
+        return jsonify(body), status_code
+    
     result, status_code = MedicalReportHandler.analyze_report(token, file)
     
-    if status_code == 200:
-        return jsonify(result)
-    else:
-        return jsonify(result), status_code
+    with stage_timer('serialize'):
+        if status_code == 200:
+            return jsonify(result)
+        else:
+            return jsonify(result), status_code
+
+
+@api.route('/api/analyze-report/stream', methods=['POST'])
+def analyze_report_stream():
+    """Report analysis as SSE: stage events as work progresses, then the analysis by section"""
+    token = request.headers.get('Authorization')
+    
+    if not MedicalReportHandler.verify_token(token):
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    # Checked before the upload is read
+    rejection = admission_check(token, 'report')
+    if rejection:
+        return rejection_response(rejection)
+    
+    if 'file' not in request.files:
+        return jsonify({"error": "No file provided"}), 400
+    
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({"error": "No file selected"}), 400
+    
+    # The upload has to be read before the response starts streaming
+    filename, digest, file_path = MedicalReportHandler.store_upload(file)
+    
+    def generate():
+        events = queue.Queue()
+        
+        def run():
+            try:
+                outcome = MedicalReportHandler.analyze_stored_report(
+                    filename, digest, file_path, progress=lambda stage: events.put(("stage", stage)))
+            except Exception as e:
+                log.exception("report_stream_error", error=str(e))
+                outcome = ({"error": "Report analysis failed"}, 500)
+            events.put(("result", outcome))
+        
+        threading.Thread(target=run, daemon=True).start()
+        yield sse_event("stage", {"stage": "uploaded"})
+        while True:
+            kind, payload = events.get()
+            if kind == "stage":
+                yield sse_event("stage", {"stage": payload})
+                continue
+            result, status_code = payload
+            if status_code != 200:
+                yield sse_event("error", {"error": result["error"], "status": status_code})
+            else:
+                yield from stream_sections(result["analysis"], result["is_fallback"])
+            break
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+
+@api.route('/api/analyze-reports', methods=['POST'])
+def analyze_reports():
+    """Analyze several uploaded files (form field "files") and stream each result as SSE
+
+    Identical files are analyzed once. ?summary=1 adds a combined summary of all
+    reports once every file is done.
+    """
+    token = request.headers.get('Authorization')
+    
+    if not MedicalReportHandler.verify_token(token):
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    # Shed before the upload is read; the budget is charged per file once they are counted
+    rejection = admission_check(token, 'report', cost=0)
+    if rejection:
+        return rejection_response(rejection)
+    
+    files = [f for f in request.files.getlist('files') if f.filename]
+    if not files:
+        return jsonify({"error": "No files provided"}), 400
+    if len(files) > REPORT_BATCH_MAX_FILES:
+        return jsonify({"error": f"At most {REPORT_BATCH_MAX_FILES} files per request"}), 400
+    rejection = admission_check(token, 'report', cost=len(files), shed=False)
+    if rejection:
+        return rejection_response(rejection)
+    want_summary = request.args.get('summary', '').lower() in ('1', 'true', 'yes')
+    
+    # Store every upload before streaming; identical content is analyzed once
+    uploads = []
+    rejected = []
+    for index, f in enumerate(files):
+        try:
+            uploads.append(MedicalReportHandler.store_upload(f))
+        except UploadError as e:
+            uploads.append((secure_filename(f.filename), None, None))
+            rejected.append({"index": index, "filename": uploads[-1][0], "status": e.status_code,
+                             "duplicate_of": None, "error": str(e)})
+    first_index = {}
+    for index, (filename, digest, file_path) in enumerate(uploads):
+        if digest is not None:
+            first_index.setdefault(digest, index)
+    
+    def run_batch(events):
+        def analyze(index, extracted_text=None):
+            filename, digest, file_path = uploads[index]
+            try:
+                outcome = MedicalReportHandler.analyze_stored_report(
+                    filename, digest, file_path, extracted_text=extracted_text)
+            except Exception as e:
+                log.exception("report_batch_error", error=str(e))
+                outcome = ({"error": "Report analysis failed"}, 500)
+            events.put((digest, outcome))
+        
+        # Cached analyses and texts skip the extraction pool
+        to_extract = []
+        for digest, index in first_index.items():
+            if analysis_cache.get(digest, 'analysis') is not None or analysis_cache.get(digest, 'text') is not None:
+                batch_executor.submit(analyze, index)
+            else:
+                to_extract.append(index)
+        
+        paths = [uploads[index][2] for index in to_extract]
+        for position, text, error in extraction.extract_many(paths):
+            index = to_extract[position]
+            filename, digest, _ = uploads[index]
+            if error is not None:
+                log.warning("extract_error", filename=filename, error=str(error))
+                events.put((digest, ({"error": f"Error extracting text from file: {str(error)}"}, 400)))
+            elif not text:
+                events.put((digest, ({"error": "Could not extract text from file"}, 400)))
+            else:
+                analysis_cache.put(digest, 'text', text)
+                batch_executor.submit(analyze, index, text)
+    
+    def generate():
+        events = queue.Queue()
+        threading.Thread(target=run_batch, args=(events,), daemon=True).start()
+        
+        for event in rejected:
+            yield sse_event("report", event)
+        
+        analyses = {}
+        for _ in range(len(first_index)):
+            digest, (result, status_code) = events.get()
+            for index, (filename, file_digest, _) in enumerate(uploads):
+                if file_digest != digest:
+                    continue
+                event = {"index": index, "filename": filename, "status": status_code,
+                         "duplicate_of": first_index[digest] if index != first_index[digest] else None}
+                event.update(result)
+                yield sse_event("report", event)
+            if status_code == 200:
+                first = first_index[digest]
+                analyses[f"Report {first + 1}: {uploads[first][0]}"] = result["analysis"]
+        
+        if want_summary and len(analyses) > 1:
+            try:
+                with stage_timer('summary', endpoint='api.analyze_reports'):
+                    summary = report_analyzer.combine_reports(analyses, REPORT_SYSTEM_PROMPT)
+                yield sse_event("summary", {"analysis": summary, "is_fallback": False})
+            except ModelUnavailableError as e:
+                log.warning("report_summary_unavailable", error=str(e))
+                yield sse_event("summary", {"error": "Combined summary is unavailable right now", "is_fallback": True})
+        yield sse_event("done", {"files": len(uploads), "unique": len(first_index)})
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+
+def get_report_job(job_id):
+    """Look up a job owned by the caller; return (job, error_response)"""
+    token = request.headers.get('Authorization')
+    if not MedicalReportHandler.verify_token(token):
+        return None, (jsonify({"error": "Unauthorized"}), 401)
+    
+    job = report_jobs.get(job_id)
+    if job is None or job["owner"] != token:
+        return None, (jsonify({"error": "Job not found"}), 404)
+    return job, None
+
+
+@api.route('/api/analyze-report/<job_id>', methods=['GET'])
+def analyze_report_status(job_id):
+    job, error = get_report_job(job_id)
+    if error:
+        return error
+    
+    return jsonify({
+        "job_id": job_id,
+        "status": job["status"],
+        "done": job["status"] in FINISHED_STAGES,
+        "error": job["error"]
+    })
+
+
+@api.route('/api/analyze-report/<job_id>/result', methods=['GET'])
+def analyze_report_result(job_id):
+    job, error = get_report_job(job_id)
+    if error:
+        return error
+    
+    if job["status"] not in FINISHED_STAGES:
+        return jsonify({"job_id": job_id, "status": job["status"]}), 202
+    if job["status"] == 'failed':
+        return jsonify({"error": job["error"] or "Report analysis failed"}), job["status_code"] or 500
+    return jsonify(job["result"]), job["status_code"]
+
+
+@api.route('/api/model-status', methods=['GET'])
+def model_status():
+    """Circuit breaker state, call counters and latency histogram of the ModelLake client"""
+    return jsonify(model_client.stats())
+
+
+@REGISTRY.collector
+def collect_component_stats():
+    """Gauges and counters owned by the client, caches, sessions and job queue"""
+    client = model_client.stats()
+    yield ('medassist_modellake_events_total', 'counter', 'ModelLake client calls, retries and failures by kind',
+           {(name,): value for name, value in client["counters"].items()}, ('kind',))
+    yield ('medassist_modellake_breaker_open', 'gauge', '1 when the ModelLake circuit breaker is not closed',
+           {(): int(client["breaker"]["state"] != 'closed')}, ())
+    
+    cache = analysis_cache.stats()
+    yield ('medassist_analysis_cache_events_total', 'counter', 'Analysis cache hits, misses and evictions',
+           {(name,): cache[name] for name in analysis_cache.counters}, ('kind',))
+    yield ('medassist_analysis_cache_bytes', 'gauge', 'Bytes held by each analysis cache tier',
+           {('memory',): cache["memory_bytes"], ('disk',): cache["disk_bytes"]}, ('tier',))
+    
+    session_stats = sessions.stats()
+    for name in ('sessions', 'history_entries', 'history_bytes'):
+        yield (f'medassist_{name}', 'gauge', f'Current {name.replace("_", " ")}', {(): session_stats[name]}, ())
+    
+    if response_cache is not None:
+        responses = client["response_cache"]
+        yield ('medassist_response_cache_events_total', 'counter',
+               'ModelLake response cache hits by tier, misses, stores, evictions and prompts with personal values',
+               {(name,): responses[name] for name in ResponseCache.counters}, ('kind',))
+        yield ('medassist_response_cache_entries', 'gauge', 'Answers held by the ModelLake response cache',
+               {(): responses["entries"]}, ())
+    
+    render = render_cache_stats()
+    yield ('medassist_chat_render_cache_events_total', 'counter', 'Structured chat reply render cache hits and misses',
+           {(name,): render[name] for name in ('hits', 'misses')}, ('kind',))
+    
+    yield ('medassist_report_jobs_pending', 'gauge', 'Report analysis jobs queued or running in this process',
+           {(): report_jobs.pending()}, ())
+
+
+@api.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text exposition of this worker's metrics, or of all workers' with METRICS_DIR"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def create_app():
+    """Build the Flask app; clients, parsers and indexes are created on first use
+
+    Call warm_up() after forking workers to build them before the first request.
+    """
+    app = Flask(__name__)
+    app.request_class = UploadRequest
+    CORS(app)  # Enable CORS for all routes
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    # Request bodies over UPLOAD_MAX_BYTES are refused with 413 while they are read
+    app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('UPLOAD_MAX_BYTES', 100 * 1024 * 1024))
+    
+    # Request and stage latencies for /metrics; SERVER_TIMING=1 also returns them per response.
+    # With METRICS_DIR, workers share their values there so any worker serves the totals
+    metrics.init_app(app, server_timing=os.environ.get('SERVER_TIMING', '').lower() in ('1', 'true', 'yes'),
+                     shared_dir=os.environ.get('METRICS_DIR'),
+                     sync_interval=float(os.environ.get('METRICS_SYNC_INTERVAL', 5)))
+    app.register_blueprint(api)
+    if os.environ.get('WARM_UP', '').lower() in ('1', 'true', 'yes'):
+        warm_up()
+    return app
+
 
+app = create_app()
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+    # Development server only; production runs under gunicorn (see gunicorn.conf.py)
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', port=int(os.environ.get('PORT', 5000)))
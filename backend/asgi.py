@@ -0,0 +1,171 @@
+"""ASGI entry point with async versions of the model-bound endpoints.
+
+    hypercorn asgi:application --bind 0.0.0.0:5000 --workers 2
+
+POST /api/chat and POST /api/analyze-report are served by a Quart app. Uploads
+are extracted in the extraction process pool and ModelLake calls are awaited
+(ModelClient.chat_complete_async), so one worker can keep hundreds of requests
+waiting on the model without a thread each. The handlers, caches, sessions and
+job queue are the ones in app.py; only the request plumbing differs.
+
+Every other route (login, streaming, batch uploads, job status, /metrics) is
+passed through to the Flask app, which runs on the event loop's thread pool.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from hypercorn.middleware import AsyncioWSGIMiddleware
+from quart import Blueprint, Quart, Request, g, jsonify, request
+
+import metrics
+from app import (app as flask_app, GeneralQueryHandler, MedicalReportHandler, admission_check, chat_result,
+                 queue_report_job, upload_store, log)
+from lazy import warm_up
+from metrics import REQUEST_SECONDS, stage_timer
+from report_store import UploadError
+
+# Named like the Flask blueprint so both apps report the same endpoint labels
+api = Blueprint('api', __name__)
+
+# (method, path) pairs served by the async app
+ASYNC_ROUTES = {('POST', '/api/chat'), ('POST', '/api/analyze-report')}
+
+# Threads for blocking work: the Flask routes, session and cache lookups
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 32))
+
+
+@api.app_errorhandler(413)
+async def request_too_large(e):
+    return jsonify({"error": "Upload is too large"}), 413
+
+
+@api.app_errorhandler(UploadError)
+async def upload_rejected(e):
+    return jsonify({"error": str(e)}), e.status_code
+
+
+def rejection_response(rejection):
+    return jsonify({"error": rejection.error}), rejection.status_code, {"Retry-After": str(rejection.retry_after)}
+
+
+@api.route('/api/chat', methods=['POST'])
+async def chat():
+    token = request.headers.get('Authorization')
+    log.debug("chat_request", token=token)
+
+    if not await asyncio.to_thread(GeneralQueryHandler.verify_token, token):
+        return jsonify({"error": "Unauthorized"}), 401
+
+    rejection = await asyncio.to_thread(admission_check, token, 'chat')
+    if rejection:
+        return rejection_response(rejection)
+
+    data = await request.get_json()
+    user_question = data.get('message') if data else None
+
+    if not user_question or not user_question.strip():
+        return jsonify({"error": "Empty message"}), 400
+
+    # The replies are rule-based; history lives in the session store, which may be SQLite
+    result = await asyncio.to_thread(chat_result, token, user_question)
+    with stage_timer('serialize'):
+        return jsonify(result)
+
+
+@api.route('/api/analyze-report', methods=['POST'])
+async def analyze_report():
+    token = request.headers.get('Authorization')
+    log.debug("report_request", token=token)
+
+    if not await asyncio.to_thread(MedicalReportHandler.verify_token, token):
+        return jsonify({"error": "Unauthorized"}), 401
+
+    # Checked before the upload is read
+    rejection = await asyncio.to_thread(admission_check, token, 'report')
+    if rejection:
+        return rejection_response(rejection)
+
+    files = await request.files
+    try:
+        return await _analyze_upload(token, files)
+    finally:
+        # Parts that were not stored are still spooled in the upload folder
+        await asyncio.to_thread(upload_store.discard_spooled, files)
+
+
+async def _analyze_upload(token, files):
+    if 'file' not in files:
+        return jsonify({"error": "No file provided"}), 400
+
+    file = files['file']
+    if file.filename == '':
+        return jsonify({"error": "No file selected"}), 400
+
+    filename, digest, file_path = await asyncio.to_thread(MedicalReportHandler.store_upload, file)
+
+    # ?async=1 queues the analysis and returns a job id straight away
+    if request.args.get('async', '').lower() in ('1', 'true', 'yes'):
+        # Writes the job record, a SQLite insert with JOB_STORE=sqlite
+        body, status_code = await asyncio.to_thread(queue_report_job, token, filename, digest, file_path)
+        return jsonify(body), status_code
+
+    result, status_code = await MedicalReportHandler.analyze_stored_report_async(filename, digest, file_path)
+    with stage_timer('serialize'):
+        return jsonify(result), status_code
+
+
+class UploadRequest(Request):
+    """Spools uploaded files into the upload folder, like app.UploadRequest"""
+
+    def make_form_data_parser(self):
+        return self.form_data_parser_class(
+            upload_store.spool, charset=self.charset, errors=self.encoding_errors,
+            max_content_length=self.max_content_length, cls=self.parameter_storage_class)
+
+
+def create_async_app():
+    """Build the Quart app for ASYNC_ROUTES, configured like the Flask app"""
+    async_app = Quart(__name__)
+    async_app.request_class = UploadRequest
+    async_app.config['MAX_CONTENT_LENGTH'] = flask_app.config['MAX_CONTENT_LENGTH']
+    # ModelLake deadlines and the extraction time budget already bound each request
+    async_app.config['RESPONSE_TIMEOUT'] = None
+    async_app.register_blueprint(api)
+
+    @async_app.before_serving
+    async def _start_worker():
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix='asgi'))
+        if os.environ.get('WARM_UP_WORKERS', '1').lower() in ('1', 'true', 'yes'):
+            await asyncio.to_thread(warm_up)
+
+    @async_app.before_request
+    async def _start_request_timer():
+        g.request_started = time.perf_counter()
+        metrics.endpoint_label.set(request.endpoint or 'unknown')
+
+    @async_app.after_request
+    async def _finish_request(response):
+        started = g.get('request_started')
+        if started is not None:
+            REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=request.endpoint or 'unknown',
+                                    status=str(response.status_code))
+        # Same policy as CORS(app) on the Flask side; preflight requests are answered there
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        return response
+
+    return async_app
+
+
+async_app = create_async_app()
+wsgi_app = AsyncioWSGIMiddleware(flask_app, max_body_size=flask_app.config['MAX_CONTENT_LENGTH'])
+
+
+async def application(scope, receive, send):
+    """Send ASYNC_ROUTES (and lifespan events) to the Quart app, the rest to Flask"""
+    if scope['type'] == 'lifespan' or (scope['type'] == 'http' and (scope['method'], scope['path']) in ASYNC_ROUTES):
+        await async_app(scope, receive, send)
+    else:
+        await wsgi_app(scope, receive, send)
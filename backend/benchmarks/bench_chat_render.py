@@ -0,0 +1,72 @@
+"""Per-call cost of the replies to structured "Question: Answer" messages.
+
+Replays a synthetic log of the structured messages the UI sends after a fever,
+stomach or general opener and times the reply with the memoized keyword scans
+and templates, with both caches bypassed, and through the full chat handler.
+
+    python benchmarks/bench_chat_render.py --messages 5000 --out render.json
+    python benchmarks/compare.py base-render.json render.json
+"""
+import argparse
+import json
+
+from bench_pipeline import load_app, measure  # also puts the backend on sys.path
+
+import corpus
+
+
+def run(args):
+    app_module = load_app(0)
+    import chat_templates
+
+    handler = app_module.GeneralQueryHandler
+    token = app_module.app.test_client().post(
+        '/api/login', json={"username": "test", "password": "test123"}).get_json()["token"]
+    messages = corpus.structured_replies(args.messages, seed=args.seed)
+    answers = [handler.parse_structured_answers(message) for message in messages]
+
+    chat_templates.render_structured.cache_clear()
+    cached = measure([lambda a=a: handler.generate_structured_response(a) for a in answers])
+    stats = chat_templates.render_cache_stats()
+
+    intent = measure([lambda a=a: chat_templates.structured_intent(a) for a in answers])
+
+    # Cold path: every keyword scan and the string building done on each call
+    render = chat_templates.render_structured.__wrapped__
+
+    def cold_render(structured_answers):
+        chat_templates._terms.cache_clear()
+        return render(chat_templates.structured_intent(structured_answers))
+
+    uncached = measure([lambda a=a: cold_render(a) for a in answers])
+    handle = measure([lambda m=m: handler.handle_chat(token, m) for m in messages])
+
+    return {
+        "meta": {"messages": len(messages), "seed": args.seed, "distinct_intents": stats["size"],
+                 "render_cache_hit_rate": round(stats["hits"] / max(1, stats["hits"] + stats["misses"]), 4)},
+        "results": {
+            "chat.structured.cached": cached,
+            "chat.structured.uncached": uncached,
+            "chat.structured.intent": intent,
+            "chat.handle_chat.structured": handle,
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--out', help="write JSON results here (default: stdout)")
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    payload = json.dumps(run(args), indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+
+
+if __name__ == '__main__':
+    main()
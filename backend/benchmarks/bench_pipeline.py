@@ -0,0 +1,166 @@
+"""Latency and throughput benchmarks for the chat and report pipelines.
+
+Runs per-stage micro-benchmarks (rule-based chat, text extraction, rule-based
+report analysis) and end-to-end requests through the Flask test client
+against the local FakeModelLake, on a synthetic corpus. Results are written as
+JSON with sorted keys so two runs can be compared with a plain diff or with
+compare.py.
+
+Run from the backend directory:
+
+    python benchmarks/bench_pipeline.py --out bench.json
+    python benchmarks/bench_pipeline.py --quick --model-latency 0.2 --out head.json
+    python benchmarks/compare.py bench.json head.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import corpus  # noqa: E402
+
+
+def summarize(samples, wall_seconds):
+    """p50/p95/p99/mean latency in milliseconds plus requests per second"""
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    return {
+        "n": len(ordered),
+        "p50_ms": round(percentile(50), 4),
+        "p95_ms": round(percentile(95), 4),
+        "p99_ms": round(percentile(99), 4),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 4),
+        "rps": round(len(ordered) / wall_seconds, 2) if wall_seconds > 0 else None,
+    }
+
+
+def measure(calls, warmup=1):
+    """Time each zero-argument callable in calls; the first `warmup` are discarded"""
+    for call in calls[:warmup]:
+        call()
+    samples = []
+    started = time.perf_counter()
+    for call in calls[warmup:]:
+        t0 = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - t0)
+    return summarize(samples, time.perf_counter() - started)
+
+
+def iterations_for(pages, base):
+    return max(3, base // pages)
+
+
+def load_app(model_latency):
+    """Import the app against the fake ModelLake inside a scratch working directory"""
+    os.environ['MODELLAKE'] = 'fake'
+    os.environ['FAKE_MODELLAKE_LATENCY'] = str(model_latency)
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    # Every request uses one session, which the per-session limits would throttle
+    os.environ.setdefault('RATE_LIMIT', 'off')
+    os.chdir(tempfile.mkdtemp(prefix='medassist-bench-'))
+    import app
+    return app
+
+
+def run(args):
+    app_module = load_app(args.model_latency)
+    client = app_module.app.test_client()
+    token = client.post('/api/login', json={"username": "test", "password": "test123"}).get_json()["token"]
+    headers = {"Authorization": token}
+    results = {}
+
+    # Chat: replay synthetic transcripts through the handler and the endpoint
+    transcripts = corpus.chat_transcripts(args.chat_conversations, seed=args.seed)
+    messages = [message for conversation in transcripts for message in conversation]
+    handler = app_module.GeneralQueryHandler
+    results["chat.handle_chat"] = measure([lambda m=m: handler.handle_chat(token, m) for m in messages])
+    results["e2e.chat"] = measure(
+        [lambda m=m: client.post('/api/chat', json={"message": m}, headers=headers) for m in messages])
+
+    # Reports: per-stage costs for each format and size
+    report_dir = os.path.join(os.getcwd(), 'corpus')
+    reports = corpus.build_reports(report_dir, page_counts=args.pages, seed=args.seed)
+    report_handler = app_module.MedicalReportHandler
+    for (fmt, pages), path in sorted(reports.items()):
+        n = iterations_for(pages, args.iterations)
+        results[f"extract.{fmt}.{pages}p"] = measure(
+            [lambda: report_handler.extract_text_from_file(path)] * (n + 1))
+
+        if fmt == 'txt':
+            text = report_handler.extract_text_from_file(path)
+            results[f"analysis.fallback.{pages}p"] = measure(
+                [lambda: report_handler.generate_report_analysis(text, 'report.txt')] * (n + 1))
+
+    # End to end: cold uploads carry a unique trailer so they miss the analysis cache
+    for (fmt, pages), path in sorted(reports.items()):
+        if fmt == 'docx':
+            continue  # appending bytes would corrupt the zip container
+        with open(path, 'rb') as f:
+            body = f.read()
+        n = iterations_for(pages, args.iterations)
+
+        def upload(data, name=f"report.{fmt}"):
+            import io
+            response = client.post('/api/analyze-report', headers=headers,
+                                   data={"file": (io.BytesIO(data), name)},
+                                   content_type='multipart/form-data')
+            assert response.status_code == 200, response.get_data(as_text=True)
+
+        nonce = 'bench-' + str(time.time_ns())
+        trailer = (lambda i: f"\n%{nonce}-{i}\n".encode()) if fmt == 'pdf' else (lambda i: f"\n{nonce}-{i}".encode())
+        results[f"e2e.report.{fmt}.{pages}p.cold"] = measure(
+            [lambda i=i: upload(body + trailer(i)) for i in range(n + 1)])
+        results[f"e2e.report.{fmt}.{pages}p.warm"] = measure([lambda: upload(body)] * (n + 1))
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "model_latency_s": args.model_latency,
+            "pages": list(args.pages),
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--out', help="write JSON results here (default: stdout)")
+    parser.add_argument('--pages', type=int, nargs='+', default=[1, 10, 50, 200])
+    parser.add_argument('--quick', action='store_true', help="small corpus: 1 and 10 page reports, fewer chats")
+    parser.add_argument('--iterations', type=int, default=50, help="iterations for a 1-page report")
+    parser.add_argument('--chat-conversations', type=int, default=100)
+    parser.add_argument('--model-latency', type=float, default=0.05, help="FakeModelLake latency in seconds")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.pages = [1, 10]
+        args.iterations = 10
+        args.chat_conversations = 20
+    out_path = os.path.abspath(args.out) if args.out else None
+
+    report = run(args)
+    payload = json.dumps(report, indent=2, sort_keys=True)
+    if out_path:
+        with open(out_path, 'w') as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Cost of flagging a report's lab values as the reference-range table grows.
+
+Pads the shipped table with synthetic analytes up to each size and times the
+vectorized flagging of one report's values, and a full scan_lab_report of a
+synthetic page with the tokenizer rebuilt for that table, at every size.
+
+    python benchmarks/bench_reference_ranges.py --analytes 25 250 1000 --out ranges.json
+"""
+import argparse
+import json
+
+from bench_pipeline import measure  # also puts the backend on sys.path
+
+import corpus
+import lab_values
+from reference_ranges import RangeRow, ReferenceRanges
+
+
+def padded_table(base, analytes):
+    """The base table plus synthetic analytes with three sex/age rows each"""
+    rows = list(base.rows)
+    for i in range(max(0, analytes - len(base.analytes))):
+        name = f"analyte{i:05d}"
+        rows += [RangeRow(name, "mg/dL", "female", 18, float('inf'), 10, 20, ""),
+                 RangeRow(name, "mg/dL", "male", 18, float('inf'), 12, 24, ""),
+                 RangeRow(name, "mg/dL", "any", 0, 18, 8, 18, "")]
+    return ReferenceRanges(rows, base.conversions)
+
+
+def run(args):
+    base = lab_values.REFERENCE_RANGES
+    page = "\n".join(corpus.report_pages(1, seed=args.seed)[0]).lower()
+    values = lab_values.scan_lab_report(page).values
+    tests = [value.test for value in values]
+    numbers = [value.value for value in values]
+
+    results = {}
+    for size in args.analytes:
+        table = padded_table(base, size)
+        table.arrays()
+        results[f"reference_ranges.flag.{size}"] = measure(
+            [lambda: table.flag(tests, numbers, sex='female', age=52)] * (args.iterations + 1))
+        # The tokenizer grows with the table: every analyte name is an alternative
+        base_pattern = lab_values.LAB_TOKEN_PATTERN
+        lab_values.REFERENCE_RANGES, lab_values.LAB_TOKEN_PATTERN = table, lab_values.token_pattern(table.analytes)
+        try:
+            results[f"reference_ranges.scan_page.{size}"] = measure(
+                [lambda: lab_values.scan_lab_report(page)] * (args.iterations + 1))
+        finally:
+            lab_values.REFERENCE_RANGES, lab_values.LAB_TOKEN_PATTERN = base, base_pattern
+    return {"meta": {"values_per_report": len(tests), "seed": args.seed}, "results": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--out', help="write JSON results here (default: stdout)")
+    parser.add_argument('--analytes', type=int, nargs='+', default=[25, 250, 1000])
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    payload = json.dumps(run(args), indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Per-page cost of report type classification.
+
+Classifies synthetic report pages one at a time and as one batch, next to the
+first-match if/elif chain the classifier replaced, and counts how many pages
+each approach gives more than one label.
+
+    python benchmarks/bench_report_types.py --pages 2000 --out types.json
+"""
+import argparse
+import json
+import time
+
+from bench_pipeline import measure, summarize  # also puts the backend on sys.path
+
+import corpus
+from report_types import REPORT_TYPES, ReportTypeClassifier
+
+
+def elif_chain(text):
+    """The replaced detection: first type with any term as a substring"""
+    text_lower = text.lower()
+    for label, terms in REPORT_TYPES:
+        if any(term in text_lower for term in terms):
+            return [label]
+    return []
+
+
+def run(args):
+    classifier = ReportTypeClassifier()
+    pages = ["\n".join(page) for page in corpus.report_pages(args.pages, seed=args.seed)]
+
+    started = time.perf_counter()
+    batch = classifier.classify_many(pages)
+    batch_seconds = time.perf_counter() - started
+
+    return {
+        "meta": {"pages": len(pages), "seed": args.seed,
+                 "chars_per_page": round(sum(map(len, pages)) / len(pages)),
+                 "multi_label_pages": sum(len(labels) > 1 for labels in batch)},
+        "results": {
+            "report_types.classify": measure([lambda p=p: classifier.classify(p) for p in pages]),
+            "report_types.classify_many": summarize([batch_seconds / len(pages)] * len(pages), batch_seconds),
+            "report_types.elif_chain": measure([lambda p=p: elif_chain(p) for p in pages]),
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--out', help="write JSON results here (default: stdout)")
+    parser.add_argument('--pages', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    payload = json.dumps(run(args), indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+
+
+if __name__ == '__main__':
+    main()
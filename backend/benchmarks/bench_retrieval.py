@@ -0,0 +1,71 @@
+"""Lookup latency of the local retrieval index at a given number of chunks.
+
+Builds an index of synthetic report chunks, saves it, reopens it as a memory
+map and times single and batched top-k searches.
+
+    python benchmarks/bench_retrieval.py --chunks 100000 --out retrieval.json
+"""
+import argparse
+import json
+import os
+import tempfile
+
+from bench_pipeline import measure  # also puts the backend on sys.path
+
+import corpus
+import retrieval
+
+
+def run(args):
+    embedder = retrieval.HashingEmbedder(args.dim)
+    retrieval.load_reference_index(embedder)
+
+    # Embed a few thousand distinct chunks and repeat them up to the target size
+    lines = [line for page in corpus.report_pages(max(1, args.distinct // 10), seed=args.seed) for line in page]
+    chunks = retrieval.chunk_text("\n".join(lines), max_chars=400)[:args.distinct]
+    vectors = embedder.embed([chunk.text for chunk in chunks])
+    index = retrieval.VectorIndex(args.dim)
+    while len(index) < args.chunks:
+        take = min(len(chunks), args.chunks - len(index))
+        index.add(vectors[:take], chunks[:take])
+
+    directory = tempfile.mkdtemp(prefix='medassist-index-')
+    index.save(directory)
+    mapped = retrieval.VectorIndex.load(directory)
+
+    queries = embedder.embed(["glucose high", "hemoglobin low", "tsh high", "ldl high",
+                              "creatinine high", "platelets low", "wbc high", "hdl low"])
+    single = [lambda i=i: mapped.search(queries[i % len(queries)], args.k) for i in range(args.iterations + 1)]
+    batch = [lambda: mapped.search(queries, args.k)] * (args.iterations + 1)
+    return {
+        "meta": {"chunks": len(mapped), "dim": args.dim, "k": args.k,
+                 "index_bytes": os.path.getsize(os.path.join(directory, 'vectors.npy'))},
+        "results": {
+            "retrieval.search.1": measure(single),
+            f"retrieval.search.{len(queries)}": measure(batch),
+            "retrieval.embed_query": measure([lambda: embedder.embed(["glucose high"])] * (args.iterations + 1)),
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--out', help="write JSON results here (default: stdout)")
+    parser.add_argument('--chunks', type=int, default=100000)
+    parser.add_argument('--distinct', type=int, default=5000)
+    parser.add_argument('--dim', type=int, default=retrieval.DEFAULT_DIM)
+    parser.add_argument('-k', type=int, default=5)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    payload = json.dumps(run(args), indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Cold start: import time and time to the first requests, each run in a fresh process.
+
+Every run starts a new interpreter in a scratch directory, imports the app
+against the fake ModelLake, then times a login and chat request and a first
+PDF report upload (which loads the PDF parser). With --target-ms the script
+exits non-zero when the median import + first chat time is over the target.
+
+    python benchmarks/bench_startup.py --runs 10 --target-ms 1000
+    python benchmarks/bench_startup.py --warm-up   # WARM_UP=1: build clients at start
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_pipeline import BACKEND_DIR
+
+import corpus
+
+CHILD = r"""
+import io, json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+token = client.post('/api/login', json={"username": "test", "password": "test123"}).get_json()["token"]
+headers = {"Authorization": token}
+client.post('/api/chat', json={"message": "I have a headache"}, headers=headers)
+chatted = time.perf_counter()
+with open(sys.argv[1], 'rb') as f:
+    body = f.read()
+response = client.post('/api/analyze-report', headers=headers, data={"file": (io.BytesIO(body), "report.pdf")},
+                       content_type='multipart/form-data')
+assert response.status_code == 200, response.get_data(as_text=True)
+reported = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "first_chat_ms": (chatted - imported) * 1000,
+    "first_report_ms": (reported - chatted) * 1000,
+    "modules": len(sys.modules),
+}))
+"""
+
+
+def run_once(pdf_path, warm_up):
+    env = dict(os.environ, MODELLAKE='fake', FAKE_MODELLAKE_LATENCY='0', LOG_LEVEL='WARNING',
+               PYTHONPATH=BACKEND_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    if warm_up:
+        env['WARM_UP'] = '1'
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', CHILD, pdf_path], cwd=tempfile.mkdtemp(prefix='medassist-start-'),
+                            env=env, check=True, capture_output=True, text=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process_ms"] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    return ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--warm-up', action='store_true', help="set WARM_UP=1 in the child processes")
+    parser.add_argument('--target-ms', type=float, help="fail if median import + first chat exceeds this")
+    parser.add_argument('--out', help="write JSON results here (default: stdout)")
+    args = parser.parse_args(argv)
+
+    pdf_path = os.path.join(tempfile.mkdtemp(prefix='medassist-start-'), 'report.pdf')
+    corpus.write_pdf(pdf_path, corpus.report_pages(2))
+
+    runs = [run_once(pdf_path, args.warm_up) for _ in range(args.runs)]
+    results = {key: round(median([run[key] for run in runs]), 2) for key in runs[0]}
+    results["import_plus_first_chat_ms"] = round(median([run["import_ms"] + run["first_chat_ms"] for run in runs]), 2)
+    payload = json.dumps({"meta": {"runs": args.runs, "warm_up": args.warm_up, "python": sys.version.split()[0]},
+                          "results": results}, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+
+    if args.target_ms is not None and results["import_plus_first_chat_ms"] > args.target_ms:
+        print(f"cold start {results['import_plus_first_chat_ms']:.0f} ms is over the {args.target_ms:.0f} ms target",
+              file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
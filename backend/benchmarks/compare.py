@@ -0,0 +1,39 @@
+"""Compare two benchmark result files written by bench_pipeline.py.
+
+    python benchmarks/compare.py base.json head.json [--metric p95_ms]
+
+Prints one line per benchmark with both values and the head/base ratio;
+ratios above 1 mean the head run is slower.
+"""
+import argparse
+import json
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument('base')
+    parser.add_argument('head')
+    parser.add_argument('--metric', default='p50_ms')
+    args = parser.parse_args(argv)
+
+    with open(args.base) as f:
+        base = json.load(f)["results"]
+    with open(args.head) as f:
+        head = json.load(f)["results"]
+
+    width = max(len(name) for name in set(base) | set(head))
+    print(f"{'benchmark'.ljust(width)}  {'base':>12}  {'head':>12}  {'ratio':>7}")
+    for name in sorted(set(base) | set(head)):
+        before = base.get(name, {}).get(args.metric)
+        after = head.get(name, {}).get(args.metric)
+        if before and after:
+            ratio = f"{after / before:7.2f}"
+        else:
+            ratio = "      -"
+        before_text = f"{before:12.3f}" if before is not None else f"{'-':>12}"
+        after_text = f"{after:12.3f}" if after is not None else f"{'-':>12}"
+        print(f"{name.ljust(width)}  {before_text}  {after_text}  {ratio}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""Synthetic chat transcripts and lab reports for the benchmarks.
+
+Everything is generated from a seeded random source, so two runs with the
+same seed see exactly the same corpus.
+"""
+import os
+import random
+
+import docx
+
+CHAT_OPENERS = [
+    "I have a headache that won't go away",
+    "What causes stomach pain after eating?",
+    "Is my fever dangerous?",
+    "How can I reduce back pain?",
+    "I've been coughing for 3 days",
+    "Why am I short of breath?",
+    "My stomach hurts after meals",
+    "I've had migraines for a week",
+    "Why do I feel dizzy when standing?",
+    "I have an itchy rash on my arm",
+    "My joints hurt in cold weather",
+    "I feel tired all the time",
+]
+CHAT_FOLLOW_UPS = [
+    "It just started today",
+    "About a week now, it comes and goes",
+    "Yes, it is severe, maybe 8 out of 10",
+    "No, mild and constant",
+    "It gets worse after spicy food",
+    "My temperature is 102.5",
+    "For a month, after eating dairy",
+]
+STRUCTURED_REPLIES = [
+    "What is your temperature reading?: 101.2 F\n\n"
+    "Are you experiencing any other symptoms alongside the fever?: no\n\n"
+    "How long have you had the fever?: since today",
+    "How long have you been experiencing this pain?: two weeks\n\n"
+    "Is it constant or does it come and go?: comes and goes\n\n"
+    "Have you noticed any specific foods triggering it?: spicy and fried food",
+]
+
+# name, unit, typical low, typical high
+ANALYTES = [
+    ("Hemoglobin", "g/dL", 10.0, 18.0),
+    ("Hematocrit", "%", 32.0, 54.0),
+    ("RBC", "million/uL", 3.8, 6.5),
+    ("WBC", "cells/uL", 3000, 14000),
+    ("Platelets", "/uL", 120000, 480000),
+    ("Cholesterol", "mg/dL", 140, 280),
+    ("LDL", "mg/dL", 60, 190),
+    ("HDL", "mg/dL", 30, 80),
+    ("Triglycerides", "mg/dL", 70, 300),
+    ("ALT", "U/L", 5, 90),
+    ("AST", "U/L", 5, 70),
+    ("Creatinine", "mg/dL", 0.4, 1.8),
+    ("BUN", "mg/dL", 5, 30),
+    ("eGFR", "mL/min", 40, 120),
+    ("Glucose", "mg/dL", 60, 180),
+    ("HbA1c", "%", 4.5, 8.5),
+    ("TSH", "uIU/mL", 0.2, 6.0),
+    ("T4", "ug/dL", 4.0, 13.0),
+    ("T3", "ng/dL", 70, 210),
+]
+NARRATIVE = [
+    "The specimen was received in good condition and processed within the stability window.",
+    "Results should be interpreted in the context of the clinical history.",
+    "The glucose level is elevated compared with the previous visit.",
+    "Urine appears negative for protein and ketones.",
+    "Ultrasound of the abdomen shows normal liver echotexture.",
+    "The lipid profile was high at the previous screening.",
+]
+LINES_PER_PAGE = 40
+
+
+def chat_transcripts(count, turns=4, seed=0):
+    """Return a list of conversations, each a list of user messages"""
+    rng = random.Random(seed)
+    transcripts = []
+    for _ in range(count):
+        messages = [rng.choice(CHAT_OPENERS)]
+        for _ in range(turns - 1):
+            messages.append(rng.choice(CHAT_FOLLOW_UPS + STRUCTURED_REPLIES))
+        transcripts.append(messages)
+    return transcripts
+
+
+# Questions the UI asks after a fever or stomach opener, with typical typed answers
+STRUCTURED_QUESTIONS = {
+    "fever": [
+        ("What is your temperature reading?", ["101.2 F", "99.5", "100.4 F", "102", "103.1", "104 F", "38.5 C", "not sure"]),
+        ("Are you experiencing any other symptoms alongside the fever?", ["no", "none", "not really", "yes, a cough",
+                                                                         "headache and chills"]),
+        ("How long have you had the fever?", ["since today", "it just started", "two days", "about a week"]),
+    ],
+    "stomach": [
+        ("How long have you been experiencing this pain?", ["since today", "a day or two", "two weeks", "a few months",
+                                                            "over a year"]),
+        ("Is it constant or does it come and go?", ["constant", "comes and goes", "after I eat", "only at night"]),
+        ("Have you noticed any specific foods triggering it?", ["spicy and fried food", "fatty meals", "milk and cheese",
+                                                                "dairy", "nothing in particular"]),
+    ],
+    "general": [
+        ("Where is the rash or ache?", ["my arm", "lower back", "all over"]),
+        ("Do you also have nausea or a cough?", ["no", "some nausea", "a dry cough"]),
+    ],
+}
+
+
+def structured_replies(count, seed=0):
+    """Return count structured "Question: Answer" messages as the UI sends them"""
+    rng = random.Random(seed)
+    replies = []
+    for _ in range(count):
+        questions = STRUCTURED_QUESTIONS[rng.choice(list(STRUCTURED_QUESTIONS))]
+        replies.append("\n\n".join(f"{question}: {rng.choice(answers)}" for question, answers in questions))
+    return replies
+
+
+def report_pages(pages, seed=0):
+    """Return the text lines of a lab report, one list of lines per page"""
+    rng = random.Random(seed)
+    result = []
+    for page in range(pages):
+        lines = [f"City Lab Services - Patient Report - Page {page + 1}"]
+        while len(lines) < LINES_PER_PAGE:
+            if rng.random() < 0.2:
+                lines.append(rng.choice(NARRATIVE))
+            else:
+                name, unit, low, high = rng.choice(ANALYTES)
+                value = rng.uniform(low, high)
+                formatted = f"{value:,.0f}" if value >= 1000 else f"{value:.1f}"
+                lines.append(f"{name}: {formatted} {unit}")
+        result.append(lines)
+    return result
+
+
+def _pdf_escape(line):
+    return line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def write_pdf(path, pages):
+    """Write a minimal text PDF (Helvetica, one content stream per page)"""
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(None)
+    page_tree = add(None)
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    page_ids = []
+    for lines in pages:
+        commands = ["BT", "/F1 10 Tf", "12 TL", "50 780 Td"]
+        for line in lines:
+            commands.append(f"({_pdf_escape(line)}) Tj T*")
+        commands.append("ET")
+        stream = "\n".join(commands).encode('latin-1', 'replace')
+        content = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_ids.append(add(
+            f"<< /Type /Page /Parent {page_tree} 0 R /MediaBox [0 0 612 792] "
+            f"/Contents {content} 0 R /Resources << /Font << /F1 {font} 0 R >> >> >>".encode()))
+    objects[catalog - 1] = f"<< /Type /Catalog /Pages {page_tree} 0 R >>".encode()
+    kids = " ".join(f"{pid} 0 R" for pid in page_ids)
+    objects[page_tree - 1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    with open(path, 'wb') as f:
+        f.write(out)
+
+
+def write_docx(path, pages):
+    document = docx.Document()
+    for lines in pages:
+        for line in lines:
+            document.add_paragraph(line)
+    document.save(path)
+
+
+def write_txt(path, pages):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(line for lines in pages for line in lines))
+
+
+WRITERS = {'pdf': write_pdf, 'docx': write_docx, 'txt': write_txt}
+
+
+def build_reports(directory, page_counts=(1, 10, 50, 200), formats=('pdf', 'docx', 'txt'), seed=0):
+    """Write one report per (format, page count); return {(format, pages): path}"""
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for pages in page_counts:
+        content = report_pages(pages, seed=seed + pages)
+        for fmt in formats:
+            path = os.path.join(directory, f"report_{pages}p.{fmt}")
+            WRITERS[fmt](path, content)
+            paths[(fmt, pages)] = path
+    return paths
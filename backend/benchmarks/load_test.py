@@ -0,0 +1,176 @@
+"""Load test of the production server at several worker counts.
+
+Starts gunicorn with gunicorn.conf.py against the fake ModelLake for each
+worker count, drives concurrent chat messages and report uploads over HTTP,
+and reports throughput and latency percentiles per worker count. Every
+upload carries unique text so it misses the analysis cache and reaches the
+model.
+
+    python benchmarks/load_test.py --workers 1 2 4 --clients 32 --requests 400
+    python benchmarks/load_test.py --profile cpu --model-latency 0 --out load.json
+    python benchmarks/load_test.py --app asgi --workers 1    # uvicorn workers, async endpoints
+"""
+import argparse
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_pipeline import BACKEND_DIR, summarize
+
+import corpus
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def request(port, method, path, body=None, headers=None):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    try:
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+def wait_until_up(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {process.returncode}")
+        try:
+            request(port, 'GET', '/metrics')
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("gunicorn did not start in time")
+
+
+def start_server(workers, args):
+    port = free_port()
+    workdir = tempfile.mkdtemp(prefix='medassist-load-')
+    env = dict(os.environ, MODELLAKE='fake', FAKE_MODELLAKE_LATENCY=str(args.model_latency), LOG_LEVEL='WARNING',
+               WEB_CONCURRENCY=str(workers), SERVING_PROFILE=args.profile, BIND=f"127.0.0.1:{port}",
+               PYTHONPATH=BACKEND_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    # All requests share one session, which the per-session limits would throttle
+    env.setdefault('RATE_LIMIT', 'off')
+    if args.threads:
+        env['GUNICORN_THREADS'] = str(args.threads)
+    if args.app == 'asgi':
+        env['GUNICORN_WORKER_CLASS'] = 'uvicorn.workers.UvicornWorker'
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(BACKEND_DIR, 'gunicorn.conf.py'),
+         f"{args.app}:application"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    wait_until_up(port, process)
+    return process, port
+
+
+def multipart(filename, content):
+    boundary = uuid.uuid4().hex
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n"
+            f"Content-Type: text/plain\r\n\r\n").encode() + content + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def run_workload(port, args):
+    status, body = request(port, 'POST', '/api/login', json.dumps({"username": "test", "password": "test123"}),
+                           {"Content-Type": "application/json"})
+    token = json.loads(body)["token"]
+    messages = [m for conversation in corpus.chat_transcripts(args.requests, seed=args.seed) for m in conversation]
+    report_text = "\n".join(corpus.report_pages(1, seed=args.seed)[0])
+    nonce = uuid.uuid4().hex
+
+    def chat(i):
+        return request(port, 'POST', '/api/chat', json.dumps({"message": messages[i % len(messages)]}),
+                       {"Content-Type": "application/json", "Authorization": token})[0]
+
+    def report(i):
+        body, content_type = multipart("report.txt", f"{report_text}\nload-{nonce}-{i}".encode())
+        return request(port, 'POST', '/api/analyze-report', body,
+                       {"Content-Type": content_type, "Authorization": token})[0]
+
+    every = max(1, round(1 / args.report_share)) if args.report_share > 0 else 0
+    calls = [(report if every and i % every == 0 else chat, i) for i in range(args.requests)]
+    samples = {"chat": [], "report": []}
+    errors = 0
+
+    def timed(call):
+        func, i = call
+        started = time.perf_counter()
+        status = func(i)
+        return func.__name__, status, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        for kind, status, seconds in pool.map(timed, calls):
+            samples[kind].append(seconds)
+            errors += status != 200
+    wall = time.perf_counter() - started
+
+    result = {"all": summarize(samples["chat"] + samples["report"], wall), "errors": errors}
+    for kind, values in samples.items():
+        if values:
+            result[kind] = summarize(values, wall)
+    return result
+
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, help="threads per worker (default: from the serving profile)")
+    parser.add_argument('--profile', choices=['io', 'cpu'], default='io')
+    parser.add_argument('--app', choices=['wsgi', 'asgi'], default='wsgi', help="entry point to serve")
+    parser.add_argument('--clients', type=int, default=32, help="concurrent client connections")
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--report-share', type=float, default=0.2, help="fraction of requests that are uploads")
+    parser.add_argument('--model-latency', type=float, default=0.2, help="FakeModelLake latency in seconds")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help="write JSON results here (default: stdout)")
+    args = parser.parse_args(argv)
+
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        sys.exit("gunicorn is not installed: pip install -r requirements.txt")
+
+    results = {}
+    for workers in args.workers:
+        process, port = start_server(workers, args)
+        try:
+            results[f"workers_{workers}"] = run_workload(port, args)
+        finally:
+            stop_server(process)
+
+    payload = json.dumps({"meta": {"app": args.app, "cpus": os.cpu_count(), "profile": args.profile, "threads": args.threads,
+                                   "clients": args.clients, "requests": args.requests,
+                                   "report_share": args.report_share, "model_latency_s": args.model_latency},
+                          "results": results}, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+
+
+if __name__ == '__main__':
+    main()
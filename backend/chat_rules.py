@@ -0,0 +1,246 @@
+"""Declarative keyword rules for the rule-based chat responder.
+
+Every keyword used by the chat rules is compiled once, at import, into a single
+regular expression, so a message is scanned in one pass no matter how many
+rules there are. Rules are listed in priority order: the first rule of a stage
+whose keyword groups are satisfied wins, exactly like the old if/elif chains.
+"""
+import re
+from collections import namedtuple
+
+# require: tuple of keyword groups, each group needs at least one keyword present
+# exclude: keywords that must all be absent for the rule to fire
+Rule = namedtuple('Rule', ['name', 'stage', 'require', 'exclude', 'response'])
+RuleHit = namedtuple('RuleHit', ['priority', 'rule', 'offset'])
+
+
+class KeywordMatcher:
+    """Finds every keyword occurring as a substring of a text in a single pass"""
+
+    def __init__(self, keywords):
+        # Longest alternative first: at each position the lookahead reports the
+        # longest keyword starting there, and any shorter keyword starting at the
+        # same position must be a prefix of it.
+        self.keywords = sorted(set(keywords), key=lambda k: (-len(k), k))
+        alternation = '|'.join(re.escape(k) for k in self.keywords)
+        self.pattern = re.compile(f'(?=({alternation}))')
+        self.prefixes = {
+            keyword: [k for k in self.keywords if keyword.startswith(k)]
+            for keyword in self.keywords
+        }
+
+    def scan(self, text):
+        """Return a {keyword: first offset} dict for every keyword found in text"""
+        found = {}
+        for match in self.pattern.finditer(text):
+            for keyword in self.prefixes[match.group(1)]:
+                if keyword not in found:
+                    found[keyword] = match.start()
+        return found
+
+
+def rule_hits(found, stage=None):
+    """Return every rule satisfied by the scanned keywords, in priority order"""
+    hits = []
+    for priority, rule in enumerate(CHAT_RULES):
+        if stage is not None and rule.stage != stage:
+            continue
+        if any(keyword in found for keyword in rule.exclude):
+            continue
+        offsets = []
+        for group in rule.require:
+            group_offsets = [found[keyword] for keyword in group if keyword in found]
+            if not group_offsets:
+                break
+            offsets.append(min(group_offsets))
+        else:
+            hits.append(RuleHit(priority, rule, min(offsets) if offsets else None))
+    return hits
+
+
+def first_rule(found, stage):
+    """Return the highest-priority rule of a stage that fires, or None"""
+    hits = rule_hits(found, stage)
+    return hits[0].rule if hits else None
+
+
+def _category(keyword, response):
+    return Rule(keyword, 'category', ((keyword,),), (), response)
+
+
+STOMACH_TERMS = ('stomach', 'digest')
+HEADACHE_TERMS = ('headache', 'migraine')
+
+CHAT_RULES = [
+    # Health category questions, checked in this order
+    # Respiratory questions
+    _category("cough", "I understand you're asking about a cough. To provide the most helpful information:\n\n1. How long have you been coughing?\n2. Is your cough dry or productive (bringing up mucus)?\n3. Have you noticed any specific triggers for your cough?"),
+    _category("breathing", "I understand you're having breathing concerns. To better understand your situation:\n\n1. When did you first notice difficulty breathing?\n2. Does it happen during specific activities or all the time?\n3. Have you experienced this before?"),
+    _category("shortness of breath", "I understand you're experiencing shortness of breath. Let me help you better:\n\n1. When did this shortness of breath start?\n2. Does it occur at rest, with activity, or both?\n3. Is it associated with any other symptoms like chest pain or dizziness?"),
+
+    # Digestive questions
+    _category("stomach", "About your stomach concern, I'd like to understand more:\n\n1. How long have you been experiencing this discomfort?\n2. Is the pain constant or does it come and go?\n3. Have you noticed any connection to eating certain foods?"),
+    _category("nausea", "Regarding your nausea, to help you better:\n\n1. How long have you been feeling nauseated?\n2. Have you vomited or just felt nauseated?\n3. Have you identified any triggers for this feeling?"),
+    _category("acid reflux", "About your acid reflux concern:\n\n1. How often do you experience acid reflux symptoms?\n2. Do you notice them at any particular time (after meals, when lying down)?\n3. Have you tried any remedies so far?"),
+
+    # Neurological questions
+    _category("headache", "To help with your headache concern:\n\n1. How long have you been experiencing these headaches?\n2. Where in your head do you feel the pain?\n3. How would you rate the intensity from 1-10?"),
+    _category("migraine", "Regarding your migraine question:\n\n1. How frequently do you experience migraines?\n2. Do you notice any warning signs before they start?\n3. What triggers have you identified, if any?"),
+    _category("dizziness", "About your dizziness concern:\n\n1. When did you first notice feeling dizzy?\n2. Would you describe it more as lightheadedness or a spinning sensation?\n3. Is it constant or does it come in episodes?"),
+
+    # Skin questions
+    _category("rash", "Regarding your rash question:\n\n1. Where on your body is the rash located?\n2. How long have you had this rash?\n3. Is it itchy, painful, or neither?"),
+    _category("itchy skin", "About your itchy skin:\n\n1. How long have you been experiencing itchiness?\n2. Is it limited to one area or all over your body?\n3. Have you noticed any visible changes to your skin?"),
+    _category("eczema", "Regarding your eczema question:\n\n1. Which parts of your body are affected?\n2. How long have you been dealing with this?\n3. Have you identified any triggers that worsen your symptoms?"),
+
+    # Musculoskeletal questions
+    _category("joint pain", "About your joint pain:\n\n1. Which joints are affected?\n2. How long have you been experiencing this pain?\n3. Does anything seem to improve or worsen the pain?"),
+    _category("back pain", "Regarding your back pain:\n\n1. Where exactly in your back is the pain located?\n2. How long have you been experiencing it?\n3. Would you describe the pain as sharp, dull, or aching?"),
+    _category("muscle", "About your muscle concern:\n\n1. Which muscles are affected?\n2. How long have you been experiencing this issue?\n3. Is the discomfort constant or only during certain activities?"),
+
+    # Diagnostic follow-ups once the user has answered our questions.
+    # A stomach message that matches none of the stomach rules does not fall
+    # through to the headache/fever rules, hence the exclusions.
+    Rule('stomach_recent_after_meal', 'follow_up',
+         (STOMACH_TERMS, ('day', 'just started'), ('after',), ('meal', 'eating')), (),
+         "Based on what you've shared about your stomach pain being recent and occurring after meals, "
+         "this suggests you may be experiencing indigestion or possibly gastritis. Indigestion is common "
+         "and can be triggered by certain foods, eating too quickly, or stress.\n\n"
+         "Here are some approaches that might help:\n"
+         "1. Try eating smaller, more frequent meals\n"
+         "2. Avoid spicy, fatty, or acidic foods temporarily\n"
+         "3. Consider over-the-counter antacids for temporary relief\n\n"
+         "If the pain is severe, persistent beyond a few days, or accompanied by fever, vomiting, or blood in stool, "
+         "please seek medical attention promptly."),
+    Rule('stomach_recent', 'follow_up',
+         (STOMACH_TERMS, ('day', 'just started')), (),
+         "Based on your description of recent stomach discomfort, there are several potential causes including "
+         "gastritis, food intolerance, or a mild stomach virus. Since this is a recent onset, it may resolve on its own "
+         "with basic care.\n\n"
+         "I recommend:\n"
+         "1. Staying hydrated with clear fluids\n"
+         "2. Eating bland foods like rice, toast, or bananas\n"
+         "3. Resting and monitoring your symptoms\n\n"
+         "If symptoms worsen, persist beyond 48 hours, or if you develop fever or vomiting, please consult a healthcare provider."),
+    Rule('stomach_chronic', 'follow_up',
+         (STOMACH_TERMS, ('week', 'month', 'chronic', 'long time')), (),
+         "The stomach pain you've been experiencing for an extended period could indicate a chronic condition "
+         "such as irritable bowel syndrome (IBS), gastroesophageal reflux disease (GERD), or food sensitivities. "
+         "Persistent symptoms should be evaluated by a healthcare provider.\n\n"
+         "In the meantime, consider:\n"
+         "1. Keeping a food diary to identify potential trigger foods\n"
+         "2. Managing stress through relaxation techniques\n"
+         "3. Avoiding alcohol, caffeine, and spicy foods\n\n"
+         "Given the chronic nature of your symptoms, I strongly recommend scheduling an appointment with a "
+         "gastroenterologist for proper diagnosis and treatment."),
+    Rule('headache_severe', 'follow_up',
+         (HEADACHE_TERMS, ('severe', '8', '9', '10')), STOMACH_TERMS,
+         "The severe headache you've described is concerning. Based on your description, this could be a migraine "
+         "or tension headache, but severe headaches can sometimes indicate more serious conditions.\n\n"
+         "For immediate relief:\n"
+         "1. Rest in a dark, quiet room\n"
+         "2. Apply a cold compress to your forehead or neck\n"
+         "3. Consider appropriate over-the-counter pain relievers if not contraindicated for you\n\n"
+         "Given the severity you've described, I recommend consulting with a healthcare provider soon, especially if this "
+         "is a new or 'worst headache of your life' or if accompanied by fever, stiff neck, or confusion."),
+    Rule('headache_mild', 'follow_up',
+         (HEADACHE_TERMS,), STOMACH_TERMS,
+         "Based on your description, you appear to be experiencing a tension-type headache or mild migraine. "
+         "These are common and often triggered by stress, dehydration, poor sleep, or eye strain.\n\n"
+         "Here are some strategies that might help:\n"
+         "1. Ensure you're staying hydrated throughout the day\n"
+         "2. Take regular breaks from screens and practice the 20-20-20 rule (every 20 minutes, look at something 20 feet away for 20 seconds)\n"
+         "3. Practice relaxation techniques like deep breathing or gentle neck stretches\n"
+         "4. Consider over-the-counter pain relievers if appropriate for you\n\n"
+         "If these headaches become more frequent or severe, please consult a healthcare provider."),
+    Rule('fever_high', 'follow_up',
+         (('fever',), ('102', '103', '104')), STOMACH_TERMS + HEADACHE_TERMS,
+         "With a temperature reading this high (over 102°F), you're experiencing a significant fever that requires attention. "
+         "This level of fever suggests your body is fighting an infection, which could be viral or bacterial.\n\n"
+         "Immediate steps to take:\n"
+         "1. Stay well-hydrated with water or electrolyte drinks\n"
+         "2. Use appropriate fever-reducing medication (acetaminophen or ibuprofen) if not contraindicated for you\n"
+         "3. Rest and monitor your temperature\n\n"
+         "A fever this high warrants medical attention, especially if it persists for more than 24 hours or is accompanied by "
+         "severe headache, rash, confusion, persistent vomiting, or difficulty breathing. Please contact a healthcare provider today."),
+    Rule('fever_low', 'follow_up',
+         (('fever',),), STOMACH_TERMS + HEADACHE_TERMS,
+         "Based on what you've shared, you have a low-grade fever. This is often your body's natural response to fighting "
+         "a mild infection, most commonly viral.\n\n"
+         "Here's what I recommend:\n"
+         "1. Rest and get plenty of fluids\n"
+         "2. Monitor your temperature over the next 24-48 hours\n"
+         "3. Use acetaminophen or ibuprofen as directed if you're uncomfortable\n\n"
+         "If your fever persists beyond 3 days, rises above 102°F (39°C), or is accompanied by severe symptoms like difficulty "
+         "breathing or confusion, please seek medical care promptly."),
+
+    # Common symptoms when the message is not a follow-up
+    Rule('stomach_pain', 'symptom',
+         (('stomach',), ('ache', 'pain', 'hurt', 'issue')), (),
+         "I understand you're experiencing stomach pain. This can be caused by various factors "
+         "including indigestion, gas, or more serious conditions. To help me understand better:\n\n"
+         "1. How long have you been experiencing this pain?\n"
+         "2. Is it constant or does it come and go?\n"
+         "3. Have you noticed any specific foods triggering it?\n\n"
+         "While I can provide some general guidance, it's important to consult with a healthcare provider "
+         "if the pain is severe, persistent, or accompanied by other concerning symptoms."),
+    Rule('head_pain', 'symptom',
+         (('head',), ('ache', 'pain', 'hurt', 'migraine')), (),
+         "I'm sorry to hear you're dealing with a headache. Headaches can have various causes including stress, "
+         "dehydration, lack of sleep, or eye strain. To better understand your situation:\n\n"
+         "1. How long have you had this headache?\n"
+         "2. How would you rate the pain from 1-10?\n"
+         "3. Have you tried any remedies already?\n\n"
+         "Remember, while I can offer general information, persistent or severe headaches should be evaluated by a healthcare professional."),
+    Rule('fever', 'symptom',
+         (('fever',),), (),
+         "I see you've mentioned having a fever. Fevers are often your body's natural response to infection. "
+         "To help me understand your situation better:\n\n"
+         "1. What is your temperature reading?\n"
+         "2. Are you experiencing any other symptoms alongside the fever?\n"
+         "3. How long have you had the fever?\n\n"
+         "While I can provide general guidance, please remember that I'm not a substitute for professional medical advice, "
+         "especially for fevers that are high, persistent, or accompanied by other concerning symptoms."),
+    Rule('respiratory', 'symptom',
+         (('cough', 'cold', 'flu'),), (),
+         "I understand you're experiencing respiratory symptoms. These could be related to a cold, flu, or other "
+         "respiratory conditions. To better understand your specific situation:\n\n"
+         "1. How long have you been experiencing these symptoms?\n"
+         "2. Is your cough dry or productive (producing mucus)?\n"
+         "3. Do you have other symptoms like fever, body aches, or fatigue?\n\n"
+         "While I can provide general information, these symptoms can vary widely in cause and treatment, so consulting "
+         "with a healthcare provider is recommended for proper diagnosis and care."),
+    # For any other query, return a generic response
+    Rule('generic', 'symptom', (), (),
+         "Thank you for sharing your health concern. To help me understand your situation better and provide more relevant information, could you please:\n\n"
+         "1. Tell me more about when these symptoms started?\n"
+         "2. Describe any specific patterns or triggers you've noticed?\n"
+         "3. Mention any remedies you've already tried?\n\n"
+         "While I'm here to provide health information, please remember that I cannot replace professional medical advice. "
+         "If your symptoms are severe, persistent, or concerning, I'd recommend consulting with a healthcare provider."),
+]
+
+# Markers of a previous bot message that asked the user questions (case-sensitive)
+BOT_QUESTION_MARKERS = ("1.", "2.", "3.", "how long", "rate the pain")
+
+# Terms in a user reply that indicate it answers those questions
+FOLLOW_UP_ANSWER_TERMS = ("just started", "day", "week", "month", "constant", "comes and goes",
+                          "yes", "no", "mild", "moderate", "severe", "spicy", "dairy")
+
+# Vocabulary used when reading structured "Question: Answer" replies
+STRUCTURED_TERMS = (
+    'fever', 'temperature', 'other symptoms', 'long', 'duration', 'pain', 'digest',
+    'constant', 'come and go', 'food', 'trigger', 'today', 'just started', 'year',
+    'come', 'go', 'eat', 'spicy', 'fatty', 'fried', 'dairy', 'milk', 'cheese', 'lactose',
+    '99', '100', '105',
+)
+HIGH_FEVER_TERMS = ('102', '103', '104', '105')
+MILD_FEVER_TERMS = ('99', '100')
+CONDITION_TERMS = ("pain", "ache", "discomfort", "fever", "cough", "headache", "rash", "nausea")
+
+CHAT_MATCHER = KeywordMatcher(
+    [kw for rule in CHAT_RULES for group in rule.require for kw in group]
+    + [kw for rule in CHAT_RULES for kw in rule.exclude]
+    + list(BOT_QUESTION_MARKERS) + list(FOLLOW_UP_ANSWER_TERMS)
+    + list(STRUCTURED_TERMS) + list(CONDITION_TERMS)
+)
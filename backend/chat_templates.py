@@ -0,0 +1,229 @@
+"""Reply templates for structured "Question: Answer" messages from the UI.
+
+A structured reply is reduced to a StructuredIntent: the topic and the few
+features of the answers the reply depends on (temperature band, duration
+bucket, pain pattern, trigger foods). The reply text is assembled from the
+fixed sentences below and only depends on the intent, so rendering is memoized
+in a bounded LRU and repeat intents return the cached string.
+"""
+import os
+from collections import namedtuple
+from functools import lru_cache
+
+from chat_rules import CHAT_MATCHER, CONDITION_TERMS, HIGH_FEVER_TERMS, MILD_FEVER_TERMS
+
+# topic: 'fever', 'stomach' or 'general'
+# temperature: the temperature answer as typed, quoted back in fever replies
+# temperature_band: 'high', 'mild', 'other' or None without a temperature answer
+# duration: 'today' (fever); 'short' or 'long' (stomach); None otherwise
+# pattern: 'constant', 'intermittent' or 'after_meals'
+# trigger: 'spicy_fatty' or 'dairy'
+# conditions: condition keywords named in the questions (general replies)
+StructuredIntent = namedtuple('StructuredIntent', [
+    'topic', 'temperature', 'temperature_band', 'duration', 'other_symptoms', 'pattern', 'trigger', 'conditions',
+])
+
+RENDER_CACHE_SIZE = int(os.environ.get('CHAT_RENDER_CACHE_SIZE', 1024))
+# The UI asks a handful of fixed questions and many answers repeat ("no", "since today")
+TERMS_CACHE_SIZE = 4 * RENDER_CACHE_SIZE
+
+NO_OTHER_SYMPTOMS = ('no', 'none', 'not really')
+SHORT_DURATION_TERMS = ('today', 'day', 'just started')
+LONG_DURATION_TERMS = ('week', 'month', 'year')
+SPICY_FATTY_TERMS = ('spicy', 'fatty', 'fried')
+DAIRY_TERMS = ('dairy', 'milk', 'cheese', 'lactose')
+MEAL_TERMS = ('eat', 'food', 'meal')
+
+FEVER_OPENING = "Thank you for providing those details about your fever. "
+FEVER_BAND = {
+    'high': "A temperature of {reading} is considered a high fever. ",
+    'mild': "A temperature of {reading} is considered a low-grade fever. ",
+    'other': "Based on the temperature reading of {reading}, ",
+}
+# (band, duration) -> advice after the temperature sentence
+FEVER_ADVICE = {
+    ('high', 'today'): "Even though it just started today, this temperature is concerning and should be monitored closely. "
+                       "I recommend contacting a healthcare provider soon. ",
+    ('high', None): "This is concerning, especially if it has persisted. "
+                    "I recommend contacting a healthcare provider soon. ",
+    ('mild', 'today'): "Since it just started today, you can monitor it for now. ",
+    ('mild', None): "It's generally not a major concern but worth monitoring. ",
+}
+FEVER_WITH_SYMPTOMS = (
+    "The presence of other symptoms alongside your fever could indicate an infection or illness. "
+    "Have you noticed if anything specific triggers or worsens these symptoms? "
+)
+FEVER_ALONE = (
+    "A fever without other symptoms might be your body's initial response to an infection. "
+    "Are you staying hydrated and getting enough rest? "
+)
+FEVER_CLOSING = (
+    "\nFor fever management, you can:\n"
+    "1. Stay well-hydrated with water or electrolyte drinks\n"
+    "2. Rest as much as possible\n"
+    "3. Use appropriate over-the-counter fever reducers like acetaminophen if needed\n\n"
+    "Please remember that I'm providing general information and not medical advice. If your fever exceeds 103°F (39.4°C), "
+    "persists for more than three days, or is accompanied by severe symptoms, please seek medical attention."
+)
+
+STOMACH_OPENING = "Thank you for providing those details about your stomach pain. "
+STOMACH_DURATION = {
+    'short': "Since the pain just started recently, it could be related to something you ate or a brief digestive issue. ",
+    'long': "The fact that you've been experiencing this pain for some time suggests it may be a chronic condition. "
+            "It would be important to consult with a gastroenterologist. ",
+}
+STOMACH_PATTERN = {
+    'constant': "Constant pain that doesn't subside is worth discussing with a healthcare provider as it might indicate "
+                "inflammation or irritation. ",
+    'intermittent': "Pain that comes and goes is common with various digestive issues like gas, indigestion, or even "
+                    "conditions like IBS. ",
+    'after_meals': "Pain that occurs after eating could be related to food sensitivities, gastritis, or other digestive "
+                   "processes. ",
+}
+STOMACH_TRIGGER = {
+    'spicy_fatty': "Spicy and fatty foods commonly trigger digestive discomfort for many people. "
+                   "Limiting these foods could help reduce symptoms. ",
+    'dairy': "Discomfort after consuming dairy might suggest lactose intolerance. "
+             "You might consider trying lactose-free alternatives. ",
+}
+STOMACH_CLOSING = (
+    "\nBased on what you've shared, here are some general recommendations:\n"
+    "1. Keep a food diary to identify potential trigger foods\n"
+    "2. Consider smaller, more frequent meals rather than large ones\n"
+    "3. Stay hydrated throughout the day\n"
+    "4. Avoid lying down immediately after eating\n\n"
+    "Would you like me to provide more specific information about managing stomach discomfort? "
+    "Remember, persistent or severe symptoms should always be evaluated by a healthcare professional."
+)
+
+GENERAL_OPENING = (
+    "Thank you for providing those detailed answers. This information helps me understand your situation better. "
+    "Based on what you've shared, it seems you're experiencing "
+)
+GENERAL_UNKNOWN = "some health concerns"
+GENERAL_CLOSING = (
+    "Could you share if anything seems to improve or worsen your symptoms? "
+    "Understanding these patterns can help provide more relevant information."
+)
+
+
+@lru_cache(maxsize=TERMS_CACHE_SIZE)
+def _terms(text):
+    """Keywords of a question or answer; the returned dict is shared and must not be modified"""
+    return CHAT_MATCHER.scan(text.lower())
+
+
+def _any(terms, keywords):
+    return any(keyword in terms for keyword in keywords)
+
+
+def _fever_intent(structured_answers, question_terms):
+    temperature = None
+    other_symptoms = False
+    duration = None
+    for question, terms in question_terms.items():
+        answer = structured_answers[question]
+        if 'temperature' in terms:
+            temperature = answer
+        elif 'other symptoms' in terms:
+            if answer.lower() not in NO_OTHER_SYMPTOMS:
+                other_symptoms = True
+        elif 'long' in terms or 'duration' in terms:
+            duration = answer
+
+    band = None
+    if temperature:
+        temperature_terms = _terms(temperature)
+        if _any(temperature_terms, HIGH_FEVER_TERMS):
+            band = 'high'
+        elif _any(temperature_terms, MILD_FEVER_TERMS):
+            band = 'mild'
+        else:
+            band = 'other'
+    # Only the advice for a high or low-grade fever depends on when it started
+    duration_bucket = None
+    if band in ('high', 'mild') and duration and 'today' in _terms(duration):
+        duration_bucket = 'today'
+    return StructuredIntent('fever', temperature if band else None, band, duration_bucket, other_symptoms,
+                            None, None, ())
+
+
+def _stomach_intent(structured_answers, question_terms):
+    duration = pattern = trigger = None
+    for question, terms in question_terms.items():
+        answer = structured_answers[question]
+        if 'long' in terms or 'duration' in terms:
+            duration = answer
+        elif 'constant' in terms or 'come and go' in terms:
+            pattern = answer
+        elif 'food' in terms or 'trigger' in terms:
+            trigger = answer
+
+    duration_bucket = pattern_kind = trigger_kind = None
+    if duration:
+        terms = _terms(duration)
+        if _any(terms, SHORT_DURATION_TERMS):
+            duration_bucket = 'short'
+        elif _any(terms, LONG_DURATION_TERMS):
+            duration_bucket = 'long'
+    if pattern:
+        terms = _terms(pattern)
+        if 'constant' in terms:
+            pattern_kind = 'constant'
+        elif 'come' in terms and 'go' in terms:
+            pattern_kind = 'intermittent'
+        elif 'after' in terms and _any(terms, MEAL_TERMS):
+            pattern_kind = 'after_meals'
+    if trigger:
+        terms = _terms(trigger)
+        if _any(terms, SPICY_FATTY_TERMS):
+            trigger_kind = 'spicy_fatty'
+        elif _any(terms, DAIRY_TERMS):
+            trigger_kind = 'dairy'
+    return StructuredIntent('stomach', None, None, duration_bucket, False, pattern_kind, trigger_kind, ())
+
+
+def structured_intent(structured_answers):
+    """Reduce {question: answer} pairs to the features the reply depends on"""
+    # Scan each question once; every check below is a set lookup
+    question_terms = {q: _terms(q) for q in structured_answers}
+
+    if any('fever' in terms for terms in question_terms.values()):
+        return _fever_intent(structured_answers, question_terms)
+    if any(_any(terms, ('stomach', 'pain', 'digest')) for terms in question_terms.values()):
+        return _stomach_intent(structured_answers, question_terms)
+
+    # Try to identify what they're describing from the questions
+    conditions = {}
+    for terms in question_terms.values():
+        for term in CONDITION_TERMS:
+            if term in terms:
+                conditions[term] = None
+    return StructuredIntent('general', None, None, None, False, None, None, tuple(conditions))
+
+
+@lru_cache(maxsize=RENDER_CACHE_SIZE)
+def render_structured(intent):
+    """The reply text for an intent"""
+    if intent.topic == 'fever':
+        parts = [FEVER_OPENING]
+        if intent.temperature_band:
+            parts.append(FEVER_BAND[intent.temperature_band].format(reading=intent.temperature))
+            parts.append(FEVER_ADVICE.get((intent.temperature_band, intent.duration), ''))
+        parts.append(FEVER_WITH_SYMPTOMS if intent.other_symptoms else FEVER_ALONE)
+        parts.append(FEVER_CLOSING)
+    elif intent.topic == 'stomach':
+        parts = [STOMACH_OPENING,
+                 STOMACH_DURATION.get(intent.duration, ''),
+                 STOMACH_PATTERN.get(intent.pattern, ''),
+                 STOMACH_TRIGGER.get(intent.trigger, ''),
+                 STOMACH_CLOSING]
+    else:
+        parts = [GENERAL_OPENING, ', '.join(intent.conditions) or GENERAL_UNKNOWN, '. ', GENERAL_CLOSING]
+    return ''.join(parts)
+
+
+def render_cache_stats():
+    """Hits, misses and size of the render cache in this process"""
+    info = render_structured.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max_size": info.maxsize}
@@ -0,0 +1,103 @@
+"""Per-session dialogue state for the rule-based chat.
+
+Rather than rescanning the conversation history on every turn, each session
+keeps a small state that is advanced once per turn:
+
+    topic    keyword of the complaint the current questions are about
+    asked    whether the last reply asked the user questions
+    pending  the questions of that reply
+    answers  keywords from the user's messages since then, across turns
+
+Deciding whether a message answers our questions is then a look at the state
+and the message alone. The state serializes to a short JSON object, so the
+SQLite session store keeps it in the session row.
+"""
+import json
+import re
+from functools import lru_cache
+
+from chat_rules import CHAT_MATCHER, BOT_QUESTION_MARKERS, FOLLOW_UP_ANSWER_TERMS
+
+MAX_PENDING = 5
+MAX_ANSWER_TERMS = 32
+
+_LIST_NUMBER = re.compile(r"^\s*\d+\.\s*")
+
+
+@lru_cache(maxsize=256)
+def _reply_questions(reply):
+    """(asked, questions) for a reply; most replies are the fixed rule texts, hence the cache"""
+    # Same test the history scan used: the reply's question markers, case-sensitive
+    reply_terms = CHAT_MATCHER.scan(reply)
+    if not any(marker in reply_terms for marker in BOT_QUESTION_MARKERS):
+        return False, ()
+    questions = []
+    for line in reply.splitlines():
+        if '?' in line:
+            question = _LIST_NUMBER.sub('', line[:line.rindex('?') + 1]).strip()
+            if question:
+                questions.append(question)
+    return True, tuple(questions[:MAX_PENDING])
+
+
+def _topic_keyword(rule, found):
+    """The keyword that made a category or symptom rule fire"""
+    if rule.stage == 'category':
+        return rule.name
+    present = [(found[keyword], keyword) for keyword in rule.require[0] if keyword in found]
+    return min(present)[1] if present else None
+
+
+class DialogueState:
+    """What the rule-based chat remembers about one conversation"""
+
+    __slots__ = ('topic', 'asked', 'pending', 'answers', 'turns')
+
+    def __init__(self, topic=None, asked=False, pending=(), answers=(), turns=0):
+        self.topic = topic
+        self.asked = asked
+        self.pending = tuple(pending)
+        self.answers = tuple(answers)
+        self.turns = turns
+
+    def is_follow_up(self, found):
+        """Does a message with these keywords answer the questions we asked?"""
+        return self.asked and any(term in found for term in FOLLOW_UP_ANSWER_TERMS)
+
+    def context(self, found):
+        """Keywords for follow-up rules: the topic, earlier answers and this message"""
+        merged = dict.fromkeys(self.answers, 0)
+        if self.topic:
+            merged[self.topic] = 0
+        merged.update(found)
+        return merged
+
+    def advance(self, found, rule, reply):
+        """Apply one turn: the scanned user message, the rule that answered it
+        (None when the reply did not come from a rule) and the reply text"""
+        self.turns += 1
+        if rule is not None and rule.stage in ('category', 'symptom') and rule.require:
+            # A new complaint starts a new line of questions
+            self.topic = _topic_keyword(rule, found)
+            self.answers = ()
+        elif self.asked:
+            collected = dict.fromkeys(self.answers)
+            collected.update(dict.fromkeys(found))
+            self.answers = tuple(collected)[-MAX_ANSWER_TERMS:]
+
+        self.asked, self.pending = _reply_questions(reply)
+
+    def copy(self):
+        return DialogueState(self.topic, self.asked, self.pending, self.answers, self.turns)
+
+    def to_json(self):
+        return json.dumps({"topic": self.topic, "asked": self.asked, "pending": self.pending,
+                           "answers": self.answers, "turns": self.turns}, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, text):
+        return cls(**json.loads(text))
+
+    def __repr__(self):
+        return (f"<DialogueState topic={self.topic!r} asked={self.asked} "
+                f"pending={len(self.pending)} answers={len(self.answers)} turns={self.turns}>")
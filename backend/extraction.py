@@ -0,0 +1,219 @@
+"""Page-level text extraction for uploaded reports.
+
+Large PDFs are split into page ranges that are extracted in a process pool,
+and pages are yielded in order as soon as they are ready, so callers can start
+on page 1 while later pages are still being parsed. DOCX and TXT files go
+through the same generator interface. extract_many spreads a batch of
+documents over the same pool, one document per task.
+
+The type comes from the file's first bytes. PDFs are parsed from a memory map
+of the file: given a path, PyPDF2 would first copy the whole document into a
+BytesIO, while the map lets the OS page it in on demand.
+
+PyPDF2 and python-docx are imported when the first document of their type
+arrives (or by load_parsers()), not when this module is imported.
+"""
+import mmap
+import multiprocessing
+import os
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError,
+                                as_completed)
+
+from report_store import sniff_file_type
+from structured_log import child_logging_settings, get_logger, setup_child_logging
+
+log = get_logger('extraction')
+
+# Hard limits per document
+MAX_PAGES = int(os.environ.get('EXTRACT_MAX_PAGES', 500))
+TIME_BUDGET_SECONDS = float(os.environ.get('EXTRACT_TIME_BUDGET', 60))
+
+# PDFs with fewer pages than this are extracted inline; pool start-up and
+# re-parsing the file in each worker would cost more than it saves
+PARALLEL_MIN_PAGES = 16
+PAGES_PER_TASK = 8
+EXTRACT_WORKERS = int(os.environ.get('EXTRACT_WORKERS', os.cpu_count() or 1))
+
+TEXT_CHUNK_CHARS = 64 * 1024
+
+_pool = None
+# Tasks submitted to the pool and not yet finished, for admission control
+_pending = 0
+_pending_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        if multiprocessing.current_process().daemon:
+            # Daemonic server workers (e.g. hypercorn --workers) cannot start child processes
+            log.warning("extract_pool_threads", reason="daemonic worker process")
+            _pool = ThreadPoolExecutor(max_workers=EXTRACT_WORKERS, thread_name_prefix='extract')
+        else:
+            # The pool processes cannot use this process's log writer thread
+            _pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, initializer=setup_child_logging,
+                                        initargs=child_logging_settings())
+    return _pool
+
+
+def _task_done(future):
+    global _pending
+    with _pending_lock:
+        _pending -= 1
+
+
+def _submit(func, *args):
+    """Submit func(*args) to the pool, counting it as pending until it finishes"""
+    global _pending
+    with _pending_lock:
+        _pending += 1
+    future = _get_pool().submit(func, *args)
+    future.add_done_callback(_task_done)
+    return future
+
+
+def pending():
+    """Number of extraction tasks queued or running in the pool"""
+    return _pending
+
+
+def load_parsers():
+    """Import the document parsers ahead of the first upload"""
+    import PyPDF2  # noqa: F401
+    import docx  # noqa: F401
+
+
+@contextmanager
+def mapped_file(file_path):
+    """Read-only memory map of a file, usable wherever a binary stream is"""
+    with open(file_path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        yield data
+    finally:
+        data.close()
+
+
+def _extract_page_range(file_path, start, stop):
+    """Worker: extract the text of pages [start, stop) of a PDF"""
+    import PyPDF2
+    with mapped_file(file_path) as data:
+        reader = PyPDF2.PdfReader(data)
+        return [reader.pages[i].extract_text() for i in range(start, stop)]
+
+
+def _extract_document(file_path, max_pages, time_budget):
+    """Worker: extract one whole document without fanning out again"""
+    return extract_text_from_file(file_path, max_pages, time_budget, parallel=False)
+
+
+def iter_pdf_pages(file_path, max_pages=MAX_PAGES, time_budget=TIME_BUDGET_SECONDS, parallel=True):
+    """Yield the text of each PDF page in order, within the page cap and time budget"""
+    import PyPDF2
+    with mapped_file(file_path) as data:
+        yield from _iter_pdf_pages(file_path, PyPDF2.PdfReader(data), max_pages, time_budget, parallel)
+
+
+def _iter_pdf_pages(file_path, reader, max_pages, time_budget, parallel):
+    deadline = time.monotonic() + time_budget
+    page_count = min(len(reader.pages), max_pages)
+    if page_count < len(reader.pages):
+        log.warning("extract_page_cap", max_pages=max_pages, page_count=len(reader.pages))
+
+    if not parallel or page_count < PARALLEL_MIN_PAGES or EXTRACT_WORKERS < 2:
+        for i in range(page_count):
+            if time.monotonic() > deadline:
+                log.warning("extract_time_budget", pages=i)
+                return
+            yield reader.pages[i].extract_text()
+        return
+
+    futures = [
+        _submit(_extract_page_range, file_path, start, min(start + PAGES_PER_TASK, page_count))
+        for start in range(0, page_count, PAGES_PER_TASK)
+    ]
+    try:
+        for done, future in enumerate(futures):
+            try:
+                pages = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                log.warning("extract_time_budget", pages=done * PAGES_PER_TASK)
+                return
+            yield from pages
+    finally:
+        # Stop queued ranges once the consumer goes away or the budget runs out
+        for future in futures:
+            future.cancel()
+
+
+def iter_text_from_file(file_path, max_pages=MAX_PAGES, time_budget=TIME_BUDGET_SECONDS, parallel=True):
+    """Yield text pieces of a report in document order; None for unsupported types
+
+    Joining the pieces with "" gives the same text as extract_text_from_file.
+    """
+    file_type = sniff_file_type(file_path)
+
+    if file_type == 'pdf':
+        return (page + "\n" for page in iter_pdf_pages(file_path, max_pages, time_budget, parallel))
+    elif file_type == 'docx':
+        return _iter_docx(file_path)
+    elif file_type == 'txt':
+        return _iter_txt(file_path)
+    else:
+        return None
+
+
+def _iter_docx(file_path):
+    import docx
+    # zipfile already reads members from the path on demand
+    paragraphs = docx.Document(file_path).paragraphs
+    for i, para in enumerate(paragraphs):
+        yield para.text if i == 0 else "\n" + para.text
+
+
+def _iter_txt(file_path):
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        while True:
+            chunk = f.read(TEXT_CHUNK_CHARS)
+            if not chunk:
+                break
+            yield chunk
+
+
+def extract_text_from_file(file_path, max_pages=MAX_PAGES, time_budget=TIME_BUDGET_SECONDS, parallel=True):
+    """Extract the full text of a report; None for unsupported types"""
+    pieces = iter_text_from_file(file_path, max_pages, time_budget, parallel)
+    if pieces is None:
+        return None
+    return "".join(pieces)
+
+
+def submit_document(file_path, max_pages=MAX_PAGES, time_budget=TIME_BUDGET_SECONDS):
+    """Extract one whole document in the process pool; returns its Future"""
+    return _submit(_extract_document, file_path, max_pages, time_budget)
+
+
+def extract_many(file_paths, max_pages=MAX_PAGES, time_budget=TIME_BUDGET_SECONDS):
+    """Extract several documents in the process pool
+
+    Yields (index, text, error) in completion order; error is the exception
+    raised for that document, if any.
+    """
+    if len(file_paths) < 2 or EXTRACT_WORKERS < 2:
+        for index, file_path in enumerate(file_paths):
+            try:
+                yield index, extract_text_from_file(file_path, max_pages, time_budget), None
+            except Exception as e:
+                yield index, None, e
+        return
+
+    futures = {_submit(_extract_document, file_path, max_pages, time_budget): index
+               for index, file_path in enumerate(file_paths)}
+    for future in as_completed(futures):
+        try:
+            yield futures[future], future.result(), None
+        except Exception as e:
+            yield futures[future], None, e
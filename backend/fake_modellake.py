@@ -0,0 +1,61 @@
+"""Local stand-in for groclake's ModelLake, for development, tests and benchmarks.
+
+Select it with MODELLAKE=fake. Latency and failures can be injected through
+the constructor or the FAKE_MODELLAKE_* environment variables.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+
+
+class FakeModelLake:
+    """Answers chat_complete calls locally with configurable latency and errors"""
+
+    def __init__(self, latency=None, jitter=None, error_rate=None, empty_rate=0.0, seed=None):
+        self.latency = float(os.environ.get('FAKE_MODELLAKE_LATENCY', 0.05)) if latency is None else latency
+        self.jitter = float(os.environ.get('FAKE_MODELLAKE_JITTER', 0.0)) if jitter is None else jitter
+        self.error_rate = float(os.environ.get('FAKE_MODELLAKE_ERROR_RATE', 0.0)) if error_rate is None else error_rate
+        self.empty_rate = empty_rate
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _draw(self):
+        with self._lock:
+            self.calls += 1
+            return self._random.random(), self.latency + self._random.uniform(0, self.jitter)
+
+    def _respond(self, payload, roll):
+        if roll < self.error_rate:
+            raise ConnectionError("Injected ModelLake failure")
+        if roll < self.error_rate + self.empty_rate:
+            return {}
+
+        prompt = payload["messages"][-1]["content"]
+        return {"answer": (
+            "## Summary\n\n"
+            f"This is a simulated analysis of {len(prompt)} characters of input.\n\n"
+            "## Key Findings\n\n"
+            "- No real model was consulted.\n\n"
+            "## Disclaimer\n\n"
+            "This is not a substitute for professional medical interpretation."
+        )}
+
+    def chat_complete(self, payload, timeout=None):
+        roll, delay = self._draw()
+        if timeout is not None and delay > timeout:
+            # Like an HTTP read timeout: the call gives up instead of waiting for the answer
+            time.sleep(timeout)
+            raise TimeoutError("Injected ModelLake read timeout")
+        time.sleep(delay)
+        return self._respond(payload, roll)
+
+    async def chat_complete_async(self, payload, timeout=None):
+        roll, delay = self._draw()
+        if timeout is not None and delay > timeout:
+            await asyncio.sleep(timeout)
+            raise TimeoutError("Injected ModelLake read timeout")
+        await asyncio.sleep(delay)
+        return self._respond(payload, roll)
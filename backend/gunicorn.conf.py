@@ -0,0 +1,86 @@
+"""Gunicorn settings for serving the backend.
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+or, with the async chat and report endpoints (see asgi.py):
+
+    GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn -c gunicorn.conf.py asgi:application
+
+Request handling is mostly waiting: a report analysis spends nearly all of its
+time in the ModelLake call, while text extraction already runs in its own
+process pool. So the default SERVING_PROFILE=io runs one threaded worker per
+core with several threads each. SERVING_PROFILE=cpu is for deployments where
+the model answers quickly (or MODELLAKE=fake) and the rule-based code
+dominates; it runs more single-threaded workers instead.
+
+Sessions, chat history, job status and rate limits must be visible to every
+worker, so with more than one worker the SQLite backends are switched on unless
+configured otherwise. Metrics are shared the same way: each worker writes its
+values to METRICS_DIR and /metrics on any worker serves the totals of all.
+
+Send SIGHUP to the master for a graceful reload: new workers start with the
+current code and configuration, and old workers finish their requests first.
+"""
+import os
+
+cpus = os.cpu_count() or 1
+profile = os.environ.get('SERVING_PROFILE', 'io')
+
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', 5000)}")
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+if profile == 'cpu':
+    workers = int(os.environ.get('WEB_CONCURRENCY', 2 * cpus + 1))
+    threads = int(os.environ.get('GUNICORN_THREADS', 1))
+else:
+    workers = int(os.environ.get('WEB_CONCURRENCY', cpus))
+    threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# A worker is killed if it stops answering the master for this long; it must
+# outlast the longest request: every ModelLake attempt plus the map-reduce merge
+model_timeout = float(os.environ.get('MODELLAKE_TIMEOUT', 20))
+model_retries = int(os.environ.get('MODELLAKE_RETRIES', 2))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', model_timeout * (model_retries + 1) * 2 + 10))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+# Longer than the 60 s idle timeout of common load balancers, so the proxy
+# rather than the worker closes idle connections
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 75))
+
+# Recycle workers now and then to bound slow leaks; jitter avoids restarting all at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = max_requests // 10
+
+# The app is imported in each worker after the fork: the log writer thread and
+# the thread and process pools it starts must not be created in the master
+preload_app = False
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG')  # e.g. "-" for stdout
+errorlog = '-'
+
+if workers > 1:
+    os.environ.setdefault('SESSION_BACKEND', 'sqlite')
+    os.environ.setdefault('JOB_STORE', 'sqlite')
+    os.environ.setdefault('RATE_LIMIT_STORE', 'sqlite')
+    os.environ.setdefault('METRICS_DIR', os.path.join('uploads', 'metrics'))
+
+
+def on_starting(server):
+    # Snapshots of the workers of an earlier run would be counted again
+    metrics_dir = os.environ.get('METRICS_DIR')
+    if metrics_dir and os.path.isdir(metrics_dir):
+        from metrics import clear_directory
+        clear_directory(metrics_dir)
+
+
+def child_exit(server, worker):
+    # Keep an exited worker's counters in the totals, and drop its gauges
+    metrics_dir = os.environ.get('METRICS_DIR')
+    if metrics_dir:
+        from metrics import mark_process_dead
+        mark_process_dead(worker.pid, metrics_dir)
+
+
+def post_worker_init(worker):
+    # Build the ModelLake client, parsers and retrieval index before taking requests
+    if os.environ.get('WARM_UP_WORKERS', '1').lower() in ('1', 'true', 'yes'):
+        from lazy import warm_up
+        warm_up()
@@ -0,0 +1,168 @@
+"""Background jobs for report analysis.
+
+A job moves through the stages uploaded -> extracted -> analyzing -> done (or
+failed). LocalJobQueue runs jobs on a bounded thread pool inside the process;
+where the job records live is pluggable, so MemoryJobStore can be swapped for
+SQLiteJobStore to make job status visible to every worker process.
+"""
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from structured_log import get_logger
+
+log = get_logger('jobs')
+
+STAGES = ('uploaded', 'extracted', 'analyzing', 'done', 'failed')
+FINISHED_STAGES = ('done', 'failed')
+
+
+class QueueFullError(Exception):
+    """Raised when too many jobs are already waiting to run"""
+
+
+class MemoryJobStore:
+    """Job records in a process-local dict; finished jobs expire after ttl seconds"""
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job_id, owner):
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            self._jobs[job_id] = {"job_id": job_id, "owner": owner, "status": "uploaded",
+                                  "result": None, "status_code": None, "error": None,
+                                  "created": now, "updated": now}
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields, updated=time.time())
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def _prune(self, now):
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job["status"] in FINISHED_STAGES and now - job["updated"] > self.ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+class SQLiteJobStore:
+    """Job records in a SQLite table shared by every process using the same file"""
+
+    def __init__(self, path, ttl=3600):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._connection().execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                status TEXT NOT NULL,
+                result TEXT,
+                status_code INTEGER,
+                error TEXT,
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            )
+        """)
+
+    def _connection(self):
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def create(self, job_id, owner):
+        now = time.time()
+        conn = self._connection()
+        conn.execute("DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?",
+                     FINISHED_STAGES + (now - self.ttl,))
+        conn.execute("INSERT INTO jobs (job_id, owner, status, created, updated) VALUES (?, ?, 'uploaded', ?, ?)",
+                     (job_id, owner, now, now))
+
+    def update(self, job_id, **fields):
+        if 'result' in fields:
+            fields['result'] = json.dumps(fields['result'])
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        self._connection().execute(f"UPDATE jobs SET {assignments}, updated = ? WHERE job_id = ?",
+                                   (*fields.values(), time.time(), job_id))
+
+    def get(self, job_id):
+        cursor = self._connection().execute(
+            "SELECT job_id, owner, status, result, status_code, error, created, updated FROM jobs WHERE job_id = ?",
+            (job_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        job = dict(zip(("job_id", "owner", "status", "result", "status_code", "error", "created", "updated"), row))
+        if job["result"] is not None:
+            job["result"] = json.loads(job["result"])
+        return job
+
+
+class LocalJobQueue:
+    """Runs jobs on a bounded in-process thread pool"""
+
+    def __init__(self, store, max_workers=4, max_pending=64):
+        self.store = store
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='report-job')
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, owner, func, *args):
+        """Queue func(*args, progress=...) and return its job id
+
+        func must return a (result, status_code) pair; progress(stage) records
+        intermediate stages.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFullError("Too many report analyses in progress")
+            self._pending += 1
+
+        job_id = str(uuid.uuid4())
+        self.store.create(job_id, owner)
+        try:
+            self._executor.submit(self._run, job_id, func, args)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        return job_id
+
+    def _run(self, job_id, func, args):
+        def progress(stage):
+            self.store.update(job_id, status=stage)
+
+        try:
+            result, status_code = func(*args, progress=progress)
+            self.store.update(job_id, status='done', result=result, status_code=status_code)
+        except Exception as e:
+            log.exception("report_job_failed", job_id=job_id, error=str(e))
+            self.store.update(job_id, status='failed', error=str(e), status_code=500)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def pending(self):
+        with self._lock:
+            return self._pending
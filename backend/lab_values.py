@@ -0,0 +1,147 @@
+"""Single-pass extraction of lab values and abnormality phrases from report text.
+
+The analyte names, numeric values (with their units) and abnormality phrases
+are folded into one precompiled alternation, so a report is tokenized in a
+single left-to-right scan. Each analyte takes the first number that follows
+it. The values are then converted to their analytes' units and compared with
+the reference ranges (reference_ranges.py) all at once, for the patient's sex
+and age when the report states them.
+"""
+import math
+import re
+from collections import namedtuple
+
+from reference_ranges import ReferenceRanges
+
+LabValue = namedtuple('LabValue', ['test', 'value', 'raw', 'unit', 'offset', 'flag'])
+AbnormalFinding = namedtuple('AbnormalFinding', ['phrase', 'term', 'offset'])
+LabScan = namedtuple('LabScan', ['values', 'findings'])
+
+# Analytes, their units and reference ranges come from data/reference_ranges.csv
+REFERENCE_RANGES = ReferenceRanges.load()
+
+ABNORMAL_TERMS = ["abnormal", "high", "low", "elevated", "decreased", "positive", "negative",
+                  "out of range", "reference range", "critical"]
+
+# Lowercased unit spellings mapped to (canonical unit, multiplier into it)
+UNIT_ALIASES = {
+    "g/dl": ("g/dL", 1), "mg/dl": ("mg/dL", 1), "ng/dl": ("ng/dL", 1),
+    "μg/dl": ("μg/dL", 1), "µg/dl": ("μg/dL", 1), "ug/dl": ("μg/dL", 1), "mcg/dl": ("μg/dL", 1),
+    "u/l": ("U/L", 1), "iu/l": ("U/L", 1),
+    "μiu/ml": ("μIU/mL", 1), "µiu/ml": ("μIU/mL", 1), "uiu/ml": ("μIU/mL", 1), "miu/l": ("μIU/mL", 1),
+    "ml/min/1.73m2": ("mL/min", 1), "ml/min": ("mL/min", 1),
+    "%": ("%", 1),
+    "million/μl": ("million/μL", 1), "million/µl": ("million/μL", 1), "million/ul": ("million/μL", 1),
+    "m/μl": ("million/μL", 1), "m/µl": ("million/μL", 1), "m/ul": ("million/μL", 1),
+    "cells/μl": ("/μL", 1), "cells/µl": ("/μL", 1), "cells/ul": ("/μL", 1),
+    "/μl": ("/μL", 1), "/µl": ("/μL", 1), "/ul": ("/μL", 1),
+    "k/μl": ("/μL", 1000), "k/µl": ("/μL", 1000), "k/ul": ("/μL", 1000),
+    "x10^3/μl": ("/μL", 1000), "x10^3/µl": ("/μL", 1000), "x10^3/ul": ("/μL", 1000),
+    "10^3/μl": ("/μL", 1000), "10^3/µl": ("/μL", 1000), "10^3/ul": ("/μL", 1000),
+    "x10^9/l": ("/μL", 1000), "10^9/l": ("/μL", 1000), "x10^12/l": ("million/μL", 1), "10^12/l": ("million/μL", 1),
+    # SI units, converted per analyte (data/unit_conversions.csv)
+    "mmol/l": ("mmol/L", 1), "μmol/l": ("μmol/L", 1), "µmol/l": ("μmol/L", 1), "umol/l": ("μmol/L", 1),
+    "nmol/l": ("nmol/L", 1), "g/l": ("g/L", 1), "l/l": ("L/L", 1),
+}
+
+
+def _alternation(words):
+    return '|'.join(re.escape(w) for w in sorted(words, key=len, reverse=True))
+
+
+def token_pattern(analytes):
+    """The single-scan tokenizer for analyte names, numbers with units and findings"""
+    return re.compile(
+        rf'(?P<test>\b(?:{_alternation(analytes)})\b)'
+        rf'|(?P<number>\d{{1,3}}(?:,\d{{3}})+(?:\.\d+)?|\d+(?:\.\d+)?)(?:\s*(?P<unit>{_alternation(UNIT_ALIASES)}))?'
+        rf'|(?P<finding>\b(?:is|was|were|appears?|shows?)\s*(?P<term>{_alternation(ABNORMAL_TERMS)}))'
+    )
+
+
+LAB_TOKEN_PATTERN = token_pattern(REFERENCE_RANGES.analytes)
+
+# Up to two words immediately preceding a "<verb> <term>" phrase
+_SUBJECT_PATTERN = re.compile(r'(\w+\s*\w*)\s*$')
+_SUBJECT_WINDOW = 64
+
+
+# Patient details as reports usually print them: "Sex: F", "Gender - male", "Age: 52",
+# looked for in the header only
+_PATIENT_HEADER_CHARS = 2048
+_SEX_PATTERN = re.compile(r'\b(?:sex|gender)\s*[:\-]?\s*(female|male|f|m)\b')
+_AGE_PATTERN = re.compile(r'\bage\s*[:\-]?\s*(\d{1,3})\b')
+
+
+def patient_details(text_lower):
+    """(sex, age) stated in the report; either is None when it is not stated"""
+    header = text_lower[:_PATIENT_HEADER_CHARS]
+    sex = _SEX_PATTERN.search(header)
+    age = _AGE_PATTERN.search(header)
+    if sex:
+        sex = {'f': 'female', 'm': 'male'}.get(sex.group(1), sex.group(1))
+    return sex, int(age.group(1)) if age else None
+
+
+def _in_unit(test, value, unit):
+    """The value in the test's unit; NaN when its unit does not convert"""
+    if unit is None:
+        return value
+    canonical, scale = UNIT_ALIASES[unit]
+    factor = REFERENCE_RANGES.factor(test, canonical)
+    return value * scale * factor if factor is not None else math.nan
+
+
+def scan_lab_report(text_lower, sex=None, age=None):
+    """Tokenize lowercased report text once and return the lab values and findings
+
+    sex ('female' or 'male') and age select the reference ranges; by default
+    they are read from the report.
+    """
+    values = {}  # test -> (value, raw, unit, offset)
+    pending = []
+    findings = []
+    for match in LAB_TOKEN_PATTERN.finditer(text_lower):
+        kind = match.lastgroup
+        if kind == 'test':
+            test = match.group('test')
+            # Only the first mention of a test is reported
+            if test not in values and test not in pending:
+                pending.append(test)
+        elif kind in ('number', 'unit'):
+            raw = match.group('number')
+            unit = match.group('unit')
+            value = float(raw.replace(',', ''))
+            for test in pending:
+                values[test] = (value, raw, unit, match.start())
+            pending = []
+        else:
+            window = text_lower[max(0, match.start() - _SUBJECT_WINDOW):match.start()]
+            subject = _SUBJECT_PATTERN.search(window)
+            if subject:
+                findings.append(AbnormalFinding(subject.group(1), match.group('term'), match.start()))
+
+    if values and (sex is None or age is None):
+        stated_sex, stated_age = patient_details(text_lower)
+        sex = sex or stated_sex
+        age = age if age is not None else stated_age
+    # Every value of the report is compared in one call
+    tests = list(values)
+    flags = REFERENCE_RANGES.flag(tests, [_in_unit(test, values[test][0], values[test][2]) for test in tests],
+                                  sex=sex, age=age)
+    lab_values = [LabValue(test, *values[test], flag) for test, flag in zip(tests, flags)]
+    return LabScan(sorted(lab_values, key=lambda v: v.offset), findings)
+
+
+def format_lab_value(lab_value):
+    """Render a detected value as a markdown bullet body"""
+    if lab_value.unit is None:
+        unit = REFERENCE_RANGES.unit(lab_value.test)
+    else:
+        unit, factor = UNIT_ALIASES[lab_value.unit]
+        if factor == 1000:
+            unit = f"x10^3{unit}"
+    line = (f"**{lab_value.test.upper()}**: {lab_value.raw} {unit} "
+            f"(Normal range: {REFERENCE_RANGES.describe(lab_value.test)})")
+    if lab_value.flag in ('low', 'high'):
+        line += f" - **{lab_value.flag.capitalize()}**"
+    return line
@@ -0,0 +1,69 @@
+"""Deferred construction of expensive clients and indexes.
+
+A LazyObject stands in for an object whose construction imports heavy
+packages or talks to the network. It is built on the first attribute access,
+or ahead of time by warm_up(), which a server can call after forking
+its workers so the first request does not pay for it.
+"""
+import threading
+import time
+
+from structured_log import get_logger
+
+log = get_logger('lazy')
+
+_registry = []
+
+
+class LazyObject:
+    """Proxy that builds the wrapped object with factory() on first use"""
+
+    def __init__(self, name, factory):
+        self._name = name
+        self._factory = factory
+        self._value = None
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def resolve(self):
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    started = time.perf_counter()
+                    self._value = self._factory()
+                    log.info("lazy_init", name=self._name, seconds=round(time.perf_counter() - started, 4))
+        return self._value
+
+    @property
+    def resolved(self):
+        return self._value is not None
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __repr__(self):
+        state = 'resolved' if self.resolved else 'pending'
+        return f"<LazyObject {self._name} ({state})>"
+
+
+_warm_up_hooks = []
+
+
+def on_warm_up(func):
+    """Register func() to run in warm_up(); usable as a decorator"""
+    _warm_up_hooks.append(func)
+    return func
+
+
+def warm_up():
+    """Build every LazyObject and run the registered hooks; errors are logged, not raised"""
+    for item in list(_registry):
+        try:
+            item.resolve()
+        except Exception as e:
+            log.warning("warm_up_failed", name=item._name, error=str(e))
+    for hook in list(_warm_up_hooks):
+        try:
+            hook()
+        except Exception as e:
+            log.warning("warm_up_failed", name=getattr(hook, '__name__', repr(hook)), error=str(e))
@@ -0,0 +1,412 @@
+"""In-process metrics served in the Prometheus text exposition format.
+
+Counters and histograms are plain dicts guarded by a lock, so recording a
+sample costs a perf_counter call, a bisect and a dict update; it is cheap
+enough to leave on in production. Values owned by other components (session
+counts, cache and ModelLake client counters) are read through collector
+callbacks only when /metrics is scraped.
+
+Stage timing:
+
+    with stage_timer('extract'):
+        text = extract(...)
+
+records into medassist_stage_seconds{endpoint=...,stage="extract"} and, inside
+a request, adds the stage to the Server-Timing header when that is enabled.
+
+Under gunicorn every worker holds its own values. With a shared directory
+(METRICS_DIR, see gunicorn.conf.py) each worker also writes a JSON snapshot of
+its metrics there every few seconds, and /metrics merges the snapshots of all
+workers: counters and histograms are summed, gauges get a worker label. When a
+worker exits, the master folds its counters and histograms into an archive
+file with mark_process_dead(), so the totals do not drop when workers are
+recycled.
+"""
+import atexit
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import g, has_request_context, request
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _label_text(labelnames, values):
+    if not labelnames:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def sample(self):
+        with self._lock:
+            values = dict(self._values)
+        return {"type": "counter", "help": self.help, "labelnames": self.labelnames, "values": values}
+
+    def render(self):
+        return _render_family(self.name, self.sample())
+
+
+class Histogram:
+    """Cumulative histogram with fixed bucket bounds and optional labels"""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def snapshot(self, **labels):
+        """Return {"buckets": {le: cumulative count}, "sum": ..., "count": ...}"""
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            series = list(self._series.get(key, [0] * (len(self.buckets) + 2)))
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets + (float('inf'),), series[:-1]):
+            cumulative += count
+            buckets['+Inf' if bound == float('inf') else format(bound, 'g')] = cumulative
+        return {"buckets": buckets, "sum": series[-1], "count": cumulative}
+
+    def sample(self):
+        with self._lock:
+            values = {key: list(series) for key, series in self._series.items()}
+        return {"type": "histogram", "help": self.help, "labelnames": self.labelnames,
+                "buckets": self.buckets, "values": values}
+
+    def render(self):
+        return _render_family(self.name, self.sample())
+
+
+def _render_family(name, family):
+    """Text lines of one metric from {"type", "help", "labelnames", "values"[, "buckets"]}"""
+    lines = [f"# HELP {name} {family['help']}", f"# TYPE {name} {family['type']}"]
+    labelnames = tuple(family["labelnames"])
+    for key, value in sorted(family["values"].items()):
+        if family["type"] != 'histogram':
+            lines.append(f"{name}{_label_text(labelnames, key)} {_number(value)}")
+            continue
+        cumulative = 0
+        for bound, count in zip(tuple(family["buckets"]) + (float('inf'),), value[:-1]):
+            cumulative += count
+            labels = _label_text(labelnames + ('le',), key + (_number(bound),))
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        base_labels = _label_text(labelnames, key)
+        lines.append(f"{name}_sum{base_labels} {_number(value[-1])}")
+        lines.append(f"{name}_count{base_labels} {cumulative}")
+    return lines
+
+
+def render_families(families):
+    """Prometheus text of {name: family}"""
+    lines = []
+    for name, family in families.items():
+        lines.extend(_render_family(name, family))
+    return "\n".join(lines) + "\n"
+
+
+class Registry:
+    """Holds metrics and scrape-time collectors and renders them as one text page"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register(self, metric):
+        """Add a metric created elsewhere, such as a client's own histogram"""
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, func):
+        """Register func() -> iterable of (name, type, help, {labels tuple: value}, labelnames)"""
+        self._collectors.append(func)
+        return func
+
+    def samples(self):
+        """{name: family} of every metric and collector, as _render_family takes them"""
+        families = {metric.name: metric.sample() for metric in self._metrics}
+        for collect in self._collectors:
+            for name, metric_type, help_text, values, labelnames in collect():
+                families[name] = {"type": metric_type, "help": help_text,
+                                  "labelnames": tuple(labelnames), "values": dict(values)}
+        return families
+
+    def render(self):
+        return render_families(self.samples())
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'medassist_stage_seconds', 'Time spent in each request stage', ('endpoint', 'stage'))
+REQUEST_SECONDS = REGISTRY.histogram(
+    'medassist_request_seconds', 'Total request handling time', ('endpoint', 'status'))
+RESPONSES = REGISTRY.counter(
+    'medassist_responses_total', 'Chat and report responses by fallback outcome', ('endpoint', 'is_fallback'))
+
+
+ARCHIVE_FILE = 'archive.json'
+# Snapshot files already folded into the archive, kept so a scrape racing the
+# fold does not count them twice
+ARCHIVE_KEEP_MERGED = 64
+
+
+def _write_json(path, data):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def _read_json(path):
+    """Parsed file, or None when it is gone or half-written"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _encode(families):
+    return {name: dict(family, values=[[list(key), value] for key, value in family["values"].items()])
+            for name, family in families.items()}
+
+
+def _decode(families):
+    return {name: dict(family, labelnames=tuple(family["labelnames"]),
+                       values={tuple(key): value for key, value in family["values"]})
+            for name, family in families.items()}
+
+
+def _merge_into(merged, families, worker=None):
+    """Add a worker's families to merged: counters and histograms are summed
+
+    Gauges are kept per worker under a worker label, and dropped when worker
+    is None (the archive of exited workers).
+    """
+    for name, family in families.items():
+        labelnames = family["labelnames"]
+        if family["type"] == 'gauge':
+            if worker is None:
+                continue
+            labelnames = labelnames + ('worker',)
+        target = merged.setdefault(name, dict(family, labelnames=labelnames, values={}))
+        if target["type"] != family["type"] or target["labelnames"] != labelnames:
+            continue  # changed between code versions; keep the first layout
+        for key, value in family["values"].items():
+            if family["type"] == 'gauge':
+                target["values"][key + (worker,)] = value
+            elif family["type"] == 'histogram':
+                current = target["values"].get(key)
+                if current is None:
+                    target["values"][key] = list(value)
+                elif len(current) == len(value):
+                    target["values"][key] = [a + b for a, b in zip(current, value)]
+            else:
+                target["values"][key] = target["values"].get(key, 0) + value
+    return merged
+
+
+def _load_archive(directory):
+    archive = _read_json(os.path.join(directory, ARCHIVE_FILE)) or {}
+    return archive.get("merged", []), _decode(archive.get("families", {}))
+
+
+def merge_directory(directory):
+    """{name: family} over the archive and every live worker's snapshot"""
+    merged_files, archived = _load_archive(directory)
+    merged = _merge_into({}, archived)
+    for path in sorted(glob.glob(os.path.join(directory, '*-*.json'))):
+        filename = os.path.basename(path)
+        if filename in merged_files:
+            continue
+        snapshot = _read_json(path)
+        if snapshot is not None:
+            _merge_into(merged, _decode(snapshot), worker=filename.split('-', 1)[0])
+    return merged
+
+
+def mark_process_dead(pid, directory):
+    """Fold an exited worker's counters and histograms into the archive
+
+    Called by the gunicorn master only, so the archive has a single writer.
+    """
+    paths = glob.glob(os.path.join(directory, f'{pid}-*.json'))
+    if not paths:
+        return
+    merged_files, archived = _load_archive(directory)
+    for path in paths:
+        snapshot = _read_json(path)
+        if snapshot is not None:
+            _merge_into(archived, _decode(snapshot))
+        merged_files.append(os.path.basename(path))
+    _write_json(os.path.join(directory, ARCHIVE_FILE),
+                {"merged": merged_files[-ARCHIVE_KEEP_MERGED:], "families": _encode(archived)})
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def clear_directory(directory):
+    """Remove the snapshots of a previous server run"""
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        os.unlink(path)
+
+
+class SharedMetrics:
+    """Writes this worker's snapshot to the shared directory and renders the merged view"""
+
+    def __init__(self, registry, directory, interval=5.0):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        os.makedirs(directory, exist_ok=True)
+        # The suffix tells apart two workers that got the same pid over time
+        self.path = os.path.join(directory, f'{os.getpid()}-{uuid.uuid4().hex[:8]}.json')
+        self._stop = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name='metrics-sync', daemon=True).start()
+        # Write the final values before exiting, for the master to archive
+        atexit.register(self.dump)
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.dump()
+            except OSError:
+                pass  # retried on the next tick
+
+    def dump(self):
+        _write_json(self.path, _encode(self.registry.samples()))
+
+    def render(self):
+        self.dump()
+        return render_families(merge_directory(self.directory))
+
+
+_shared = None
+
+
+def render():
+    """/metrics page: every worker's values when sharing is on, else this process's"""
+    if _shared is not None:
+        return _shared.render()
+    return REGISTRY.render()
+
+
+# Endpoint label for work outside a Flask request, set per request by the ASGI app
+endpoint_label = ContextVar('endpoint_label', default='background')
+
+
+def _endpoint():
+    if has_request_context():
+        return request.endpoint or 'unknown'
+    return endpoint_label.get()
+
+
+@contextmanager
+def stage_timer(name, endpoint=None):
+    """Time a block as one stage of the current request (or of a background job)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, endpoint=endpoint or _endpoint(), stage=name)
+        if has_request_context():
+            timings = g.setdefault('stage_timings', [])
+            timings.append((name, elapsed))
+
+
+def record_response(endpoint, is_fallback):
+    RESPONSES.inc(endpoint=endpoint, is_fallback='true' if is_fallback else 'false')
+
+
+def init_app(app, server_timing=False, shared_dir=None, sync_interval=5.0):
+    """Time every request and optionally report stages in a Server-Timing header
+
+    With shared_dir, write this process's metrics there for /metrics to merge.
+    """
+    global _shared
+    if shared_dir:
+        _shared = SharedMetrics(REGISTRY, shared_dir, sync_interval).start()
+
+    @app.before_request
+    def _start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def _finish_request_timer(response):
+        started = g.get('request_started')
+        if started is not None:
+            elapsed = time.perf_counter() - started
+            REQUEST_SECONDS.observe(elapsed, endpoint=request.endpoint or 'unknown',
+                                    status=str(response.status_code))
+            if server_timing:
+                entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in g.get('stage_timings', [])]
+                entries.append(f"total;dur={elapsed * 1000:.2f}")
+                response.headers['Server-Timing'] = ', '.join(entries)
+        return response
@@ -0,0 +1,336 @@
+"""Resilient wrapper around the ModelLake client.
+
+Every call gets a deadline, failed calls are retried with jittered exponential
+backoff, and a circuit breaker stops calling ModelLake for a cool-down window
+after repeated failures so callers go straight to their rule-based fallback
+instead of paying the full network wait each time.
+
+chat_complete_async is the same for the ASGI app (asgi.py). With a
+response_cache (response_cache.py) repeated and near-identical prompts are
+answered locally, even while the breaker is open.
+"""
+import asyncio
+import inspect
+import os
+import random
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from metrics import Histogram
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class ModelUnavailableError(Exception):
+    """ModelLake could not produce a usable answer"""
+
+
+class ModelTimeoutError(ModelUnavailableError):
+    """The call did not finish before its deadline"""
+
+
+class CircuitOpenError(ModelUnavailableError):
+    """The circuit breaker is open, ModelLake is not being called"""
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures, for cooldown seconds
+
+    Once the cool-down has passed a single trial call is let through
+    (half-open); its outcome closes the breaker again or re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, cooldown=30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.state == 'half_open' or self.consecutive_failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def snapshot(self):
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self.consecutive_failures}
+
+
+def accepts_timeout(method):
+    """Does the client method take a timeout keyword, to bound its HTTP request?"""
+    try:
+        parameters = inspect.signature(method).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    return any(p.name == 'timeout' or p.kind == p.VAR_KEYWORD for p in parameters)
+
+
+def extract_answer(response):
+    """Pull the answer text out of a ModelLake chat_complete response"""
+    # Check if we got a valid response
+    if not response or not isinstance(response, dict):
+        raise ModelUnavailableError("Empty or invalid ModelLake response")
+    if response.get('answer'):
+        return response['answer']
+    # Try other fields
+    for field in ['content', 'text', 'response']:
+        if response.get(field):
+            return response[field]
+    # If no text field, check for any string value
+    for value in response.values():
+        if isinstance(value, str) and value:
+            return value
+    raise ModelUnavailableError("No usable content in ModelLake response")
+
+
+class ModelClient:
+    """Deadline-bounded, retrying, circuit-broken access to one shared ModelLake client"""
+
+    def __init__(self, modellake, account_id, timeout=20.0, retries=2, backoff_base=0.25,
+                 backoff_max=2.0, failure_threshold=5, cooldown=30.0, max_concurrency=16,
+                 max_async_concurrency=256, response_cache=None):
+        # A single client instance is reused for every call
+        self.modellake = modellake
+        self.account_id = account_id
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = CircuitBreaker(failure_threshold, cooldown)
+        self.response_cache = response_cache
+        self.latency = Histogram('medassist_modellake_call_seconds', 'ModelLake call latency by outcome',
+                                 ('outcome',), LATENCY_BUCKETS)
+        self.counters = {"calls": 0, "successes": 0, "failures": 0, "timeouts": 0,
+                         "retries": 0, "short_circuited": 0}
+        self._counter_lock = threading.Lock()
+        self._pending = 0
+        # Calls run on this pool so a hung request can be abandoned at its deadline
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='modellake')
+        # Awaited calls are not bounded by the pool, so they take a slot of their own
+        self.max_async_concurrency = max_async_concurrency
+        # One semaphore per event loop: a semaphore must only be used on its own loop
+        self._async_slots = weakref.WeakKeyDictionary()
+        self._native_async = None
+        self._sync_timeout = None
+        self._async_timeout = None
+
+    @classmethod
+    def from_env(cls, modellake, account_id, response_cache=None):
+        return cls(
+            modellake, account_id,
+            timeout=float(os.environ.get('MODELLAKE_TIMEOUT', 20)),
+            retries=int(os.environ.get('MODELLAKE_RETRIES', 2)),
+            failure_threshold=int(os.environ.get('MODELLAKE_BREAKER_THRESHOLD', 5)),
+            cooldown=float(os.environ.get('MODELLAKE_BREAKER_COOLDOWN', 30)),
+            max_concurrency=int(os.environ.get('MODELLAKE_MAX_CONCURRENCY', 16)),
+            max_async_concurrency=int(os.environ.get('MODELLAKE_MAX_ASYNC_CONCURRENCY', 256)),
+            response_cache=response_cache,
+        )
+
+    def _count(self, name):
+        with self._counter_lock:
+            self.counters[name] += 1
+
+    def _track(self, delta):
+        with self._counter_lock:
+            self._pending += delta
+
+    def pending(self):
+        """Calls handed to ModelLake or queued for it that have not returned yet"""
+        with self._counter_lock:
+            return self._pending
+
+    def _submit(self, payload, timeout):
+        # Counted until ModelLake returns (or the queued call is cancelled),
+        # even when the caller gave up earlier
+        self._track(1)
+        future = self._executor.submit(self._call, payload, timeout)
+        future.add_done_callback(lambda _: self._track(-1))
+        return future
+
+    def _call(self, payload, timeout):
+        # Looked up on the executor thread, so a lazily created client starts
+        # inside the caller's deadline
+        chat_complete = self.modellake.chat_complete
+        if self._sync_timeout is None:
+            self._sync_timeout = accepts_timeout(chat_complete)
+        if self._sync_timeout:
+            # The HTTP request itself gives up at the deadline and frees this thread;
+            # without it, a timed-out call keeps the thread until ModelLake answers
+            return chat_complete(payload, timeout=timeout)
+        return chat_complete(payload)
+
+    def _payload(self, messages):
+        return {"groc_account_id": self.account_id, "messages": messages}
+
+    def _start_attempt(self, attempt):
+        """Ask the breaker for a call; return the start time or raise CircuitOpenError"""
+        if not self.breaker.allow():
+            self._count("short_circuited")
+            raise CircuitOpenError("ModelLake circuit breaker is open")
+        if attempt:
+            self._count("retries")
+        self._count("calls")
+        return time.monotonic()
+
+    def _cached(self, messages):
+        return self.response_cache.get(messages) if self.response_cache is not None else None
+
+    def _remember(self, messages, answer):
+        if self.response_cache is not None:
+            self.response_cache.put(messages, answer)
+
+    def _record(self, started, success):
+        self.latency.observe(time.monotonic() - started, outcome='success' if success else 'failure')
+        if success:
+            self.breaker.record_success()
+            self._count("successes")
+        else:
+            self.breaker.record_failure()
+            self._count("failures")
+
+    def _backoff(self, attempt, deadline):
+        """Seconds to wait before the next attempt, or None when there is none"""
+        # Full jitter: sleep a random fraction of the exponential backoff
+        backoff = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if attempt < self.retries and time.monotonic() + backoff < deadline:
+            return backoff
+        return None
+
+    @staticmethod
+    def _give_up(last_error):
+        if isinstance(last_error, ModelUnavailableError):
+            raise last_error
+        raise ModelUnavailableError(str(last_error) if last_error else "ModelLake deadline exceeded") from last_error
+
+    def chat_complete(self, messages, timeout=None):
+        """Return the model's answer text or raise ModelUnavailableError
+
+        timeout bounds the whole call including retries and backoff.
+        """
+        cached = self._cached(messages)
+        if cached is not None:
+            return cached
+        deadline = time.monotonic() + (timeout or self.timeout)
+        last_error = None
+
+        for attempt in range(self.retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            started = self._start_attempt(attempt)
+            future = self._submit(self._payload(messages), remaining)
+            try:
+                answer = extract_answer(future.result(timeout=remaining))
+            except FutureTimeoutError:
+                self._count("timeouts")
+                last_error = ModelTimeoutError(f"ModelLake call exceeded {remaining:.1f}s deadline")
+            except Exception as e:
+                last_error = e
+            else:
+                self._record(started, success=True)
+                self._remember(messages, answer)
+                return answer
+
+            self._record(started, success=False)
+            backoff = self._backoff(attempt, deadline)
+            if backoff is None:
+                break
+            time.sleep(backoff)
+
+        self._give_up(last_error)
+
+    async def _call_async(self, payload, timeout):
+        loop = asyncio.get_running_loop()
+        if self._native_async is None:
+            # Resolving a lazily created client may block, so do it off the event loop once
+            self._native_async = await loop.run_in_executor(
+                self._executor, lambda: getattr(self.modellake, 'chat_complete_async', False))
+            self._async_timeout = bool(self._native_async) and accepts_timeout(self._native_async)
+        if not self._native_async:
+            # Blocking SDK: the call waits on the bounded pool instead of the event loop
+            return await asyncio.wrap_future(self._submit(payload, timeout))
+        slots = self._async_slots.get(loop)
+        if slots is None:
+            slots = self._async_slots[loop] = asyncio.Semaphore(self.max_async_concurrency)
+        self._track(1)
+        try:
+            async with slots:
+                if self._async_timeout:
+                    return await self._native_async(payload, timeout=timeout)
+                return await self._native_async(payload)
+        finally:
+            self._track(-1)
+
+    async def chat_complete_async(self, messages, timeout=None):
+        """chat_complete for coroutines, with the same deadline, retries and breaker
+
+        A client with a chat_complete_async coroutine is awaited directly, so
+        waiting on ModelLake holds no thread; otherwise the blocking call runs
+        on the executor.
+        """
+        cached = self._cached(messages)
+        if cached is not None:
+            return cached
+        deadline = time.monotonic() + (timeout or self.timeout)
+        last_error = None
+
+        for attempt in range(self.retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            started = self._start_attempt(attempt)
+            try:
+                answer = extract_answer(await asyncio.wait_for(self._call_async(self._payload(messages), remaining),
+                                                               remaining))
+            except asyncio.TimeoutError:
+                self._count("timeouts")
+                last_error = ModelTimeoutError(f"ModelLake call exceeded {remaining:.1f}s deadline")
+            except Exception as e:
+                last_error = e
+            else:
+                self._record(started, success=True)
+                self._remember(messages, answer)
+                return answer
+
+            self._record(started, success=False)
+            backoff = self._backoff(attempt, deadline)
+            if backoff is None:
+                break
+            await asyncio.sleep(backoff)
+
+        self._give_up(last_error)
+
+    def stats(self):
+        with self._counter_lock:
+            counters = dict(self.counters)
+            pending = self._pending
+        return {"breaker": self.breaker.snapshot(), "counters": counters, "pending": pending,
+                "response_cache": self.response_cache.stats() if self.response_cache is not None else None,
+                "latency_seconds": {"success": self.latency.snapshot(outcome='success'),
+                                    "failure": self.latency.snapshot(outcome='failure')}}
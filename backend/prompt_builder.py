@@ -0,0 +1,322 @@
+"""Token-budgeted report prompts and map-reduce analysis of long reports.
+
+A report that fits PROMPT_TOKEN_BUDGET is analyzed in one call. A longer one is
+split into section-aware chunks; each chunk is summarized concurrently (map)
+and the partial summaries are merged into one analysis (reduce), in several
+rounds if they do not fit in one prompt. Chunk summaries are cached by a hash
+of the chunk text, so re-uploading a report with one page changed only sends
+the chunks covering that page. The map prompt therefore holds nothing but the
+chunk: its position only appears when the summaries are merged.
+
+Chunks start at section headings. Packing sections into chunks restarts at
+"anchor" headings, chosen by a hash of the heading text, so a section that
+grows only shifts chunk boundaries up to the next anchor.
+
+A ReportStream takes the text page by page while it is extracted. Once the
+report is past the single-call budget, every chunk that later text can no
+longer change is summarized straight away, so the map step overlaps
+extraction.
+"""
+import hashlib
+import math
+import re
+import zlib
+from collections import namedtuple
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+from structured_log import get_logger
+
+log = get_logger('prompt_builder')
+
+CHARS_PER_TOKEN = 4
+ANCHOR_EVERY = 4
+# Bump when the map prompt changes so cached chunk summaries are not reused
+MAP_PROMPT_VERSION = '2'
+
+REPORT_INSTRUCTION = "Please analyze this report and provide a summary of key findings."
+
+MAP_SYSTEM_PROMPT = """You are a medical assistant reading one part of a longer medical report.
+List every test result in this part with its value, unit and reference range when given,
+mark values outside the range, and note any other clinical findings. Be brief and factual;
+do not write an overall conclusion, another step will combine all parts."""
+
+REDUCE_INSTRUCTION = ("Combine these partial analyses of one medical report into a single analysis. "
+                      "Merge repeated results, keep every abnormal finding, and provide a summary of key findings.")
+
+COMBINE_INSTRUCTION = ("These are analyses of several reports from the same patient. Write one combined summary: "
+                       "results that appear in more than one report and how they changed, every abnormal finding, "
+                       "and which report it came from.")
+
+ReportChunk = namedtuple('ReportChunk', ['index', 'text', 'digest'])
+
+_PAGE_PATTERN = re.compile(r"\bpage\s+\d+\b", re.IGNORECASE)
+
+
+def estimate_tokens(text):
+    """Rough token count, about four characters per token for English text"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _is_heading(line):
+    """Markdown headings, page headers, "Lipid Panel:" and ALL CAPS lines without numbers"""
+    stripped = line.strip()
+    if not stripped or len(stripped) > 80:
+        return False
+    if stripped.startswith('#') or stripped.endswith(':') or _PAGE_PATTERN.search(stripped):
+        return True
+    return stripped.isupper() and not any(ch.isdigit() for ch in stripped)
+
+
+def split_sections(text):
+    """Split report text into sections, each starting at a heading line"""
+    sections = []
+    current = []
+    for line in text.splitlines(keepends=True):
+        if current and _is_heading(line):
+            sections.append(''.join(current))
+            current = []
+        current.append(line)
+    if current:
+        sections.append(''.join(current))
+    return sections
+
+
+def _is_anchor(section):
+    heading = section.split('\n', 1)[0].strip().lower()
+    return zlib.crc32(heading.encode('utf-8')) % ANCHOR_EVERY == 0
+
+
+def _pack(text, max_tokens):
+    """(offset, text) of each piece of at most max_tokens, packed from whole sections"""
+    from retrieval import chunk_text  # imports NumPy, which short reports never need
+    pieces = []
+    current = []
+    current_start = current_tokens = 0
+    offset = 0
+
+    def flush():
+        if current:
+            pieces.append((current_start, ''.join(current)))
+            current.clear()
+
+    for section in split_sections(text):
+        tokens = estimate_tokens(section)
+        if tokens > max_tokens:
+            flush()
+            current_tokens = 0
+            pieces.extend((offset + chunk.offset, chunk.text)
+                          for chunk in chunk_text(section, max_tokens * CHARS_PER_TOKEN))
+        else:
+            if current and (current_tokens + tokens > max_tokens or _is_anchor(section)):
+                flush()
+                current_tokens = 0
+            if not current:
+                current_start = offset
+            current.append(section)
+            current_tokens += tokens
+        offset += len(section)
+    flush()
+    return pieces
+
+
+def _report_chunk(index, piece):
+    digest = hashlib.sha256((MAP_PROMPT_VERSION + '\0' + piece).encode('utf-8')).hexdigest()
+    return ReportChunk(index, piece, digest)
+
+
+def chunk_report(text, max_tokens):
+    """Pack sections into ReportChunks of at most max_tokens each"""
+    chunks = []
+    for _, piece in _pack(text, max_tokens):
+        piece = piece.strip()
+        if piece:
+            chunks.append(_report_chunk(len(chunks), piece))
+    return chunks
+
+
+def _join_parts(summaries):
+    return "\n\n".join(f"Part {i + 1}:\n{summary}" for i, summary in enumerate(summaries))
+
+
+def _reference_notes(references):
+    if not references:
+        return ""
+    notes = "\n".join(f"- {chunk.title}: {chunk.text}" for chunk in references)
+    return f"Reference notes:\n{notes}\n\n"
+
+
+def report_messages(system_content, report_text, references=()):
+    """Messages for a single-call analysis of a report or report excerpt"""
+    prompt = f"Here's a medical report to analyze: {report_text}\n\n" + _reference_notes(references)
+    return [
+        {"role": "system", "content": system_content},
+        {"role": "user", "content": prompt + REPORT_INSTRUCTION},
+    ]
+
+
+class MapReduceAnalyzer:
+    """Analyzes long reports chunk by chunk through the ModelLake client"""
+
+    def __init__(self, model_client, cache, token_budget=3000, chunk_tokens=1500, max_workers=4):
+        self.model_client = model_client
+        self.cache = cache
+        self.token_budget = token_budget
+        self.chunk_tokens = chunk_tokens
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='report-map')
+
+    def fits(self, text):
+        return estimate_tokens(text) <= self.token_budget
+
+    def stream(self):
+        """A ReportStream to feed the text to while it is extracted"""
+        return ReportStream(self)
+
+    def analyze(self, text, system_content, references=(), stream=None):
+        """Return the merged analysis; raises ModelUnavailableError like chat_complete
+
+        Pass the ReportStream the text was fed to, to use the chunk summaries
+        it already started. Chunk summaries that finished before a failure
+        stay cached, so a retry only sends the rest.
+        """
+        if stream is not None:
+            summaries = stream.summaries()
+        else:
+            summaries = self._map(self._summarize, chunk_report(text, self.chunk_tokens))
+        return self._reduce(summaries, system_content, references)
+
+    def _map(self, function, items):
+        """function over items on the executor, in order"""
+        return self._gather([self._executor.submit(function, item) for item in items])
+
+    @staticmethod
+    def _gather(futures):
+        """Results of the futures in order; the first failure cancels those not yet started"""
+        done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in pending:
+            future.cancel()
+        for future in done:
+            if not future.cancelled() and future.exception() is not None:
+                raise future.exception()
+        return [future.result() for future in futures]
+
+    def _summarize(self, chunk):
+        # Keyed on the chunk text alone, so the prompt must not depend on the chunk's position
+        cached = self.cache.get(chunk.digest, 'chunk')
+        if cached is not None:
+            return cached
+        summary = self.model_client.chat_complete([
+            {"role": "system", "content": MAP_SYSTEM_PROMPT},
+            {"role": "user", "content": f"Report part:\n{chunk.text}"},
+        ])
+        self.cache.put(chunk.digest, 'chunk', summary)
+        return summary
+
+    def combine_reports(self, analyses, system_content):
+        """One cross-report summary from {report label: analysis}"""
+        summaries = [f"{label}\n{analysis}" for label, analysis in analyses.items()]
+        return self._reduce(summaries, system_content, (), header="Analyses of a patient's reports",
+                            instruction=COMBINE_INSTRUCTION)
+
+    def _reduce(self, summaries, system_content, references, header="Partial analyses of a medical report",
+                instruction=REDUCE_INSTRUCTION):
+        rounds = 0
+        while len(summaries) > 1 and not self.fits(_join_parts(summaries)):
+            # Too long for one prompt: merge groups of neighbouring summaries first
+            groups = self._group(summaries)
+            if len(groups) == len(summaries):
+                break
+            summaries = self._map(self._merge, groups)
+            rounds += 1
+        log.debug("report_reduce", parts=len(summaries), rounds=rounds)
+
+        prompt = f"{header}:\n\n{_join_parts(summaries)}\n\n" + _reference_notes(references)
+        return self.model_client.chat_complete([
+            {"role": "system", "content": system_content},
+            {"role": "user", "content": prompt + instruction},
+        ])
+
+    def _group(self, summaries):
+        groups = [[]]
+        tokens = 0
+        for summary in summaries:
+            size = estimate_tokens(summary)
+            if groups[-1] and tokens + size > self.token_budget:
+                groups.append([])
+                tokens = 0
+            groups[-1].append(summary)
+            tokens += size
+        return groups
+
+    def _merge(self, group):
+        if len(group) == 1:
+            return group[0]
+        return self.model_client.chat_complete([
+            {"role": "system", "content": MAP_SYSTEM_PROMPT},
+            {"role": "user", "content": "Merge these consecutive partial analyses into one list of results "
+                                        f"and findings, without a conclusion:\n\n{_join_parts(group)}"},
+        ])
+
+
+class ReportStream:
+    """Report text fed piece by piece, summarized chunk by chunk once it is long
+
+    The chunks are those chunk_report() makes of the whole text, except that a
+    section too long for one chunk may end a chunk early.
+    """
+
+    def __init__(self, analyzer):
+        self._analyzer = analyzer
+        self._pieces = []
+        self._chars = 0
+        self._started = False
+        self._tail = ''  # text that is not in a summarized chunk yet
+        self._futures = []
+
+    def feed(self, piece):
+        self._pieces.append(piece)
+        self._chars += len(piece)
+        if self._started:
+            self._tail += piece
+        elif self._chars > self._analyzer.token_budget * CHARS_PER_TOKEN:
+            self._started = True
+            self._tail = self.text()
+        else:
+            return  # fits the single-call prompt so far
+        if self._failed():
+            return
+        # Whole lines only: the line being extracted could still join another section
+        end = self._tail.rfind('\n') + 1
+        pieces = _pack(self._tail[:end], self._analyzer.chunk_tokens)
+        # The last piece can still grow
+        for _, text in pieces[:-1]:
+            self._submit(text)
+        if len(pieces) > 1:
+            self._tail = self._tail[pieces[-1][0]:]
+
+    def _submit(self, text):
+        text = text.strip()
+        if text:
+            chunk = _report_chunk(len(self._futures), text)
+            self._futures.append(self._analyzer._executor.submit(self._analyzer._summarize, chunk))
+
+    def _failed(self):
+        # The model is failing: send nothing more, summaries() raises the error
+        return any(future.done() and not future.cancelled() and future.exception() is not None
+                   for future in self._futures)
+
+    def text(self):
+        return ''.join(self._pieces)
+
+    def summaries(self):
+        """Summaries of every chunk, in order; raises the first failure"""
+        tail = self._tail if self._started else self.text()
+        if not self._failed():
+            for _, text in _pack(tail, self._analyzer.chunk_tokens):
+                self._submit(text)
+        self._started, self._tail = True, ''
+        return self._analyzer._gather(self._futures)
+
+    def cancel(self):
+        """Cancel the summaries not started yet, when the report will not be analyzed"""
+        for future in self._futures:
+            future.cancel()
@@ -0,0 +1,163 @@
+"""Per-session rate limits and load shedding for the model-bound endpoints.
+
+Each session token has a token bucket per budget ("chat", "report"). A bucket
+holds up to `burst` tokens and refills at `rate` tokens per second. A request
+spends one token, a batch upload one per file. A batch larger than the burst
+is let in when the bucket is full and leaves it in debt. An empty bucket means
+429 with a Retry-After of the seconds until the request would fit.
+
+Bucket state lives in a pluggable store, like job records: MemoryBucketStore
+for one process, SQLiteBucketStore to hold the limits across worker processes.
+
+AdmissionGate refuses new report work with 503 while the ModelLake or
+extraction queue is over its threshold, so a burst is turned away at once
+instead of queueing behind calls that would miss their deadlines anyway.
+"""
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from metrics import REGISTRY
+
+Budget = namedtuple('Budget', ['rate', 'burst'])
+Rejection = namedtuple('Rejection', ['status_code', 'error', 'retry_after'])
+
+REJECTIONS = REGISTRY.counter(
+    'medassist_rejected_total', 'Requests refused by rate limits or load shedding', ('budget', 'reason'))
+
+
+def _spend(tokens, updated, now, budget, cost):
+    """Return (tokens left, seconds to wait) for spending cost from a bucket last seen at updated"""
+    tokens = min(budget.burst, tokens + (now - updated) * budget.rate)
+    needed = min(cost, budget.burst)
+    if tokens >= needed:
+        return tokens - cost, 0.0
+    return tokens, (needed - tokens) / budget.rate
+
+
+def _full_at(tokens, now, budget):
+    return now + max(0.0, budget.burst - tokens) / budget.rate
+
+
+class MemoryBucketStore:
+    """Buckets in a process-local dict; buckets that have refilled are dropped"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = {}  # key -> (tokens, updated, full_at)
+        self._lock = threading.Lock()
+
+    def take(self, key, budget, cost, now):
+        """Spend cost tokens from key's bucket; return the seconds to wait, 0 when allowed"""
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (budget.burst, now, now))
+            tokens, wait = _spend(tokens, updated, now, budget, cost)
+            self._buckets[key] = (tokens, now, _full_at(tokens, now, budget))
+            if len(self._buckets) > self.max_keys:
+                # A bucket that is full again is the same as no bucket
+                self._buckets = {k: v for k, v in self._buckets.items() if v[2] > now}
+        return wait
+
+
+class SQLiteBucketStore:
+    """Buckets in a SQLite table shared by every process using the same file"""
+
+    # Refilled buckets are deleted once every this many takes
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._takes = 0
+        self._connection().execute("""
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL,
+                full_at REAL NOT NULL
+            )
+        """)
+
+    def _connection(self):
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, budget, cost, now):
+        """Spend cost tokens from key's bucket; return the seconds to wait, 0 when allowed"""
+        conn = self._connection()
+        self._takes += 1
+        # The read and the write must not interleave with another process
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (budget.burst, now)
+            tokens, wait = _spend(tokens, updated, now, budget, cost)
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)",
+                         (key, tokens, now, _full_at(tokens, now, budget)))
+            if self._takes % self.PRUNE_EVERY == 0:
+                conn.execute("DELETE FROM buckets WHERE full_at <= ?", (now,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+
+class RateLimiter:
+    """Token-bucket budgets per session token"""
+
+    def __init__(self, store, budgets, clock=time.time):
+        self.store = store
+        self.budgets = budgets
+        self.clock = clock
+
+    @classmethod
+    def from_env(cls, store):
+        return cls(store, {
+            'chat': Budget(rate=float(os.environ.get('RATE_LIMIT_CHAT_PER_MINUTE', 60)) / 60,
+                           burst=float(os.environ.get('RATE_LIMIT_CHAT_BURST', 20))),
+            'report': Budget(rate=float(os.environ.get('RATE_LIMIT_REPORT_PER_MINUTE', 10)) / 60,
+                             burst=float(os.environ.get('RATE_LIMIT_REPORT_BURST', 5))),
+        })
+
+    def check(self, token, budget_name, cost=1):
+        """Spend from token's budget; return a Rejection when it is exhausted, else None"""
+        budget = self.budgets[budget_name]
+        # Session tokens are credentials, so the store only sees a hash of them
+        key = budget_name + ':' + hashlib.blake2b(token.encode('utf-8'), digest_size=16).hexdigest()
+        wait = self.store.take(key, budget, cost, self.clock())
+        if wait <= 0:
+            return None
+        REJECTIONS.inc(budget=budget_name, reason='rate_limit')
+        return Rejection(429, "Too many requests, please slow down", math.ceil(wait))
+
+
+class AdmissionGate:
+    """Refuses new work while a watched queue is at or over its limit"""
+
+    def __init__(self, retry_after=5):
+        self.retry_after = retry_after
+        self._queues = []
+
+    def watch(self, name, depth, limit):
+        """depth() returns the current queue length; a limit of 0 disables the check"""
+        if limit > 0:
+            self._queues.append((name, depth, limit))
+
+    def check(self):
+        """Return a Rejection when any watched queue is full, else None"""
+        for name, depth, limit in self._queues:
+            if depth() >= limit:
+                REJECTIONS.inc(budget='admission', reason=name)
+                return Rejection(503, "The service is busy, please try again shortly", self.retry_after)
+        return None
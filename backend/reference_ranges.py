@@ -0,0 +1,181 @@
+"""Reference ranges of lab analytes, loaded from data/reference_ranges.csv.
+
+Each row of the table is one analyte, sex and age band with its low and high
+bounds, and the rows are held in parallel NumPy arrays with the rows of each
+analyte stored together. flag() compares every value of a report in one
+vectorized pass: the candidate rows of all values are gathered with a single
+index array, rows for another sex or age band are masked out, and each value's
+bounds are reduced over its own rows. The work per report depends on the rows
+of the analytes it mentions, not on the size of the table.
+
+Values are first converted to the analyte's unit. Factors that depend on the
+analyte (mmol/L to mg/dL differs for glucose and cholesterol) come from
+data/unit_conversions.csv. A value whose unit does not convert is not flagged.
+
+NumPy is imported when the arrays are first needed, so importing the app stays
+cheap; lazy.warm_up() builds them ahead of the first report.
+"""
+import csv
+import math
+import os
+from collections import namedtuple
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+REFERENCE_RANGES_PATH = os.environ.get('REFERENCE_RANGES_PATH', os.path.join(DATA_DIR, 'reference_ranges.csv'))
+UNIT_CONVERSIONS_PATH = os.environ.get('UNIT_CONVERSIONS_PATH', os.path.join(DATA_DIR, 'unit_conversions.csv'))
+
+SEXES = ('any', 'female', 'male')
+FLAGS = ('normal', 'low', 'high')
+
+# Reports rarely state the patient's age; the adult bands apply then
+ADULT_AGE = 40
+
+# Count units are interchangeable ("cells/μL" and "/μL" measure the same thing)
+COUNT_UNITS = {"cells/μL", "/μL"}
+
+# age_min is inclusive and age_max exclusive; open bounds are -inf/inf
+RangeRow = namedtuple('RangeRow', ['analyte', 'unit', 'sex', 'age_min', 'age_max', 'low', 'high', 'note'])
+RangeArrays = namedtuple('RangeArrays', ['starts', 'counts', 'sex', 'age_min', 'age_max', 'low', 'high'])
+
+
+def _read_csv(path):
+    """Rows of a CSV file as dicts; lines starting with # are comments"""
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(line for line in f if not line.startswith('#')))
+
+
+def _bound(text, default):
+    text = (text or '').strip()
+    return float(text) if text else default
+
+
+def _number(value):
+    return f"{value:,g}"
+
+
+def _with_unit(text, unit):
+    # "36-48%" and "150,000-450,000/μL", but "12-16 g/dL"
+    return text + unit if unit[:1] in ('%', '/') else f"{text} {unit}"
+
+
+class ReferenceRanges:
+    """Reference-range table with per-analyte unit conversions"""
+
+    def __init__(self, rows, conversions=None):
+        # Stable sort: rows of an analyte stay in file order
+        self.rows = sorted(rows, key=lambda row: row.analyte)
+        self.units = {}
+        self._row_slices = {}
+        for position, row in enumerate(self.rows):
+            first = self._row_slices.get(row.analyte, slice(position, position)).start
+            self._row_slices[row.analyte] = slice(first, position + 1)
+            if row.sex not in SEXES:
+                raise ValueError(f"{row.analyte}: unknown sex {row.sex!r}")
+            if self.units.setdefault(row.analyte, row.unit) != row.unit:
+                raise ValueError(f"{row.analyte}: rows use both {self.units[row.analyte]} and {row.unit}")
+        self.analytes = list(self.units)
+        self.analyte_index = {analyte: i for i, analyte in enumerate(self.analytes)}
+        self.conversions = dict(conversions or {})
+        self._descriptions = {}
+        self._arrays = None
+
+    @classmethod
+    def load(cls, ranges_path=REFERENCE_RANGES_PATH, conversions_path=UNIT_CONVERSIONS_PATH):
+        rows = [
+            RangeRow(r['analyte'].strip().lower(), r['unit'].strip(), (r['sex'] or 'any').strip().lower(),
+                     _bound(r['age_min'], 0.0), _bound(r['age_max'], math.inf),
+                     _bound(r['low'], -math.inf), _bound(r['high'], math.inf), (r.get('note') or '').strip())
+            for r in _read_csv(ranges_path)
+        ]
+        conversions = {}
+        if conversions_path and os.path.exists(conversions_path):
+            conversions = {(r['analyte'].strip().lower(), r['unit'].strip()): float(r['factor'])
+                           for r in _read_csv(conversions_path)}
+        return cls(rows, conversions)
+
+    def __contains__(self, analyte):
+        return analyte in self.units
+
+    def __len__(self):
+        return len(self.rows)
+
+    def unit(self, analyte):
+        return self.units[analyte]
+
+    def factor(self, analyte, unit):
+        """Multiplier taking a value in unit to the analyte's unit, or None when they do not convert"""
+        target = self.units[analyte]
+        if unit == target or (unit in COUNT_UNITS and target in COUNT_UNITS):
+            return 1.0
+        return self.conversions.get((analyte, unit))
+
+    def describe(self, analyte):
+        """Human-readable ranges of an analyte, e.g. "12-16 g/dL (females, ages 18+), ..." """
+        description = self._descriptions.get(analyte)
+        if description is None:
+            parts = []
+            for row in self.rows[self._row_slices[analyte]]:
+                if math.isinf(row.low):
+                    text = _with_unit(f"<{_number(row.high)}", row.unit)
+                elif math.isinf(row.high):
+                    text = _with_unit(f">{_number(row.low)}", row.unit)
+                else:
+                    text = _with_unit(f"{_number(row.low)}-{_number(row.high)}", row.unit)
+                qualifiers = []
+                if row.sex != 'any':
+                    qualifiers.append(row.sex + 's')
+                if row.age_min > 0 or not math.isinf(row.age_max):
+                    qualifiers.append(f"ages {row.age_min:g}+" if math.isinf(row.age_max)
+                                      else f"ages {row.age_min:g}-{row.age_max - 1:g}")
+                if row.note:
+                    qualifiers.append(row.note)
+                parts.append(f"{text} ({', '.join(qualifiers)})" if qualifiers else text)
+            description = self._descriptions[analyte] = ", ".join(parts)
+        return description
+
+    def arrays(self):
+        """The table as NumPy arrays, built on first use"""
+        if self._arrays is None:
+            import numpy as np
+            analyte_ids = np.array([self.analyte_index[row.analyte] for row in self.rows], dtype=np.intp)
+            counts = np.bincount(analyte_ids, minlength=len(self.analytes))
+            # Concurrent first calls build identical arrays; the last assignment wins
+            self._arrays = RangeArrays(
+                starts=np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.intp),
+                counts=counts,
+                sex=np.array([SEXES.index(row.sex) for row in self.rows], dtype=np.int8),
+                age_min=np.array([row.age_min for row in self.rows]),
+                age_max=np.array([row.age_max for row in self.rows]),
+                low=np.array([row.low for row in self.rows]),
+                high=np.array([row.high for row in self.rows]),
+            )
+        return self._arrays
+
+    def flag(self, analytes, values, sex=None, age=None):
+        """'low', 'high' or 'normal' for each value, already in its analyte's unit
+
+        None where the value is NaN or no range applies. Without a sex the
+        widest bounds over both sexes are used, as a value inside either
+        range is not abnormal; without an age the adult bands apply.
+        """
+        if not analytes:
+            return []
+        import numpy as np
+        table = self.arrays()
+        ids = np.fromiter((self.analyte_index[analyte] for analyte in analytes), dtype=np.intp, count=len(analytes))
+        counts = table.counts[ids]
+        segments = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        # Row numbers of every candidate range, the rows of each value side by side
+        rows = np.repeat(table.starts[ids] - segments, counts) + np.arange(counts.sum())
+
+        age = ADULT_AGE if age is None else age
+        applies = (table.age_min[rows] <= age) & (age < table.age_max[rows])
+        if sex in ('female', 'male'):
+            applies &= (table.sex[rows] == 0) | (table.sex[rows] == SEXES.index(sex))
+        low = np.minimum.reduceat(np.where(applies, table.low[rows], np.inf), segments)
+        high = np.maximum.reduceat(np.where(applies, table.high[rows], -np.inf), segments)
+
+        values = np.asarray(values, dtype=np.float64)
+        codes = np.where(values < low, 1, np.where(values > high, 2, 0))
+        known = ~np.isnan(values) & (low <= high)
+        return [FLAGS[code] if ok else None for code, ok in zip(codes.tolist(), known.tolist())]
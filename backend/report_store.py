@@ -0,0 +1,389 @@
+"""Content-addressed storage for uploaded reports and a cache of their analyses.
+
+Uploads are written under their SHA-256 digest, so identical files share one
+copy on disk and two users uploading "report.pdf" never overwrite each other.
+The digest also keys the analysis cache: a memory LRU bounded by total bytes,
+backed by an on-disk tier that survives restarts.
+
+The file type is sniffed from the first bytes of the upload, not taken from
+the client's file name, and each type has its own size cap that is enforced
+while the body streams to disk, so no upload is ever held in memory whole.
+With UploadStore.spool as the request parser's stream factory, the parser
+writes each file part into the upload folder and saving it is a rename.
+"""
+import codecs
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+CHUNK_SIZE = 64 * 1024
+
+# Default size cap per sniffed type, in bytes
+TYPE_LIMITS = {
+    'pdf': 50 * 1024 * 1024,
+    'docx': 20 * 1024 * 1024,
+    'txt': 5 * 1024 * 1024,
+}
+
+
+class UploadError(ValueError):
+    """An upload that cannot be accepted; status_code is the HTTP status to return"""
+    status_code = 400
+
+
+class UnsupportedUploadError(UploadError):
+    status_code = 415
+
+
+class UploadTooLargeError(UploadError):
+    status_code = 413
+
+
+class EmptyUploadError(UploadError):
+    pass
+
+
+def sniff_type(head):
+    """Return 'pdf', 'docx' or 'txt' from the first bytes of a file, or None"""
+    if head.startswith(b'%PDF-'):
+        return 'pdf'
+    if head.startswith(b'PK\x03\x04'):
+        return 'docx'  # the zip container is checked by the DOCX parser
+    if not head or b'\x00' in head:
+        return None
+    try:
+        # The head may end in the middle of a multi-byte character
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+    except UnicodeDecodeError:
+        return None
+    return 'txt'
+
+
+def sniff_file_type(file_path, size=CHUNK_SIZE):
+    with open(file_path, 'rb') as f:
+        return sniff_type(f.read(size))
+
+
+_UPLOAD_DIR = re.compile(r'^[0-9a-f]{2}$')
+
+
+class UploadStore:
+    """Stores uploaded files under <root>/<aa>/<sha256>.<type>
+
+    Uploads not stored again for ttl seconds are deleted, and beyond max_bytes
+    the least recently stored ones are, but never one younger than min_age,
+    which may still be waiting for its analysis. A sweep runs on a background
+    thread at most every sweep_interval seconds, started by save(). Other
+    files under root (the caches, job and rate limit databases) are left alone.
+    """
+
+    def __init__(self, root, chunk_size=CHUNK_SIZE, type_limits=None, ttl=None, max_bytes=None,
+                 min_age=3600.0, sweep_interval=600.0, clock=time.time):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.type_limits = dict(TYPE_LIMITS, **(type_limits or {}))
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.min_age = min_age
+        self.sweep_interval = sweep_interval
+        self.clock = clock
+        self._next_sweep = clock() + sweep_interval
+        self._sweep_lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, root, type_limits=None):
+        ttl = float(os.environ.get('UPLOAD_TTL', 7 * 24 * 3600))
+        max_bytes = int(os.environ.get('UPLOAD_STORE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+        return cls(root, type_limits=type_limits, ttl=ttl or None, max_bytes=max_bytes or None)
+
+    def path_for(self, digest, extension=''):
+        return os.path.join(self.root, digest[:2], digest + extension)
+
+    def spool(self, *args, **kwargs):
+        """Stream factory for the form parser: a file part written into the upload folder"""
+        return tempfile.NamedTemporaryFile('wb+', dir=self.root, prefix='spool-', suffix='.part', delete=False)
+
+    def _is_spool(self, stream):
+        name = getattr(stream, 'name', None)
+        return (isinstance(name, str) and os.path.basename(name).startswith('spool-')
+                and os.path.dirname(os.path.abspath(name)) == os.path.abspath(self.root))
+
+    def discard_spooled(self, files):
+        """Remove the spooled file parts of a request that were not saved"""
+        for file in (files or {}).values():
+            stream = getattr(file, 'stream', None)
+            if self._is_spool(stream):
+                stream.close()
+                if os.path.exists(stream.name):
+                    os.remove(stream.name)
+
+    def _file_type(self, head, filename):
+        if not head:
+            raise EmptyUploadError("Could not extract text from file")
+        file_type = sniff_type(head)
+        if file_type is None:
+            raise UnsupportedUploadError(f"Unsupported file type: {filename}")
+        return file_type
+
+    def _check_size(self, file_type, size):
+        limit = self.type_limits[file_type]
+        if size > limit:
+            raise UploadTooLargeError(f"{file_type.upper()} files are limited to {limit / (1024 * 1024):.3g} MB")
+
+    def _place(self, temp_path, digest, file_type):
+        path = self.path_for(digest, '.' + file_type)
+        try:
+            # Same content already stored: keep the existing copy, now recently used
+            os.utime(path)
+            os.remove(temp_path)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+        self._maybe_sweep()
+        return digest, path
+
+    def _maybe_sweep(self):
+        if self.ttl is None and self.max_bytes is None:
+            return
+        now = self.clock()
+        with self._sweep_lock:
+            if now < self._next_sweep:
+                return
+            self._next_sweep = now + self.sweep_interval
+        threading.Thread(target=self.sweep, name='upload-sweep', daemon=True).start()
+
+    def _files(self):
+        """(mtime, path, size) of every stored upload and left-over partial file"""
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.endswith('.part'):
+                paths = [path]
+            elif _UPLOAD_DIR.match(name) and os.path.isdir(path):
+                paths = [os.path.join(path, child) for child in os.listdir(path)]
+            else:
+                continue
+            for file_path in paths:
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    continue  # stored again or swept by another worker meanwhile
+                entries.append((stat.st_mtime, file_path, stat.st_size))
+        return sorted(entries)
+
+    def sweep(self, now=None):
+        """Delete expired uploads, then the oldest while over max_bytes; return how many"""
+        now = self.clock() if now is None else now
+        entries = self._files()
+        total = sum(size for _, _, size in entries)
+        removed = 0
+        for mtime, path, size in entries:
+            age = now - mtime
+            if age < self.min_age:
+                break  # the rest are younger still
+            expired = self.ttl is not None and age > self.ttl
+            partial = path.endswith('.part')  # an upload that was never stored
+            if not (expired or partial or (self.max_bytes is not None and total > self.max_bytes)):
+                continue
+            try:
+                # Stored again since it was listed: keep it
+                if now - os.stat(path).st_mtime >= self.min_age:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        return removed
+
+    def save(self, file, filename):
+        """Stream an upload to disk while hashing it; return (digest, path)
+
+        A file the parser spooled into the upload folder is hashed and renamed
+        instead of copied. Raises EmptyUploadError for an empty file,
+        UnsupportedUploadError when the content is not a PDF, DOCX or text
+        file, and UploadTooLargeError once it passes its type's cap.
+        """
+        stream = getattr(file, 'stream', None)
+        if self._is_spool(stream):
+            return self._save_spooled(stream, filename)
+        sha256 = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                head = file.read(self.chunk_size)
+                file_type = self._file_type(head, filename)
+                size = 0
+                chunk = head
+                while chunk:
+                    size += len(chunk)
+                    self._check_size(file_type, size)
+                    sha256.update(chunk)
+                    out.write(chunk)
+                    chunk = file.read(self.chunk_size)
+            return self._place(temp_path, sha256.hexdigest(), file_type)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _save_spooled(self, stream, filename):
+        try:
+            stream.flush()
+            stream.seek(0)
+            head = stream.read(self.chunk_size)
+            file_type = self._file_type(head, filename)
+            self._check_size(file_type, os.fstat(stream.fileno()).st_size)
+            sha256 = hashlib.sha256(head)
+            for chunk in iter(lambda: stream.read(self.chunk_size), b''):
+                sha256.update(chunk)
+            stream.seek(0)
+            return self._place(stream.name, sha256.hexdigest(), file_type)
+        except BaseException:
+            if os.path.exists(stream.name):
+                os.remove(stream.name)
+            raise
+
+
+class AnalysisCache:
+    """Two-tier cache of JSON-serializable values keyed by (digest, kind)
+
+    Both tiers evict least recently used entries once their total size in
+    bytes exceeds the configured limit. The disk tier may be shared by
+    several worker processes: a lookup reads the file itself, so entries
+    written by other workers are found, and each worker bounds the files it
+    has read or written. Disk I/O happens outside the lock.
+    """
+
+    def __init__(self, directory, max_memory_bytes=32 * 1024 * 1024, max_disk_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()  # key -> (value, size)
+        self._memory_bytes = 0
+        self._disk = OrderedDict()  # path -> size, oldest first
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0,
+                         "memory_evictions": 0, "disk_evictions": 0}
+        os.makedirs(directory, exist_ok=True)
+        self._load_disk_index()
+
+    def _load_disk_index(self):
+        """Rebuild the disk tier index from what previous processes left behind"""
+        entries = []
+        for dirpath, _, filenames in os.walk(self.directory):
+            for name in filenames:
+                if name.endswith('.json'):
+                    path = os.path.join(dirpath, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue  # evicted by another worker meanwhile
+                    entries.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(entries):
+            self._disk[path] = size
+            self._disk_bytes += size
+
+    def _disk_path(self, digest, kind):
+        return os.path.join(self.directory, digest[:2], f"{digest}.{kind}.json")
+
+    def get(self, digest, kind):
+        """Return the cached value or None"""
+        key = (digest, kind)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return self._memory[key][0]
+
+        path = self._disk_path(digest, kind)
+        try:
+            with open(path, 'rb') as f:
+                payload = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._forget_disk(path)
+                self.counters["misses"] += 1
+            return None
+        value = json.loads(payload)
+        with self._lock:
+            # The file may be another worker's or rewritten since it was indexed
+            self._index_disk(path, len(payload))
+            self._remember(key, value, len(payload))
+            self.counters["disk_hits"] += 1
+        self._evict_disk()
+        return value
+
+    def put(self, digest, kind, value):
+        """Cache a value in memory and on disk"""
+        payload = json.dumps(value).encode('utf-8')
+        path = self._disk_path(digest, kind)
+        with self._lock:
+            self._remember((digest, kind), value, len(payload))
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(payload)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        with self._lock:
+            self._index_disk(path, len(payload))
+        self._evict_disk()
+
+    def _index_disk(self, path, size):
+        self._forget_disk(path)
+        self._disk[path] = size
+        self._disk_bytes += size
+
+    def _evict_disk(self):
+        """Delete the least recently used files until the disk tier fits"""
+        while True:
+            with self._lock:
+                if self._disk_bytes <= self.max_disk_bytes or len(self._disk) <= 1:
+                    return
+                oldest, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+            try:
+                os.remove(oldest)
+            except FileNotFoundError:
+                continue  # another worker evicted it; only this index was stale
+            with self._lock:
+                self.counters["disk_evictions"] += 1
+
+    def _remember(self, key, value, size):
+        if key in self._memory:
+            self._memory_bytes -= self._memory.pop(key)[1]
+        self._memory[key] = (value, size)
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            _, (_, evicted_size) = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted_size
+            self.counters["memory_evictions"] += 1
+
+    def _forget_disk(self, path):
+        if path in self._disk:
+            self._disk_bytes -= self._disk.pop(path)
+
+    def stats(self):
+        """Counters plus the current size of each tier"""
+        with self._lock:
+            stats = dict(self.counters)
+            stats.update({
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            })
+            return stats
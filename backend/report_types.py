@@ -0,0 +1,95 @@
+"""Multi-label classification of report types.
+
+Every indicator term of every report type is compiled into one alternation,
+so a report is scanned once into a sparse vector of term counts. The scores of
+all report types come from a single product of the (log-damped) counts with a
+term-by-type weight matrix, and a batch of reports is scored with one matrix
+product. A report can carry several labels: a combined CBC and lipid panel is
+both a blood test and a lipid panel.
+"""
+import os
+import re
+from collections import namedtuple
+
+import numpy as np
+
+ReportLabel = namedtuple('ReportLabel', ['label', 'confidence'])
+
+# label, {indicator term: weight}; panel names count double. Ties between equal
+# scores go to the type listed first, the order of the old if/elif chain
+REPORT_TYPES = [
+    ("Blood Test", {"cbc": 2, "complete blood count": 2, "wbc": 1, "rbc": 1, "hemoglobin": 1, "hematocrit": 1}),
+    ("Urinalysis", {"urinalysis": 2, "urine": 1}),
+    ("Glucose/Diabetes Test", {"glucose": 1, "hba1c": 1, "blood sugar": 1}),
+    ("Lipid Panel", {"lipid": 2, "cholesterol": 1, "hdl": 1, "ldl": 1, "triglycerides": 1}),
+    ("X-Ray Report", {"x-ray": 2, "xray": 2, "radiograph": 2}),
+    ("MRI Report", {"mri": 2, "magnetic resonance": 2}),
+    ("CT Scan", {"ct scan": 2, "cat scan": 2}),
+    ("Ultrasound", {"ultrasound": 2, "sonogram": 2, "doppler": 1}),
+    ("ECG/EKG", {"ecg": 2, "ekg": 2, "electrocardiogram": 2}),
+]
+
+# Scores just over this are confidence 0.5: one panel name, or two distinct analytes
+CONFIDENCE_SCALE = 1.38
+
+
+class ReportTypeClassifier:
+    """Scores every report type from one scan of the text"""
+
+    def __init__(self, report_types=REPORT_TYPES, min_confidence=0.5):
+        self.labels = [label for label, _ in report_types]
+        self.min_confidence = min_confidence
+        self.terms = sorted({term for _, terms in report_types for term in terms}, key=lambda t: (-len(t), t))
+        self.term_index = {term: i for i, term in enumerate(self.terms)}
+        self.weights = np.zeros((len(self.terms), len(self.labels)), dtype=np.float32)
+        for column, (_, terms) in enumerate(report_types):
+            for term, weight in terms.items():
+                self.weights[self.term_index[term], column] = weight
+        # Whole words only ("lipid" is not in "hyperlipidemia"); a plural "s" is allowed
+        alternation = '|'.join(re.escape(term) for term in self.terms)
+        self.pattern = re.compile(f'(?<![a-z0-9])({alternation})s?(?![a-z0-9])')
+
+    @classmethod
+    def from_env(cls):
+        return cls(min_confidence=float(os.environ.get('REPORT_TYPE_MIN_CONFIDENCE', 0.5)))
+
+    def term_counts(self, text):
+        """Sparse term counts of a lowercased text as {term index: count}"""
+        counts = {}
+        for match in self.pattern.finditer(text):
+            index = self.term_index[match.group(1)]
+            counts[index] = counts.get(index, 0) + 1
+        return counts
+
+    def confidences(self, texts):
+        """(documents x report types) array of confidences in [0, 1) for lowercased texts"""
+        rows, columns, values = [], [], []
+        for row, text in enumerate(texts):
+            for column, count in self.term_counts(text).items():
+                rows.append(row)
+                columns.append(column)
+                values.append(count)
+        counts = np.zeros((len(texts), len(self.terms)), dtype=np.float32)
+        counts[rows, columns] = values
+        # Repeats of a term add less and less; each further distinct term adds its full weight
+        scores = np.log1p(counts) @ self.weights
+        return scores / (scores + CONFIDENCE_SCALE)
+
+    def classify_many(self, texts):
+        """Labels of each text, most confident first
+
+        The best-scoring type is kept whenever any indicator term occurs; other
+        types need min_confidence.
+        """
+        confidences = self.confidences([text.lower() for text in texts])
+        orders = np.argsort(-confidences, axis=1, kind='stable')
+        results = []
+        for row, order in zip(confidences.tolist(), orders.tolist()):
+            results.append([ReportLabel(self.labels[column], round(row[column], 3))
+                            for rank, column in enumerate(order)
+                            if row[column] > 0 and (rank == 0 or row[column] >= self.min_confidence)])
+        return results
+
+    def classify(self, text):
+        """Labels of one text, most confident first"""
+        return self.classify_many([text])[0]
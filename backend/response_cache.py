@@ -0,0 +1,244 @@
+"""Local cache of ModelLake answers keyed on the normalized prompt.
+
+The last message of a prompt is the question; everything before it (the
+system prompt) is its context. An answer is stored under a hash of the
+context and the normalized question. A prompt is answered from the cache on:
+
+    exact  the same context and the same question after lowercasing and
+           collapsing punctuation and whitespace
+    near   only with threshold < 1 (off by default): the same context, the
+           same key words and a question whose content words (stop words
+           dropped, plural "s" stripped) have a Jaccard similarity of at
+           least `threshold` to a cached one's, estimated with MinHash and
+           looked up through LSH bands
+
+The key words are matched exactly because one of them changes the answer
+while barely changing the word set: question words and modals ("When
+should I take ibuprofen?" and "Who should take ibuprofen?"), negations
+("no fracture"), directions ("high" or "low potassium"), who is asked about
+("child" or "adult") and the side of the body. Other words that change the
+meaning, such as a drug or a test name, are only told apart by the
+threshold, which is why near matching is off unless configured.
+
+Questions that contain personal values (digits, such as temperatures, lab
+values, dates or phone numbers, and e-mail addresses) are not cached, as
+their text is patient data. With personal=True they are cached and matched
+exactly on their raw text only: a near match could answer with someone
+else's numbers.
+
+Entries expire after `ttl` seconds and the least recently used entry is
+evicted beyond `max_entries`. Everything is in process memory.
+"""
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+CacheEntry = namedtuple('CacheEntry', ['answer', 'expires', 'context', 'signature'])
+
+PERSONAL_VALUE = re.compile(r"\d|@")
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+
+_MERSENNE = (1 << 61) - 1
+
+# Words that do not change what is being asked
+STOP_WORDS = frozenset("""
+    a an and are am be been do does did for from had has have i i'm im in is it its me my of on or
+    please so that the there this to was with you your
+""".split())
+
+# Words that do: a near match needs the same set of them
+QUESTION_WORDS = frozenset("""
+    how what when where which who whom whose why can could may might must shall should will would
+""".split())
+KEY_TERMS = frozenset("""
+    no not never none nor without t
+    high higher low lower elevated raised increased increase decreased decrease reduced above below over under
+    up down more less positive negative normal abnormal before after
+    child children kid kids baby babies infant infants toddler teen teenager adult adults elderly
+    pregnant pregnancy breastfeeding man men woman women male female
+    left right
+""".split())  # "t" is what is left of "n't" once punctuation is dropped
+KEY_WORDS = QUESTION_WORDS | KEY_TERMS
+
+
+def normalize(text):
+    """Lowercase, punctuation to spaces, whitespace collapsed"""
+    return ' '.join(_PUNCTUATION.sub(' ', text.lower()).split())
+
+
+def key_words(text):
+    """The normalized text's question words, modals and key terms"""
+    return frozenset(word for word in text.split() if word in KEY_WORDS)
+
+
+def content_words(text):
+    """The normalized text's other words that carry meaning, plurals folded"""
+    words = set()
+    for word in text.split():
+        if word not in STOP_WORDS and word not in KEY_WORDS:
+            words.add(word[:-1] if len(word) > 3 and word.endswith('s') and not word.endswith('ss') else word)
+    return words
+
+
+def _hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class MinHasher:
+    """MinHash signatures of word sets with seeded universal hash functions"""
+
+    def __init__(self, num_perm=64, seed=1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self.params = [(rng.randrange(1, _MERSENNE), rng.randrange(0, _MERSENNE)) for _ in range(num_perm)]
+
+    def signature(self, words):
+        hashes = [_hash64(word) for word in words]
+        return tuple(min((a * h + b) % _MERSENNE for h in hashes) for a, b in self.params)
+
+    @staticmethod
+    def similarity(first, second):
+        """Estimated Jaccard similarity of the word sets"""
+        return sum(x == y for x, y in zip(first, second)) / len(first)
+
+
+class ResponseCache:
+    """TTL and size bounded answer cache with exact and near-duplicate lookup"""
+
+    # personal counts lookups of prompts with personal values, whatever their outcome
+    counters = ('exact_hits', 'near_hits', 'misses', 'personal', 'stores', 'evictions', 'expirations')
+
+    def __init__(self, ttl=3600.0, max_entries=10000, threshold=1.0, num_perm=64, bands=16, personal=False,
+                 clock=time.monotonic):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.personal = personal
+        self.clock = clock
+        self.hasher = MinHasher(num_perm)
+        self._entries = OrderedDict()  # key -> CacheEntry, least recently used first
+        self._buckets = {}  # (context, band, band hash) -> set of keys
+        self._stats = dict.fromkeys(self.counters, 0)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            ttl=float(os.environ.get('RESPONSE_CACHE_TTL', 3600)),
+            max_entries=int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 10000)),
+            threshold=float(os.environ.get('RESPONSE_CACHE_THRESHOLD', 1)),
+            personal=os.environ.get('RESPONSE_CACHE_PERSONAL', '0').lower() in ('1', 'true', 'yes'),
+        )
+
+    def _prepare(self, messages):
+        """(near-match context hash, exact key, signature or None for exact-only, cacheable)"""
+        question = messages[-1].get('content', '') if messages else ''
+        context = '\x00'.join(f"{m.get('role')}\x01{m.get('content', '')}" for m in messages[:-1])
+        if PERSONAL_VALUE.search(question):
+            # Only the very same text, whitespace aside, may share an answer
+            context = _hash64(context)
+            return context, ('raw', context, ' '.join(question.split())), None, self.personal
+        text = normalize(question)
+        # Near matches are only looked up among questions with the same key words
+        context = _hash64(context + '\x00' + ' '.join(sorted(key_words(text))))
+        words = content_words(text) if self.threshold < 1 else None
+        signature = self.hasher.signature(words) if words else None
+        return context, ('normalized', context, text), signature, True
+
+    def _band_keys(self, context, signature):
+        for band in range(self.bands):
+            yield context, band, hash(signature[band * self.rows:(band + 1) * self.rows])
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        if entry.signature is not None:
+            for band_key in self._band_keys(entry.context, entry.signature):
+                keys = self._buckets.get(band_key)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._buckets[band_key]
+
+    def _live(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires <= now:
+            self._drop(key)
+            self._stats['expirations'] += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, messages):
+        """Return a cached answer for the prompt, or None"""
+        context, key, signature, cacheable = self._prepare(messages)
+        now = self.clock()
+        with self._lock:
+            if key[0] == 'raw':
+                self._stats['personal'] += 1
+            if not cacheable:
+                return None
+            entry = self._live(key, now)
+            if entry is not None:
+                self._stats['exact_hits'] += 1
+                return entry.answer
+            if signature is not None:
+                candidates = set()
+                for band_key in self._band_keys(context, signature):
+                    candidates.update(self._buckets.get(band_key, ()))
+                best, best_score = None, self.threshold
+                for candidate in candidates:
+                    entry = self._entries[candidate]
+                    if entry.expires <= now:
+                        # Expired entries make way for the next best live one
+                        self._drop(candidate)
+                        self._stats['expirations'] += 1
+                        continue
+                    score = MinHasher.similarity(signature, entry.signature)
+                    if score >= best_score:
+                        best, best_score = candidate, score
+                if best is not None:
+                    self._entries.move_to_end(best)
+                    self._stats['near_hits'] += 1
+                    return self._entries[best].answer
+            self._stats['misses'] += 1
+        return None
+
+    def put(self, messages, answer):
+        """Store the answer the model gave for the prompt"""
+        context, key, signature, cacheable = self._prepare(messages)
+        if not cacheable:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = CacheEntry(answer, self.clock() + self.ttl, context, signature)
+            if signature is not None:
+                for band_key in self._band_keys(context, signature):
+                    self._buckets.setdefault(band_key, set()).add(key)
+            self._stats['stores'] += 1
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['exact_hits'] + stats['near_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['exact_hits'] + stats['near_hits']) / lookups, 4) if lookups else 0.0
+        return stats
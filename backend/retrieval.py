@@ -0,0 +1,376 @@
+"""Chunk retrieval for report analysis prompts.
+
+Extracted reports and the curated reference corpus (data/reference_corpus.jsonl)
+are split into chunks and embedded with a hashing embedder: every word and
+word pair is hashed to one of `dim` signed slots, so no model or vocabulary has
+to be loaded. Vectors are stored column-major (one row per dimension) in a
+NumPy array that can be saved and reopened as a memory map. A short query only
+touches a few dimensions, so a search reads just those rows and keeps the top
+k with argpartition; at 100k chunks that is a few milliseconds.
+
+The reference index is cached on disk per corpus and dimension. It is written
+to a temporary directory and renamed into place, so workers that build it at
+the same time never read each other's partial files.
+
+VectorLakeRetriever serves the reference corpus from Groclake VectorLake
+instead of the local index. The corpus is pushed once, by warm_up() or by
+
+    python retrieval.py push-vectorlake
+
+which prints the id to set as VECTORLAKE_ID.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+from lab_values import scan_lab_report
+from structured_log import get_logger
+
+log = get_logger('retrieval')
+
+DEFAULT_DIM = 256
+DEFAULT_CHUNK_CHARS = 800
+REFERENCE_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'reference_corpus.jsonl')
+
+Chunk = namedtuple('Chunk', ['text', 'source', 'title', 'offset'])
+Hit = namedtuple('Hit', ['score', 'chunk'])
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the this to was were with
+""".split())
+
+
+def chunk_text(text, max_chars=DEFAULT_CHUNK_CHARS, source='report', title=''):
+    """Split text into chunks of whole lines, each at most max_chars long
+
+    A single line longer than max_chars becomes a chunk of its own, split at
+    max_chars.
+    """
+    chunks = []
+    current = []
+    current_len = 0
+    start = 0
+    offset = 0
+    for line in text.splitlines(keepends=True):
+        while len(line) > max_chars:
+            if current:
+                chunks.append(Chunk(''.join(current).strip(), source, title, start))
+                current, current_len = [], 0
+            chunks.append(Chunk(line[:max_chars].strip(), source, title, offset))
+            line = line[max_chars:]
+            offset += max_chars
+        if current_len + len(line) > max_chars and current:
+            chunks.append(Chunk(''.join(current).strip(), source, title, start))
+            current, current_len = [], 0
+        if not current:
+            start = offset
+        current.append(line)
+        current_len += len(line)
+        offset += len(line)
+    if current:
+        chunks.append(Chunk(''.join(current).strip(), source, title, start))
+    return [chunk for chunk in chunks if chunk.text]
+
+
+@lru_cache(maxsize=1 << 16)
+def _slot(feature, dim):
+    digest = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+    return digest % dim, 1.0 if digest >> 63 else -1.0
+
+
+class HashingEmbedder:
+    """Signed feature hashing of words and word pairs into unit-length vectors
+
+    fit() learns an inverse document frequency weight per slot, so words that
+    occur everywhere ("high", "result") count for less than analyte names.
+    """
+
+    def __init__(self, dim=DEFAULT_DIM):
+        self.dim = dim
+        self.weights = np.ones(dim, dtype=np.float32)
+
+    def features(self, text):
+        words = [w for w in _WORD_PATTERN.findall(text.lower()) if w not in STOPWORDS]
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def _hash(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            slots = [_slot(feature, self.dim) for feature in self.features(text)]
+            if slots:
+                index, sign = zip(*slots)
+                np.add.at(vectors[row], list(index), sign)
+        return vectors
+
+    def fit(self, texts):
+        document_frequency = np.count_nonzero(self._hash(texts), axis=0)
+        self.weights = (np.log((1 + len(texts)) / (1 + document_frequency)) + 1).astype(np.float32)
+        return self
+
+    def embed(self, texts):
+        """Return a (len(texts), dim) float32 matrix of L2-normalised rows"""
+        vectors = self._hash(texts)
+        vectors *= self.weights
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+
+class VectorIndex:
+    """Append-only chunk index with batched top-k search by inner product"""
+
+    def __init__(self, dim=DEFAULT_DIM):
+        self.dim = dim
+        self._columns = np.zeros((dim, 0), dtype=np.float32)  # dim x capacity
+        self._size = 0
+        self.chunks = []
+
+    def __len__(self):
+        return self._size
+
+    def add(self, vectors, chunks):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.shape != (len(chunks), self.dim):
+            raise ValueError(f"Expected {len(chunks)} vectors of dimension {self.dim}")
+        needed = self._size + len(chunks)
+        if needed > self._columns.shape[1] or not self._columns.flags.writeable:
+            # Grow geometrically; a memory-mapped index is copied into memory first
+            columns = np.zeros((self.dim, max(needed, 2 * self._columns.shape[1], 64)), dtype=np.float32)
+            columns[:, :self._size] = self._columns[:, :self._size]
+            self._columns = columns
+        self._columns[:, self._size:needed] = vectors.T
+        self._size = needed
+        self.chunks.extend(chunks)
+
+    def search(self, queries, k=5):
+        """Return, for each query vector, up to k Hits with a positive score, best first"""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if self._size == 0:
+            return [[] for _ in queries]
+        # Hashed queries are sparse; only the dimensions they use need to be read
+        active = np.flatnonzero(np.any(queries != 0, axis=0))
+        if len(active) < self.dim // 2:
+            scores = queries[:, active] @ self._columns[active, :self._size]
+        else:
+            scores = queries @ self._columns[:, :self._size]
+
+        k = min(k, self._size)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        return [[Hit(float(score), self.chunks[i]) for i, score in zip(row, row_scores) if score > 0]
+                for row, row_scores in zip(top, top_scores)]
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'vectors.npy'), np.ascontiguousarray(self._columns[:, :self._size]))
+        with open(os.path.join(directory, 'chunks.jsonl'), 'w', encoding='utf-8') as f:
+            for chunk in self.chunks:
+                f.write(json.dumps(chunk._asdict(), ensure_ascii=False) + "\n")
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """Open a saved index; with mmap the vectors stay on disk until searched"""
+        columns = np.load(os.path.join(directory, 'vectors.npy'), mmap_mode='r' if mmap else None)
+        index = cls(columns.shape[0])
+        with open(os.path.join(directory, 'chunks.jsonl'), encoding='utf-8') as f:
+            index.chunks = [Chunk(**json.loads(line)) for line in f]
+        index._columns = columns
+        index._size = columns.shape[1]
+        return index
+
+
+def read_reference_corpus(path=REFERENCE_CORPUS, max_chars=DEFAULT_CHUNK_CHARS):
+    chunks = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                chunks.extend(chunk_text(entry["text"], max_chars, source=entry["id"], title=entry["title"]))
+    return chunks
+
+
+def _embedding_text(chunk):
+    return f"{chunk.title}\n{chunk.text}" if chunk.title else chunk.text
+
+
+def load_reference_index(embedder, path=REFERENCE_CORPUS, cache_dir=None):
+    """Build the reference corpus index and fit embedder on it
+
+    A copy saved under cache_dir for the same corpus and dim is reused; one
+    that cannot be read is rebuilt.
+    """
+    with open(path, 'rb') as f:
+        version = hashlib.sha256(f.read() + str(embedder.dim).encode()).hexdigest()[:16]
+    saved = os.path.join(cache_dir, version) if cache_dir else None
+    # weights.npy is written last
+    if saved and os.path.exists(os.path.join(saved, 'weights.npy')):
+        try:
+            weights = np.load(os.path.join(saved, 'weights.npy'))
+            index = VectorIndex.load(saved)
+        except (OSError, ValueError) as e:
+            log.warning("reference_index_unreadable", path=saved, error=str(e))
+        else:
+            embedder.weights = weights
+            return index
+
+    chunks = read_reference_corpus(path)
+    texts = [_embedding_text(chunk) for chunk in chunks]
+    embedder.fit(texts)
+    index = VectorIndex(embedder.dim)
+    index.add(embedder.embed(texts), chunks)
+    if saved:
+        _save_reference_index(index, embedder.weights, saved)
+    log.info("reference_index_built", chunks=len(chunks), dim=embedder.dim)
+    return index
+
+
+def _save_reference_index(index, weights, saved):
+    """Write the index next to saved and rename it into place; the first writer wins"""
+    parent = os.path.dirname(saved)
+    os.makedirs(parent, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(dir=parent, prefix='.building-')
+    try:
+        index.save(temp_dir)
+        np.save(os.path.join(temp_dir, 'weights.npy'), weights)
+        os.rename(temp_dir, saved)
+    except OSError:
+        # Another worker renamed its copy first, or the old copy is unreadable; this one is not kept
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def report_queries(text):
+    """Queries for the parts of a report worth sending: flagged values and abnormal findings"""
+    scan = scan_lab_report(text.lower())
+    queries = [f"{value.test} {value.flag}" for value in scan.values if value.flag in ('low', 'high')]
+    queries.extend(finding.phrase for finding in scan.findings)
+    return list(dict.fromkeys(queries)) or ["abnormal high low result"]
+
+
+ReportContext = namedtuple('ReportContext', ['excerpts', 'references'])
+
+
+class LocalRetriever:
+    """Picks the relevant report chunks and reference notes for a prompt"""
+
+    def __init__(self, embedder, reference_index, report_chunks=6, reference_chunks=4,
+                 chunk_chars=DEFAULT_CHUNK_CHARS):
+        self.embedder = embedder
+        self.reference_index = reference_index
+        self.report_chunks = report_chunks
+        self.reference_chunks = reference_chunks
+        self.chunk_chars = chunk_chars
+
+    def context(self, text):
+        """Return a ReportContext with report excerpts in document order and reference notes"""
+        queries = report_queries(text)
+        query_vectors = self.embedder.embed(queries)
+        return ReportContext(self.report_excerpts(text, query_vectors), self.reference_notes(queries, query_vectors))
+
+    def report_excerpts(self, text, query_vectors):
+        chunks = chunk_text(text, self.chunk_chars)
+        report_index = VectorIndex(self.embedder.dim)
+        report_index.add(self.embedder.embed([chunk.text for chunk in chunks]), chunks)
+        selected = _best_per_query(report_index.search(query_vectors, self.report_chunks), self.report_chunks)
+        if not selected:
+            selected = chunks[:self.report_chunks]
+        return sorted(selected, key=lambda chunk: chunk.offset)
+
+    def reference_notes(self, queries, query_vectors):
+        return _best_per_query(self.reference_index.search(query_vectors, self.reference_chunks),
+                               self.reference_chunks)
+
+
+def _best_per_query(results, limit):
+    """Merge per-query hit lists round-robin so every query contributes its best chunks"""
+    selected = []
+    for rank in range(max((len(hits) for hits in results), default=0)):
+        for hits in results:
+            if rank < len(hits) and len(selected) < limit and hits[rank].chunk not in selected:
+                selected.append(hits[rank].chunk)
+    return selected
+
+
+class VectorLakeRetriever(LocalRetriever):
+    """Serves the reference corpus from Groclake VectorLake; report chunks stay local
+
+    Report text is never pushed to VectorLake. Without an existing VectorLake
+    id, the reference corpus is pushed by push_reference_corpus(), never on
+    the request path; until then reports get no reference notes.
+    """
+
+    def __init__(self, vectorlake, embedder, vectorlake_id=None, **kwargs):
+        super().__init__(embedder, reference_index=None, **kwargs)
+        self.vectorlake = vectorlake
+        self._chunks = read_reference_corpus()
+        # The local embedder still ranks report chunks, so it needs the corpus weights
+        embedder.fit([_embedding_text(chunk) for chunk in self._chunks])
+        self.vectorlake_id = vectorlake_id
+        self._push_lock = threading.Lock()
+
+    def push_reference_corpus(self):
+        """Push the reference corpus unless a VectorLake id is set; return the id"""
+        with self._push_lock:
+            if self.vectorlake_id is None:
+                self.vectorlake_id = self._push_reference_corpus(self._chunks)
+        return self.vectorlake_id
+
+    def _push_reference_corpus(self, chunks):
+        vectorlake_id = self.vectorlake.create().get("vectorlake_id")
+        for chunk in chunks:
+            self.vectorlake.push({
+                "vector": self.vectorlake.generate(chunk.text),
+                "vectorlake_id": vectorlake_id,
+                "document_text": chunk.text,
+                "vector_type": "text",
+                "metadata": {"source": chunk.source, "title": chunk.title},
+            })
+        log.info("vectorlake_reference_pushed", vectorlake_id=vectorlake_id)
+        return vectorlake_id
+
+    def reference_notes(self, queries, query_vectors):
+        if self.vectorlake_id is None:
+            return []
+        # VectorLake uses its own embeddings, so it is searched by query text
+        results = []
+        for query in queries:
+            response = self.vectorlake.search({
+                "vector": self.vectorlake.generate(query),
+                "vectorlake_id": self.vectorlake_id,
+                "vector_type": "text",
+            })
+            hits = []
+            for item in (response or {}).get("results", [])[:self.reference_chunks]:
+                metadata = item.get("metadata") or {}
+                chunk = Chunk(item.get("document_text", ""), metadata.get("source", "vectorlake"),
+                              metadata.get("title", ""), 0)
+                hits.append(Hit(float(item.get("score", 0)), chunk))
+            results.append(hits)
+        return _best_per_query(results, self.reference_chunks)
+
+
+def main(argv=None):
+    """python retrieval.py push-vectorlake: push the reference corpus and print its VectorLake id"""
+    argv = sys.argv[1:] if argv is None else argv
+    if argv != ['push-vectorlake']:
+        print(main.__doc__, file=sys.stderr)
+        return 2
+    from app import vectorlake  # sets the Groclake credentials
+    print(VectorLakeRetriever(vectorlake, HashingEmbedder()).push_reference_corpus())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""Bounded session and conversation history storage.
+
+Sessions expire after an idle TTL and the total number of sessions is capped
+with least-recently-used eviction. Each session keeps its chat history in a
+ring buffer of the most recent turns, so neither logins nor long
+conversations grow memory without bound. Each session also keeps the chat's
+dialogue state. The store keeps the dict-style access the request handlers
+already use.
+"""
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
+from dialogue import DialogueState
+
+
+class HistoryBuffer(deque):
+    """Chat history ring buffer that keeps a running estimate of its size in bytes"""
+
+    def __init__(self, iterable=(), maxlen=None):
+        super().__init__(maxlen=maxlen)
+        self.nbytes = 0
+        for entry in iterable:
+            self.append(entry)
+
+    @staticmethod
+    def _entry_size(entry):
+        return sys.getsizeof(entry) + sum(sys.getsizeof(value) for value in entry.values())
+
+    def append(self, entry):
+        if self.maxlen is not None and len(self) == self.maxlen:
+            self.nbytes -= self._entry_size(self[0])
+        super().append(entry)
+        self.nbytes += self._entry_size(entry)
+
+
+class _Session:
+    __slots__ = ('username', 'history', 'dialogue', 'last_seen')
+
+    def __init__(self, username, history):
+        self.username = username
+        self.history = history
+        self.dialogue = None
+        self.last_seen = time.monotonic()
+
+
+class SessionStore:
+    """token -> username mapping with idle expiry and an LRU-evicted size cap"""
+
+    def __init__(self, idle_ttl=24 * 3600, max_sessions=10000, max_turns=50):
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        # One turn is a question plus its answer
+        self.max_history_entries = max_turns * 2
+        self._sessions = OrderedDict()
+        self._lock = threading.RLock()
+        self.history = HistoryView(self)
+        self.dialogue = DialogueView(self)
+        self.counters = {"created": 0, "expired": 0, "evicted": 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            idle_ttl=float(os.environ.get('SESSION_IDLE_TTL', 24 * 3600)),
+            max_sessions=int(os.environ.get('SESSION_MAX', 10000)),
+            max_turns=int(os.environ.get('HISTORY_MAX_TURNS', 50)),
+        )
+
+    def _new_history(self, entries=()):
+        return HistoryBuffer(entries, maxlen=self.max_history_entries)
+
+    def _live(self, token):
+        """Return the session for token, dropping it if it has been idle too long"""
+        session = self._sessions.get(token)
+        if session is None:
+            return None
+        now = time.monotonic()
+        if now - session.last_seen > self.idle_ttl:
+            del self._sessions[token]
+            self.counters["expired"] += 1
+            return None
+        session.last_seen = now
+        self._sessions.move_to_end(token)
+        return session
+
+    def _expire_idle(self):
+        # Sessions are ordered by last use, so expired ones sit at the front
+        cutoff = time.monotonic() - self.idle_ttl
+        while self._sessions:
+            token, session = next(iter(self._sessions.items()))
+            if session.last_seen >= cutoff:
+                break
+            del self._sessions[token]
+            self.counters["expired"] += 1
+
+    def __setitem__(self, token, username):
+        with self._lock:
+            session = self._live(token)
+            if session is not None:
+                session.username = username
+                return
+            self._expire_idle()
+            while len(self._sessions) >= self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.counters["evicted"] += 1
+            self._sessions[token] = _Session(username, self._new_history())
+            self.counters["created"] += 1
+
+    def __getitem__(self, token):
+        with self._lock:
+            session = self._live(token)
+            if session is None:
+                raise KeyError(token)
+            return session.username
+
+    def get(self, token, default=None):
+        with self._lock:
+            session = self._live(token)
+            return session.username if session is not None else default
+
+    def __contains__(self, token):
+        with self._lock:
+            return self._live(token) is not None
+
+    def __delitem__(self, token):
+        with self._lock:
+            del self._sessions[token]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def __repr__(self):
+        return f"<SessionStore sessions={len(self)}>"
+
+    def stats(self):
+        """Session counts plus an estimate of the memory held by chat history"""
+        with self._lock:
+            self._expire_idle()
+            history_entries = sum(len(s.history) for s in self._sessions.values())
+            history_bytes = sum(s.history.nbytes for s in self._sessions.values())
+            stats = dict(self.counters)
+            stats.update({
+                "sessions": len(self._sessions),
+                "history_entries": history_entries,
+                "history_bytes": history_bytes,
+            })
+            return stats
+
+
+class HistoryView:
+    """Dict-style access to the history buffers of live sessions"""
+
+    def __init__(self, store):
+        self._store = store
+
+    def get(self, token, default=None):
+        with self._store._lock:
+            session = self._store._live(token)
+            return session.history if session is not None else default
+
+    def __getitem__(self, token):
+        history = self.get(token)
+        if history is None:
+            raise KeyError(token)
+        return history
+
+    def __setitem__(self, token, entries):
+        with self._store._lock:
+            session = self._store._live(token)
+            if session is None:
+                # History only lives as long as its session
+                return
+            if entries is not session.history:
+                session.history = self._store._new_history(entries)
+
+    def extend(self, token, entries):
+        """Append entries to a session's history without reading it"""
+        with self._store._lock:
+            session = self._store._live(token)
+            if session is not None:
+                for entry in entries:
+                    session.history.append(entry)
+
+    def __contains__(self, token):
+        return self.get(token) is not None
+
+
+class DialogueView:
+    """Dict-style access to the dialogue state of live sessions"""
+
+    def __init__(self, store):
+        self._store = store
+
+    def get(self, token, default=None):
+        """A copy of the session's state; changes go through update()"""
+        with self._store._lock:
+            session = self._store._live(token)
+            if session is None or session.dialogue is None:
+                return default
+            return session.dialogue.copy()
+
+    def __setitem__(self, token, state):
+        with self._store._lock:
+            session = self._store._live(token)
+            if session is not None:
+                session.dialogue = state
+
+    def update(self, token, change):
+        """Apply change(state) to the session's state under the store lock"""
+        with self._store._lock:
+            session = self._store._live(token)
+            if session is not None:
+                state = session.dialogue or DialogueState()
+                change(state)
+                session.dialogue = state
@@ -0,0 +1,310 @@
+"""SQLite persistence for users, sessions and chat history.
+
+With SESSION_BACKEND=sqlite every worker process opens the same database file
+in WAL mode, so a token issued by one worker is accepted by all of them and
+readers never block the writer. Lookups go through primary-key or indexed
+columns, statements are fixed strings reused from each connection's statement
+cache, and the two history rows written per chat turn go in one transaction.
+The stores keep the dict-style interface of the in-memory ones. A session's
+chat dialogue state is a JSON column of its row.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+from dialogue import DialogueState
+
+# Applied in order; PRAGMA user_version records how many have run
+MIGRATIONS = [
+    # 1: schema
+    """
+    CREATE TABLE users (
+        username TEXT PRIMARY KEY,
+        password TEXT NOT NULL
+    );
+    CREATE TABLE sessions (
+        token TEXT PRIMARY KEY,
+        username TEXT NOT NULL,
+        created REAL NOT NULL,
+        last_seen REAL NOT NULL
+    );
+    CREATE INDEX sessions_last_seen ON sessions (last_seen);
+    CREATE TABLE history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        token TEXT NOT NULL REFERENCES sessions (token) ON DELETE CASCADE,
+        type TEXT NOT NULL,
+        content TEXT NOT NULL
+    );
+    CREATE INDEX history_token ON history (token, id);
+    """,
+    # 2: default user for testing
+    """
+    INSERT OR IGNORE INTO users (username, password) VALUES ('test', 'test123');
+    """,
+    # 3: chat dialogue state (dialogue.DialogueState as JSON)
+    """
+    ALTER TABLE sessions ADD COLUMN dialogue TEXT;
+    """,
+]
+
+
+class SQLiteDatabase:
+    """Per-thread connections to one WAL-mode database file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self.migrate()
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=10, cached_statements=256)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def migrate(self):
+        """Bring the schema up to date; safe to run from several processes at once"""
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+                for statement in script.split(';'):
+                    if statement.strip():
+                        conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {number}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+class SQLiteUserStore:
+    """username -> {"password": ...} backed by the users table"""
+
+    def __init__(self, database):
+        self.database = database
+
+    def __contains__(self, username):
+        row = self.database.connection().execute(
+            "SELECT 1 FROM users WHERE username = ?", (username,)).fetchone()
+        return row is not None
+
+    def __getitem__(self, username):
+        row = self.database.connection().execute(
+            "SELECT password FROM users WHERE username = ?", (username,)).fetchone()
+        if row is None:
+            raise KeyError(username)
+        return {"password": row[0]}
+
+    def __setitem__(self, username, record):
+        self.database.connection().execute(
+            "INSERT OR REPLACE INTO users (username, password) VALUES (?, ?)",
+            (username, record["password"]))
+
+
+class SQLiteSessionStore:
+    """token -> username backed by the sessions table, with idle expiry and a size cap"""
+
+    # last_seen is only rewritten when it is older than this, to keep reads read-only
+    TOUCH_INTERVAL = 60
+
+    def __init__(self, database, idle_ttl=24 * 3600, max_sessions=10000, max_turns=50):
+        self.database = database
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self.max_history_entries = max_turns * 2
+        self.history = SQLiteHistoryView(self)
+        self.dialogue = SQLiteDialogueView(self)
+
+    @classmethod
+    def from_env(cls, database):
+        return cls(
+            database,
+            idle_ttl=float(os.environ.get('SESSION_IDLE_TTL', 24 * 3600)),
+            max_sessions=int(os.environ.get('SESSION_MAX', 10000)),
+            max_turns=int(os.environ.get('HISTORY_MAX_TURNS', 50)),
+        )
+
+    def _live(self, token):
+        """Return the username for a live session, or None"""
+        if not token:
+            return None
+        conn = self.database.connection()
+        row = conn.execute("SELECT username, last_seen FROM sessions WHERE token = ?", (token,)).fetchone()
+        if row is None:
+            return None
+        username, last_seen = row
+        now = time.time()
+        if now - last_seen > self.idle_ttl:
+            conn.execute("DELETE FROM sessions WHERE token = ?", (token,))
+            return None
+        if now - last_seen > self.TOUCH_INTERVAL:
+            conn.execute("UPDATE sessions SET last_seen = ? WHERE token = ?", (now, token))
+        return username
+
+    def __setitem__(self, token, username):
+        now = time.time()
+        conn = self.database.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM sessions WHERE last_seen < ?", (now - self.idle_ttl,))
+            conn.execute(
+                "INSERT INTO sessions (token, username, created, last_seen) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (token) DO UPDATE SET username = excluded.username, last_seen = excluded.last_seen",
+                (token, username, now, now))
+            # Evict the least recently used sessions beyond the cap
+            conn.execute(
+                "DELETE FROM sessions WHERE token IN ("
+                "SELECT token FROM sessions ORDER BY last_seen DESC LIMIT -1 OFFSET ?)",
+                (self.max_sessions,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def __getitem__(self, token):
+        username = self._live(token)
+        if username is None:
+            raise KeyError(token)
+        return username
+
+    def get(self, token, default=None):
+        username = self._live(token)
+        return username if username is not None else default
+
+    def __contains__(self, token):
+        return self._live(token) is not None
+
+    def __delitem__(self, token):
+        self.database.connection().execute("DELETE FROM sessions WHERE token = ?", (token,))
+
+    def __len__(self):
+        return self.database.connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def __repr__(self):
+        return f"<SQLiteSessionStore path={self.database.path!r}>"
+
+    def stats(self):
+        conn = self.database.connection()
+        sessions = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        entries, history_bytes = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(content)), 0) FROM history").fetchone()
+        return {"sessions": sessions, "history_entries": entries, "history_bytes": history_bytes}
+
+
+class SQLiteHistory(list):
+    """A session's recent history; appended entries are written in one batch when
+    the list is assigned back through the history view"""
+
+    def __init__(self, token, entries):
+        super().__init__(entries)
+        self.token = token
+        self.pending = []
+
+    def append(self, entry):
+        super().append(entry)
+        self.pending.append(entry)
+
+
+class SQLiteHistoryView:
+    """Dict-style access to chat history rows of live sessions"""
+
+    def __init__(self, store):
+        self._store = store
+
+    def get(self, token, default=None):
+        if self._store._live(token) is None:
+            return default
+        rows = self._store.database.connection().execute(
+            "SELECT type, content FROM history WHERE token = ? ORDER BY id DESC LIMIT ?",
+            (token, self._store.max_history_entries)).fetchall()
+        return SQLiteHistory(token, [{"type": t, "content": c} for t, c in reversed(rows)])
+
+    def __getitem__(self, token):
+        history = self.get(token)
+        if history is None:
+            raise KeyError(token)
+        return history
+
+    def __setitem__(self, token, entries):
+        conn = self._store.database.connection()
+        if isinstance(entries, SQLiteHistory) and entries.token == token:
+            new_entries = entries.pending
+        else:
+            # Assigning a plain list replaces the whole history
+            conn.execute("DELETE FROM history WHERE token = ?", (token,))
+            new_entries = list(entries)
+        self.extend(token, new_entries)
+        if isinstance(entries, SQLiteHistory):
+            entries.pending = []
+
+    def extend(self, token, entries):
+        """Append entries to a session's history in one transaction, without reading it"""
+        if not entries:
+            return
+        conn = self._store.database.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM sessions WHERE token = ?", (token,)).fetchone() is None:
+                # History only lives as long as its session
+                conn.execute("ROLLBACK")
+                return
+            conn.executemany("INSERT INTO history (token, type, content) VALUES (?, ?, ?)",
+                             [(token, e["type"], e["content"]) for e in entries])
+            # Keep only the most recent turns
+            conn.execute(
+                "DELETE FROM history WHERE token = ? AND id <= ("
+                "SELECT id FROM history WHERE token = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (token, token, self._store.max_history_entries))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def __contains__(self, token):
+        return self._store._live(token) is not None
+
+
+class SQLiteDialogueView:
+    """Dict-style access to the dialogue state column of live sessions"""
+
+    def __init__(self, store):
+        self._store = store
+
+    def get(self, token, default=None):
+        if self._store._live(token) is None:
+            return default
+        row = self._store.database.connection().execute(
+            "SELECT dialogue FROM sessions WHERE token = ?", (token,)).fetchone()
+        if row is None or row[0] is None:
+            return default
+        return DialogueState.from_json(row[0])
+
+    def __setitem__(self, token, state):
+        self._store.database.connection().execute(
+            "UPDATE sessions SET dialogue = ? WHERE token = ?", (state.to_json(), token))
+
+    def update(self, token, change):
+        """Apply change(state) to the session's state in one transaction"""
+        if self._store._live(token) is None:
+            return
+        conn = self._store.database.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT dialogue FROM sessions WHERE token = ?", (token,)).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                return
+            state = DialogueState.from_json(row[0]) if row[0] is not None else DialogueState()
+            change(state)
+            conn.execute("UPDATE sessions SET dialogue = ? WHERE token = ?", (state.to_json(), token))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
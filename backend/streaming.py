@@ -0,0 +1,29 @@
+"""Server-Sent Events helpers for the streaming chat and report endpoints."""
+import json
+import re
+
+# Split after each blank line, keeping it, so the pieces join back to the original text
+_SECTION_BREAK = re.compile(r'(?<=\n\n)')
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    # Stop nginx-style proxies from buffering the stream
+    "X-Accel-Buffering": "no",
+}
+
+
+def sse_event(event, data):
+    """Encode one SSE event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def split_sections(text):
+    """Split a reply into paragraph/section pieces whose concatenation is the text"""
+    return [piece for piece in _SECTION_BREAK.split(text) if piece]
+
+
+def stream_sections(text, is_fallback):
+    """Yield a chunk event per section followed by a done event"""
+    for index, section in enumerate(split_sections(text)):
+        yield sse_event("chunk", {"index": index, "content": section, "is_fallback": is_fallback})
+    yield sse_event("done", {"is_fallback": is_fallback})
@@ -0,0 +1,195 @@
+"""Leveled, structured logging that never blocks request threads.
+
+Request code logs an event name plus keyword fields. Records go onto an
+in-memory queue and are redacted, formatted as JSON lines and written by a
+background listener thread, so the request path only pays for a level check
+and a queue put (nothing at all for disabled levels or unsampled events).
+Session tokens, passwords and free-text health information are redacted by
+default; set LOG_PHI=1 only on a development machine.
+
+    log = get_logger(__name__)
+    log.info("chat_request", sample=0.1, token=token, question=user_question)
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import threading
+
+# Field values that are never written
+SECRET_FIELDS = {'token', 'authorization', 'password', 'session_id'}
+# Free-text fields that may contain personal health information; logged as their length
+PHI_FIELDS = {'question', 'message', 'answer', 'analysis', 'content', 'text', 'response',
+              'filename', 'username'}
+
+# Session tokens are UUIDs; scrub them from exception messages and tracebacks too
+_UUID_PATTERN = re.compile(r'\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b', re.IGNORECASE)
+_EMAIL_PATTERN = re.compile(r'\b[\w.+-]+@[\w-]+\.[\w.-]+\b')
+
+_listener = None
+_setup_lock = threading.Lock()
+# (level, allow_phi) given to setup_logging, for child processes to log the same way
+_settings = None
+
+
+def redact_text(text):
+    text = _UUID_PATTERN.sub('[token]', text)
+    return _EMAIL_PATTERN.sub('[email]', text)
+
+
+def redact_fields(fields, allow_phi=False):
+    redacted = {}
+    for key, value in fields.items():
+        if key in SECRET_FIELDS:
+            redacted[key] = '[redacted]' if value else value
+        elif key in PHI_FIELDS and not allow_phi and isinstance(value, str):
+            redacted[key + '_length'] = len(value)
+        elif isinstance(value, str):
+            redacted[key] = redact_text(value)
+        else:
+            redacted[key] = value
+    return redacted
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; runs on the listener thread"""
+
+    def __init__(self, allow_phi=False):
+        super().__init__()
+        self.allow_phi = allow_phi
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.msg if isinstance(record.msg, str) else str(record.msg),
+        }
+        entry.update(redact_fields(getattr(record, 'fields', {}), self.allow_phi))
+        if record.exc_info:
+            entry["exc"] = redact_text(self.formatException(record.exc_info))
+        return json.dumps(entry, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Enqueues records without formatting them and drops them if the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatting happens on the listener thread; keep the request path to a queue put
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class StructuredLogger:
+    """Thin wrapper that turns keyword fields into a structured log record"""
+
+    def __init__(self, logger):
+        self._logger = logger
+
+    def isEnabledFor(self, level):
+        return self._logger.isEnabledFor(level)
+
+    def log(self, level, event, sample=None, exc_info=None, **fields):
+        if not self._logger.isEnabledFor(level):
+            return
+        # High-volume events can be sampled; the rate is recorded with the event
+        if sample is not None and sample < 1.0:
+            if random.random() >= sample:
+                return
+            fields["sample_rate"] = sample
+        self._logger.log(level, event, exc_info=exc_info, extra={"fields": fields})
+
+    def debug(self, event, **fields):
+        self.log(logging.DEBUG, event, **fields)
+
+    def info(self, event, **fields):
+        self.log(logging.INFO, event, **fields)
+
+    def warning(self, event, **fields):
+        self.log(logging.WARNING, event, **fields)
+
+    def error(self, event, **fields):
+        self.log(logging.ERROR, event, **fields)
+
+    def exception(self, event, **fields):
+        self.log(logging.ERROR, event, exc_info=True, **fields)
+
+
+def setup_logging(level=None, stream=None, allow_phi=None, queue_size=10000):
+    """Install the queue handler and start the writer thread; safe to call twice"""
+    global _listener, _settings
+    with _setup_lock:
+        if _listener is not None:
+            return _listener
+        level = level or os.environ.get('LOG_LEVEL', 'INFO').upper()
+        if allow_phi is None:
+            allow_phi = os.environ.get('LOG_PHI', '').lower() in ('1', 'true', 'yes')
+
+        _settings = (level, allow_phi)
+
+        writer = logging.StreamHandler(stream or sys.stderr)
+        writer.setFormatter(JsonFormatter(allow_phi=allow_phi))
+        log_queue = queue.Queue(maxsize=queue_size)
+        _listener = logging.handlers.QueueListener(log_queue, writer, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+
+        root = logging.getLogger('medassist')
+        root.setLevel(level)
+        root.addHandler(NonBlockingQueueHandler(log_queue))
+        root.propagate = False
+        return _listener
+
+
+def child_logging_settings():
+    """Arguments for setup_child_logging in a process started by this one"""
+    if _settings is not None:
+        return _settings
+    return os.environ.get('LOG_LEVEL', 'INFO').upper(), os.environ.get('LOG_PHI', '').lower() in ('1', 'true', 'yes')
+
+
+def setup_child_logging(level, allow_phi):
+    """Write records straight to stderr, as the initializer of a pool process
+
+    A forked child inherits the queue handler but not the listener thread that
+    empties the queue, so its records would never be written. Lines from
+    several processes interleave whole, as each is written in one call.
+    """
+    global _listener
+    _listener = None  # the parent's; it does not run in this process
+    writer = logging.StreamHandler(sys.stderr)
+    writer.setFormatter(JsonFormatter(allow_phi=allow_phi))
+    root = logging.getLogger('medassist')
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(level)
+    root.addHandler(writer)
+    root.propagate = False
+
+
+def stop_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def get_logger(name):
+    return StructuredLogger(logging.getLogger('medassist.' + name))
+
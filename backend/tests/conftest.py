@@ -0,0 +1,32 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+# The backend modules are imported by name, as app.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """app.py with the fake ModelLake, keeping its uploads and caches in a temporary directory"""
+    os.environ['MODELLAKE'] = 'fake'
+    cwd = os.getcwd()
+    # UPLOAD_FOLDER and the cache directories are relative to the working directory
+    os.chdir(tmp_path_factory.mktemp('app'))
+    try:
+        yield importlib.import_module('app')
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def token(client):
+    response = client.post('/api/login', json={"username": "test", "password": "test123"})
+    return response.get_json()["token"]
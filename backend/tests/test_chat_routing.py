@@ -0,0 +1,29 @@
+import pytest
+
+from chat_rules import CHAT_RULES
+
+RESPONSES = {rule.name: rule.response for rule in CHAT_RULES}
+
+
+@pytest.mark.parametrize('messages, rule', [
+    # A symptom with no earlier questions gets the symptom rule
+    (["I have a fever"], 'fever'),
+    (["My head hurts"], 'head_pain'),
+    (["What should I eat before bed?"], 'generic'),
+    # Answers to our questions pick a follow-up rule, with the complaint carried over from the first turn
+    (["I have a fever", "it is 103 since yesterday"], 'fever_high'),
+    (["I have a fever", "it started a day ago"], 'fever_low'),
+    (["I have a stomach ache", "it just started"], 'stomach_recent'),
+    (["I have a stomach ache", "about a month now"], 'stomach_chronic'),
+    (["I have a headache", "it is severe"], 'headache_severe'),
+    # Follow-up rules need the complaint: without a topic the plain symptom rules answer
+    (["What should I eat before bed?", "it started a day ago"], 'generic'),
+    (["My head hurts", "it is severe"], 'generic'),
+    # A new complaint is not read as an answer
+    (["I have a fever", "my head hurts"], 'head_pain'),
+    (["I have a stomach ache", "I have a fever"], 'fever'),
+])
+def test_chat_routing(client, token, messages, rule):
+    for message in messages:
+        response = client.post('/api/chat', json={"message": message}, headers={"Authorization": token})
+    assert response.get_json() == {"message": RESPONSES[rule], "is_fallback": False}
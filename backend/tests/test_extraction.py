@@ -0,0 +1,23 @@
+import os
+
+import extraction
+from structured_log import get_logger
+
+
+def _log_from_worker():
+    get_logger('extraction').warning("worker_event", pages=3)
+    return os.getpid()
+
+
+def test_pool_workers_log_to_stderr(capfd, monkeypatch):
+    # A pool of its own, so its processes write to the captured stderr
+    monkeypatch.setattr(extraction, '_pool', None)
+    try:
+        pid = extraction._submit(_log_from_worker).result(timeout=30)
+    finally:
+        extraction._pool.shutdown()
+    assert pid != os.getpid()
+    lines = [line for line in capfd.readouterr().err.splitlines() if '"worker_event"' in line]
+    assert len(lines) == 1
+    assert '"logger": "medassist.extraction"' in lines[0]
+    assert '"pages": 3' in lines[0]
@@ -0,0 +1,45 @@
+from lab_values import format_lab_value, patient_details, scan_lab_report
+
+
+def flags(text, **kwargs):
+    return {value.test: value.flag for value in scan_lab_report(text.lower(), **kwargs).values}
+
+
+def test_values_and_findings_in_one_scan():
+    scan = scan_lab_report("hemoglobin 11.0 g/dl\nwbc 12,500 cells/μl\nthe urine culture was positive")
+    assert [(v.test, v.value, v.flag) for v in scan.values] == [("hemoglobin", 11.0, 'low'), ("wbc", 12500.0, 'high')]
+    assert [finding.term for finding in scan.findings] == ["positive"]
+
+
+def test_si_units_are_converted():
+    assert flags("Glucose 5.0 mmol/L") == {"glucose": 'normal'}
+    assert flags("Glucose 7.5 mmol/L") == {"glucose": 'high'}
+    assert flags("Glucose 3.5 mmol/L") == {"glucose": 'low'}
+    assert flags("Cholesterol 6.2 mmol/L") == {"cholesterol": 'high'}
+    assert flags("Hemoglobin 140 g/L") == {"hemoglobin": 'normal'}
+    assert flags("WBC 3.2 x10^9/L") == {"wbc": 'low'}
+
+
+def test_units_that_do_not_convert_have_no_flag():
+    assert flags("WBC 15.2 mg/dL") == {"wbc": None}
+    assert flags("ALT 40 mmol/L") == {"alt": None}
+    assert flags("TSH 2.1") == {"tsh": 'normal'}
+
+
+def test_sex_and_age_from_the_header():
+    text = "Patient: Jane Doe\nSex: F  Age: 34\nCreatinine 100 umol/L\nHDL 45 mg/dL"
+    assert patient_details(text.lower()) == ('female', 34)
+    assert flags(text) == {"creatinine": 'high', "hdl": 'low'}
+    assert flags(text.replace("Sex: F", "Sex: M")) == {"creatinine": 'normal', "hdl": 'normal'}
+    # Neither stated: the widest bounds over both sexes
+    assert flags("Creatinine 100 umol/L\nHDL 45 mg/dL") == {"creatinine": 'normal', "hdl": 'normal'}
+
+
+def test_explicit_sex_and_age_override_the_report():
+    assert flags("Sex: M\nHemoglobin 13.0 g/dL", sex='female') == {"hemoglobin": 'normal'}
+    assert flags("Hemoglobin 16.0 g/dL", age=12) == {"hemoglobin": 'high'}
+
+
+def test_format_lab_value():
+    value = scan_lab_report("platelets 500,000 /μl").values[0]
+    assert format_lab_value(value) == "**PLATELETS**: 500,000 /μL (Normal range: 150,000-450,000/μL) - **High**"
@@ -0,0 +1,44 @@
+import os
+
+from metrics import Registry, SharedMetrics, mark_process_dead, merge_directory, render_families
+
+
+def _worker(directory, pid, pending):
+    registry = Registry()
+    registry.counter('requests_total', 'Requests', ('endpoint',)).inc(2, endpoint='chat')
+    registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1)).observe(0.5)
+    registry.collector(lambda: [('jobs_pending', 'gauge', 'Pending jobs', {(): pending}, ())])
+    shared = SharedMetrics(registry, str(directory))
+    shared.path = os.path.join(str(directory), f'{pid}-0000.json')
+    shared.dump()
+    return shared
+
+
+def test_workers_are_merged(tmp_path):
+    _worker(tmp_path, 101, pending=1)
+    text = _worker(tmp_path, 102, pending=3).render()
+    assert 'requests_total{endpoint="chat"} 4' in text
+    assert 'latency_seconds_bucket{le="1"} 2' in text
+    assert 'latency_seconds_count 2' in text
+    assert 'jobs_pending{worker="101"} 1' in text
+    assert 'jobs_pending{worker="102"} 3' in text
+
+
+def test_exited_worker_counters_are_kept(tmp_path):
+    _worker(tmp_path, 101, pending=1)
+    _worker(tmp_path, 102, pending=3)
+    mark_process_dead(101, str(tmp_path))
+    assert not os.path.exists(tmp_path / '101-0000.json')
+    text = render_families(merge_directory(str(tmp_path)))
+    assert 'requests_total{endpoint="chat"} 4' in text
+    assert 'worker="101"' not in text
+    assert 'jobs_pending{worker="102"} 3' in text
+
+
+def test_file_folded_into_archive_is_not_counted_twice(tmp_path):
+    _worker(tmp_path, 101, pending=1)
+    snapshot = (tmp_path / '101-0000.json').read_text()
+    mark_process_dead(101, str(tmp_path))
+    # A scrape that listed the directory before the file was removed
+    (tmp_path / '101-0000.json').write_text(snapshot)
+    assert 'requests_total{endpoint="chat"} 2' in render_families(merge_directory(str(tmp_path)))
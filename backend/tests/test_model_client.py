@@ -0,0 +1,44 @@
+import asyncio
+import time
+
+import pytest
+
+from fake_modellake import FakeModelLake
+from model_client import ModelClient, ModelUnavailableError
+
+
+def test_timed_out_call_frees_its_thread():
+    client = ModelClient(FakeModelLake(latency=5), 'account', timeout=0.2, retries=0, max_concurrency=1)
+    started = time.monotonic()
+    with pytest.raises(ModelUnavailableError):
+        client.chat_complete([{"role": "user", "content": "hello"}])
+    # The fake gave up at the deadline too, instead of holding the only thread for 5 s
+    deadline = time.monotonic() + 1
+    while client.pending() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert client.pending() == 0
+    assert time.monotonic() - started < 1
+
+
+class NoTimeoutModelLake:
+    def chat_complete(self, payload):
+        return {"answer": "fine"}
+
+
+def test_client_without_timeout_parameter():
+    client = ModelClient(NoTimeoutModelLake(), 'account')
+    assert client.chat_complete([{"role": "user", "content": "hello"}]) == "fine"
+
+
+def test_async_calls_from_several_event_loops():
+    client = ModelClient(FakeModelLake(latency=0.01), 'account', max_async_concurrency=1)
+
+    async def calls():
+        # Two calls contend for the single slot
+        return await asyncio.gather(*(client.chat_complete_async([{"role": "user", "content": f"q{i}"}])
+                                      for i in range(2)))
+
+    for _ in range(2):
+        assert len(asyncio.run(calls())) == 2
+    # A semaphore bound to the first loop fails the second loop's call, which the retry would hide
+    assert client.stats()["counters"]["failures"] == 0
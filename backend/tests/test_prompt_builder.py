@@ -0,0 +1,97 @@
+import re
+import threading
+
+import pytest
+
+from prompt_builder import MapReduceAnalyzer, chunk_report
+
+
+class DictCache:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, digest, kind):
+        return self.values.get((digest, kind))
+
+    def put(self, digest, kind, value):
+        self.values[(digest, kind)] = value
+
+
+class ModelDown(Exception):
+    pass
+
+
+class RecordingClient:
+    def __init__(self, fail_on=None, slow_on=None):
+        self.prompts = []
+        self.fail_on = fail_on
+        self.slow_on = slow_on
+        self.failed = threading.Event()
+        self.lock = threading.Lock()
+
+    def chat_complete(self, messages):
+        content = messages[-1]["content"]
+        with self.lock:
+            self.prompts.append(content)
+        if self.slow_on is not None and self.slow_on in content:
+            self.failed.wait(0.5)
+        if self.fail_on is not None and self.fail_on in content:
+            self.failed.set()
+            raise ModelDown(content)
+        return "summary of " + content.split("\n", 2)[1]
+
+
+def report(sections):
+    return "".join(f"SECTION {name.upper()}\n" + f"{name} value 1.0 mg/dL\n" * 40 for name in sections)
+
+
+def map_prompts(client):
+    return [prompt for prompt in client.prompts if not prompt.startswith("Partial analyses")]
+
+
+def test_map_prompt_does_not_depend_on_position():
+    client = RecordingClient()
+    analyzer = MapReduceAnalyzer(client, DictCache(), token_budget=400, chunk_tokens=300, max_workers=1)
+    text = report(["alpha", "beta", "gamma"])
+    analyzer.analyze(text, "system")
+    first_run = len(map_prompts(client))
+    assert first_run == len(chunk_report(text, 300)) > 1
+    # The same chunks at other positions and with another total reuse their summaries
+    analyzer.analyze(report(["delta"]) + text, "system")
+    assert not any(re.search(r"Part \d+ of \d+", prompt) for prompt in map_prompts(client))
+    assert not any("alpha" in prompt or "beta" in prompt for prompt in map_prompts(client)[first_run:])
+
+
+def test_first_failure_cancels_remaining_chunks():
+    # The first chunk is still running when the second fails
+    client = RecordingClient(fail_on="beta", slow_on="alpha")
+    analyzer = MapReduceAnalyzer(client, DictCache(), token_budget=400, chunk_tokens=300, max_workers=2)
+    text = report(["alpha", "beta", "gamma", "delta", "epsilon", "zeta"])
+    with pytest.raises(ModelDown):
+        analyzer.analyze(text, "system")
+    assert len(client.prompts) < len(chunk_report(text, 300))
+
+
+def test_stream_summarizes_chunks_during_extraction():
+    client = RecordingClient()
+    analyzer = MapReduceAnalyzer(client, DictCache(), token_budget=400, chunk_tokens=300, max_workers=1)
+    sections = ["alpha", "beta", "gamma", "delta", "epsilon"]
+    stream = analyzer.stream()
+    stream.feed(report(sections[:1]))
+    assert client.prompts == []  # still fits one prompt
+    for name in sections[1:]:
+        stream.feed(report([name]))
+    analyzer._executor.submit(lambda: None).result()
+    assert len(map_prompts(client)) > 0  # started before the last page was read
+    text = stream.text()
+    assert text == report(sections)
+    assert stream.summaries() == ["summary of " + chunk.text.split("\n", 1)[0] for chunk in chunk_report(text, 300)]
+
+
+def test_stream_of_a_short_report_sends_nothing():
+    client = RecordingClient()
+    analyzer = MapReduceAnalyzer(client, DictCache(), token_budget=4000, chunk_tokens=300, max_workers=1)
+    stream = analyzer.stream()
+    stream.feed(report(["alpha"]))
+    stream.feed(report(["beta"]))
+    assert client.prompts == []
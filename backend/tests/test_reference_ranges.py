@@ -0,0 +1,81 @@
+import math
+
+import pytest
+
+from reference_ranges import RangeRow, ReferenceRanges
+
+# The single range per test that lab_values used before the table; reports that
+# state neither sex nor age must flag exactly as they did against it
+LEGACY_RANGES = {
+    "hemoglobin": (12, 17.5), "hematocrit": (36, 50), "rbc": (4.2, 6.1), "wbc": (4500, 11000),
+    "platelets": (150000, 450000), "cholesterol": (None, 200), "ldl": (None, 100), "hdl": (40, None),
+    "triglycerides": (None, 150), "alt": (7, 56), "ast": (5, 40), "creatinine": (0.5, 1.2), "bun": (7, 20),
+    "egfr": (60, None), "glucose": (70, 99), "hba1c": (None, 5.7), "tsh": (0.4, 4.0), "t4": (4.5, 12),
+    "t3": (80, 200),
+}
+
+
+@pytest.fixture(scope='module')
+def table():
+    return ReferenceRanges.load()
+
+
+def legacy_flag(analyte, value):
+    low, high = LEGACY_RANGES[analyte]
+    if low is not None and value < low:
+        return 'low'
+    if high is not None and value > high:
+        return 'high'
+    return 'normal'
+
+
+def test_table_covers_the_legacy_tests(table):
+    assert sorted(table.analytes) == sorted(LEGACY_RANGES)
+
+
+@pytest.mark.parametrize("analyte", sorted(LEGACY_RANGES))
+def test_flags_match_legacy_ranges_at_the_boundaries(table, analyte):
+    values = []
+    for bound in LEGACY_RANGES[analyte]:
+        if bound is not None:
+            values += [bound * 0.99, bound, bound * 1.01]
+    assert table.flag([analyte] * len(values), values) == [legacy_flag(analyte, v) for v in values]
+
+
+def test_sex_and_age_select_rows(table):
+    assert table.flag(["hemoglobin"], [13.0], sex='female') == ['normal']
+    assert table.flag(["hemoglobin"], [13.0], sex='male') == ['low']
+    assert table.flag(["hemoglobin"], [13.0]) == ['normal']
+    assert table.flag(["hemoglobin"], [16.5], sex='female') == ['high']
+    assert table.flag(["hemoglobin"], [16.5], age=10) == ['high']
+    assert table.flag(["hemoglobin"], [11.5], age=10) == ['normal']
+    assert table.flag(["hdl"], [45], sex='female') == ['low']
+    assert table.flag(["hdl"], [45], sex='male') == ['normal']
+
+
+def test_nan_and_missing_rows_are_not_flagged(table):
+    assert table.flag(["glucose", "wbc"], [math.nan, 12000]) == [None, 'high']
+    # No hemoglobin row covers infants
+    assert table.flag(["hemoglobin"], [12.0], age=0) == [None]
+    assert table.flag([], []) == []
+
+
+def test_factor(table):
+    assert table.factor("glucose", "mmol/L") == pytest.approx(18.016)
+    assert table.factor("wbc", "cells/μL") == 1.0
+    assert table.factor("glucose", "mg/dL") == 1.0
+    assert table.factor("wbc", "mg/dL") is None
+
+
+def test_describe(table):
+    assert table.describe("glucose") == "70-99 mg/dL (fasting)"
+    assert table.describe("platelets") == "150,000-450,000/μL"
+    assert table.describe("hdl").startswith(">40 mg/dL (males)")
+    assert "(ages 1-17)" in table.describe("hemoglobin")
+
+
+def test_rows_of_an_analyte_must_share_a_unit():
+    rows = [RangeRow("glucose", "mg/dL", "any", 0, math.inf, 70, 99, ""),
+            RangeRow("glucose", "mmol/L", "any", 0, math.inf, 3.9, 5.5, "")]
+    with pytest.raises(ValueError):
+        ReferenceRanges(rows)
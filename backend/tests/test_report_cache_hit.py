@@ -0,0 +1,21 @@
+import io
+
+REPORT = ("CHEST X-RAY\n"
+          "Findings: The lungs are clear. No pleural effusion or pneumothorax.\n"
+          "Impression: No acute cardiopulmonary abnormality.\n")
+
+
+def test_same_report_text_is_answered_from_the_response_cache(app_module, client, token):
+    # Different bytes, so the analysis cache keyed on the upload misses; the prompt is the same once normalized
+    uploads = [REPORT, REPORT.replace('\n', '\r\n')]
+    before = app_module.model_client.stats()
+    answers = []
+    for text in uploads:
+        response = client.post('/api/analyze-report', headers={"Authorization": token},
+                               data={"file": (io.BytesIO(text.encode()), 'chest.txt')})
+        assert response.status_code == 200
+        answers.append(response.get_json())
+    after = app_module.model_client.stats()
+    assert answers[0] == answers[1]
+    assert after["counters"]["calls"] - before["counters"]["calls"] == 1
+    assert after["response_cache"]["exact_hits"] - before["response_cache"]["exact_hits"] == 1
@@ -0,0 +1,132 @@
+import io
+import os
+
+import pytest
+
+from report_store import (AnalysisCache, EmptyUploadError, UnsupportedUploadError, UploadStore, UploadTooLargeError,
+                          sniff_type)
+
+
+def test_sniff_type():
+    assert sniff_type(b'%PDF-1.7\n') == 'pdf'
+    assert sniff_type(b'PK\x03\x04rest') == 'docx'
+    assert sniff_type("Hémoglobine 13 g/dL".encode('utf-8')) == 'txt'
+    assert sniff_type(b'\x7fELF\x00\x01') is None
+
+
+def test_upload_store_rejects_unsupported_and_oversized(tmp_path):
+    store = UploadStore(str(tmp_path), type_limits={'txt': 10})
+    with pytest.raises(UnsupportedUploadError):
+        store.save(io.BytesIO(b'\x00\x01\x02'), 'x.bin')
+    with pytest.raises(UploadTooLargeError):
+        store.save(io.BytesIO(b'glucose 90 mg/dL'), 'x.txt')
+    digest, path = store.save(io.BytesIO(b'glucose 90'), 'x.txt')
+    assert path.endswith(digest + '.txt')
+    assert [name for name in os.listdir(tmp_path) if name.endswith('.part')] == []
+
+
+def test_empty_upload_is_rejected(tmp_path):
+    store = UploadStore(str(tmp_path))
+    with pytest.raises(EmptyUploadError) as excinfo:
+        store.save(io.BytesIO(b''), 'x.txt')
+    assert excinfo.value.status_code == 400
+
+
+class Upload:
+    def __init__(self, stream):
+        self.stream = stream
+
+
+def test_spooled_upload_is_renamed_into_place(tmp_path):
+    store = UploadStore(str(tmp_path))
+    spooled = store.spool()
+    spooled.write(b'glucose 90 mg/dL')
+    inode = os.fstat(spooled.fileno()).st_ino
+    digest, path = store.save(Upload(spooled), 'x.txt')
+    assert os.stat(path).st_ino == inode
+    assert not os.path.exists(spooled.name)
+    store.discard_spooled({'file': Upload(spooled)})
+    assert os.path.exists(path)
+
+
+def test_unsaved_spool_is_discarded(tmp_path):
+    store = UploadStore(str(tmp_path))
+    spooled = store.spool()
+    spooled.write(b'\x00\x01')
+    with pytest.raises(UnsupportedUploadError):
+        store.save(Upload(spooled), 'x.bin')
+    other = store.spool()
+    store.discard_spooled({'file': Upload(other)})
+    assert os.listdir(tmp_path) == []
+
+
+def _stored(store, text, age, now=1_000_000.0):
+    digest, path = store.save(io.BytesIO(text), 'x.txt')
+    os.utime(path, (now - age, now - age))
+    return path
+
+
+def test_sweep_deletes_expired_uploads(tmp_path):
+    store = UploadStore(str(tmp_path), ttl=86400, min_age=3600)
+    old = _stored(store, b'glucose 90', age=2 * 86400)
+    recent = _stored(store, b'sodium 140', age=7200)
+    (tmp_path / '.cache').mkdir()
+    (tmp_path / '.cache' / 'kept.json').write_text('{}')
+    (tmp_path / 'jobs.db').write_text('')
+    assert store.sweep(now=1_000_000.0) == 1
+    assert not os.path.exists(old)
+    assert os.path.exists(recent)
+    assert sorted(os.listdir(tmp_path / '.cache')) == ['kept.json']
+    assert os.path.exists(tmp_path / 'jobs.db')
+
+
+def test_sweep_keeps_size_under_cap_but_not_young_uploads(tmp_path):
+    store = UploadStore(str(tmp_path), max_bytes=15, min_age=3600)
+    oldest = _stored(store, b'glucose 90', age=3 * 3600)
+    older = _stored(store, b'sodium 140', age=2 * 3600)
+    young = _stored(store, b'potassium 4', age=60)
+    assert store.sweep(now=1_000_000.0) == 2
+    assert [os.path.exists(path) for path in (oldest, older, young)] == [False, False, True]
+
+
+def test_repeat_upload_is_kept(tmp_path):
+    store = UploadStore(str(tmp_path), ttl=86400, min_age=3600)
+    path = _stored(store, b'glucose 90', age=2 * 86400)
+    store.save(io.BytesIO(b'glucose 90'), 'again.txt')
+    assert store.sweep(now=os.stat(path).st_mtime + 60) == 0
+    assert os.path.exists(path)
+
+
+def test_disk_tier_is_shared_between_workers(tmp_path):
+    first = AnalysisCache(str(tmp_path))
+    second = AnalysisCache(str(tmp_path))
+    first.put('ab' * 32, 'text', {"text": "hemoglobin 13"})
+    assert second.get('ab' * 32, 'text') == {"text": "hemoglobin 13"}
+    assert second.stats()["disk_hits"] == 1
+    assert second.stats()["disk_entries"] == 1
+
+
+def test_missing_file_is_a_miss(tmp_path):
+    first = AnalysisCache(str(tmp_path))
+    second = AnalysisCache(str(tmp_path), max_memory_bytes=0)
+    first.put('cd' * 32, 'text', "value")
+    assert second.get('cd' * 32, 'text') == "value"
+    os.remove(first._disk_path('cd' * 32, 'text'))
+    second._memory.clear()
+    assert second.get('cd' * 32, 'text') is None
+    assert second.stats()["disk_entries"] == 0
+
+
+def test_disk_eviction_skips_files_already_removed(tmp_path):
+    cache = AnalysisCache(str(tmp_path), max_disk_bytes=30)
+    cache.put('01' * 32, 'text', "a" * 10)
+    cache.put('02' * 32, 'text', "b" * 10)
+    # Another worker evicted the oldest file
+    os.remove(cache._disk_path('01' * 32, 'text'))
+    cache.put('03' * 32, 'text', "c" * 10)
+    stats = cache.stats()
+    assert stats["disk_evictions"] == 0
+    assert stats["disk_bytes"] == 24
+    assert os.path.exists(cache._disk_path('02' * 32, 'text'))
+    assert os.path.exists(cache._disk_path('03' * 32, 'text'))
+    assert [name for _, _, names in os.walk(tmp_path) for name in names if name.endswith('.tmp')] == []
@@ -0,0 +1,66 @@
+import pytest
+
+from report_types import REPORT_TYPES, ReportTypeClassifier
+
+
+@pytest.fixture(scope='module')
+def classifier():
+    return ReportTypeClassifier()
+
+
+def labels(classifier, text):
+    return [label for label, _ in classifier.classify(text)]
+
+
+def elif_chain(text):
+    """The detection the classifier replaced: first type with any term as a substring"""
+    text_lower = text.lower()
+    for label, terms in REPORT_TYPES:
+        if any(term in text_lower for term in terms):
+            return [label]
+    return []
+
+
+@pytest.mark.parametrize("text", [
+    "Complete Blood Count\nHemoglobin 13.5 g/dL\nWBC 6,000",
+    "Urinalysis: urine clear, pH 6.0",
+    "Fasting glucose 92 mg/dL, HbA1c 5.4%",
+    "Lipid panel: cholesterol 180, HDL 55, LDL 90, triglycerides 120",
+    "Chest X-ray: no acute findings",
+    "MRI of the lumbar spine",
+    "CT scan of the abdomen",
+    "Pelvic ultrasound with doppler",
+    "12-lead ECG: sinus rhythm",
+])
+def test_single_type_reports_keep_the_elif_chain_label(classifier, text):
+    assert labels(classifier, text) == elif_chain(text)
+
+
+def test_combined_panel_gets_every_type(classifier):
+    text = "CBC: hemoglobin 14, WBC 7,000, RBC 4.8\nLipid panel: cholesterol 210, HDL 45, LDL 130"
+    assert sorted(labels(classifier, text)) == ["Blood Test", "Lipid Panel"]
+    assert elif_chain(text) == ["Blood Test"]
+
+
+def test_confidences_are_sorted_and_bounded(classifier):
+    result = classifier.classify("CBC hemoglobin hematocrit wbc\nlipid cholesterol")
+    confidences = [confidence for _, confidence in result]
+    assert confidences == sorted(confidences, reverse=True)
+    assert all(0 < confidence < 1 for confidence in confidences)
+
+
+def test_whole_words_only(classifier):
+    # The old substring test found "lipid" in "hyperlipidemia"
+    assert labels(classifier, "History of hyperlipidemia") == []
+    assert elif_chain("History of hyperlipidemia") == ["Lipid Panel"]
+
+
+def test_weak_second_type_needs_min_confidence(classifier):
+    assert labels(classifier, "CBC with hemoglobin and hematocrit; urine sample pending") == ["Blood Test"]
+    assert labels(ReportTypeClassifier(min_confidence=0.1), "CBC with hemoglobin; urine sample") == \
+        ["Blood Test", "Urinalysis"]
+
+
+def test_classify_many_matches_classify(classifier):
+    texts = ["CBC hemoglobin", "MRI brain", "", "lipid panel"]
+    assert classifier.classify_many(texts) == [classifier.classify(text) for text in texts]
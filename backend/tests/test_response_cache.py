@@ -0,0 +1,119 @@
+import pytest
+
+from response_cache import ResponseCache
+
+SYSTEM = {"role": "system", "content": "You are a medical assistant."}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def prompt(question):
+    return [SYSTEM, {"role": "user", "content": question}]
+
+
+def test_exact_match_ignores_case_and_punctuation():
+    cache = ResponseCache()
+    cache.put(prompt("How do I reduce back pain?"), "answer")
+    assert cache.get(prompt("how do i reduce back pain")) == "answer"
+    assert cache.stats()["exact_hits"] == 1
+
+
+def test_near_matches_are_off_by_default():
+    cache = ResponseCache()
+    cache.put(prompt("How do I reduce my lower back pain?"), "answer")
+    assert cache.get(prompt("how do I reduce lower back pains")) is None
+
+
+def test_near_match_on_content_words():
+    cache = ResponseCache(threshold=0.8)
+    cache.put(prompt("How do I reduce my lower back pain?"), "answer")
+    assert cache.get(prompt("how do I reduce lower back pains")) == "answer"
+    assert cache.get(prompt("How do I reduce my lower neck pain?")) is None
+
+
+@pytest.mark.parametrize("other", [
+    "Why should I take ibuprofen?",
+    "Who should take ibuprofen?",
+    "When can I take ibuprofen?",
+    "Should I take ibuprofen?",
+])
+def test_different_question_words_do_not_match(other):
+    cache = ResponseCache(threshold=0.8)
+    cache.put(prompt("When should I take ibuprofen?"), "take it with food")
+    assert cache.get(prompt(other)) is None
+    assert cache.get(prompt("when should i take ibuprofen")) == "take it with food"
+
+
+@pytest.mark.parametrize("cached, other", [
+    ("Is a high potassium level in an adult dangerous?", "Is a low potassium level in an adult dangerous?"),
+    ("What dose of ibuprofen is safe for a child with a fever?",
+     "What dose of ibuprofen is safe for an adult with a fever?"),
+    ("The chest x-ray shows pneumonia in the lower lobe", "The chest x-ray shows no pneumonia in the lower lobe"),
+    ("Why does my left knee swell after running?", "Why does my right knee swell after running?"),
+])
+def test_key_terms_are_not_conflated(cached, other):
+    # A low threshold, so only the key terms keep the pair apart
+    cache = ResponseCache(threshold=0.3)
+    cache.put(prompt(cached), "answer")
+    assert cache.get(prompt(other)) is None
+    assert cache.get(prompt(cached.lower())) == "answer"
+
+
+def test_context_separates_answers():
+    cache = ResponseCache()
+    cache.put(prompt("What helps a headache?"), "answer")
+    other = [{"role": "system", "content": "Answer briefly."}, {"role": "user", "content": "What helps a headache?"}]
+    assert cache.get(other) is None
+
+
+def test_personal_values_not_cached_by_default():
+    cache = ResponseCache()
+    cache.put(prompt("My temperature is 38.5, what should I do?"), "answer")
+    assert cache.get(prompt("My temperature is 38.5, what should I do?")) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_personal_values_match_raw_text_only_when_enabled():
+    cache = ResponseCache(personal=True)
+    cache.put(prompt("My temperature is 38.5, what should I do?"), "answer")
+    assert cache.get(prompt("My temperature is  38.5, what should I do?")) == "answer"
+    assert cache.get(prompt("my temperature is 38.5, what should i do")) is None
+    assert cache.get(prompt("My temperature is 39.5, what should I do?")) is None
+
+
+def test_from_env_does_not_cache_personal_values(monkeypatch):
+    monkeypatch.delenv('RESPONSE_CACHE_PERSONAL', raising=False)
+    assert ResponseCache.from_env().personal is False
+    monkeypatch.setenv('RESPONSE_CACHE_PERSONAL', '1')
+    assert ResponseCache.from_env().personal is True
+
+
+def test_expired_near_candidate_falls_through_to_live_one():
+    clock = Clock()
+    cache = ResponseCache(ttl=10, threshold=0.5, clock=clock)
+    # The expired entry is the better match; the live one is still above the threshold
+    cache.put(prompt("How do I reduce my lower back pain?"), "old")
+    clock.now = 5
+    cache.put(prompt("How do I reduce lower back pains at night?"), "new")
+    clock.now = 12
+    assert cache.get(prompt("how do I reduce lower back pain")) == "new"
+    assert cache.stats()["near_hits"] == 1
+    assert cache.stats()["expirations"] == 1
+
+
+def test_expiry_and_eviction():
+    clock = Clock()
+    cache = ResponseCache(ttl=10, max_entries=2, clock=clock)
+    for question in ("What is a fever?", "What is a rash?", "What is a cough?"):
+        cache.put(prompt(question), question)
+    assert cache.get(prompt("What is a fever?")) is None
+    assert cache.stats()["evictions"] == 1
+    clock.now = 11
+    assert cache.get(prompt("What is a cough?")) is None
+    assert cache.stats()["entries"] == 1
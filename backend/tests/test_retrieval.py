@@ -0,0 +1,81 @@
+import os
+import threading
+
+from retrieval import HashingEmbedder, VectorLakeRetriever, load_reference_index, report_queries
+
+
+def test_report_queries_use_flagged_values_and_findings():
+    queries = report_queries("WBC 15.2 x10^9/L\nHemoglobin 14.0 g/dL\nThe culture was positive.")
+    assert "wbc high" in queries
+    assert not any(query.startswith("hemoglobin") for query in queries)
+    assert any("culture" in query for query in queries)
+
+
+def test_report_queries_skip_values_without_a_flag():
+    # mg/dL does not convert to the count unit of WBC, so it has no flag
+    queries = report_queries("WBC 15.2 mg/dL")
+    assert queries == ["abnormal high low result"]
+
+
+def reference_dirs(cache_dir):
+    return sorted(os.listdir(cache_dir))
+
+
+def test_reference_index_is_saved_once_and_reused(tmp_path):
+    first = load_reference_index(HashingEmbedder(), cache_dir=str(tmp_path))
+    assert len(reference_dirs(tmp_path)) == 1  # no temporary directory left behind
+    embedder = HashingEmbedder()
+    second = load_reference_index(embedder, cache_dir=str(tmp_path))
+    assert second.chunks == first.chunks
+    assert embedder.weights is not None
+
+
+def test_concurrent_builds_leave_one_complete_index(tmp_path):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        load_reference_index(HashingEmbedder(), cache_dir=str(tmp_path)))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 4
+    [saved] = reference_dirs(tmp_path)
+    assert sorted(os.listdir(tmp_path / saved)) == ['chunks.jsonl', 'vectors.npy', 'weights.npy']
+
+
+def test_unreadable_index_is_rebuilt(tmp_path):
+    expected = load_reference_index(HashingEmbedder(), cache_dir=str(tmp_path))
+    [saved] = reference_dirs(tmp_path)
+    (tmp_path / saved / 'vectors.npy').write_bytes(b'truncated')
+    rebuilt = load_reference_index(HashingEmbedder(), cache_dir=str(tmp_path))
+    assert rebuilt.chunks == expected.chunks
+
+
+class FakeVectorLake:
+    def __init__(self):
+        self.pushed = []
+
+    def create(self):
+        return {"vectorlake_id": "vl-1"}
+
+    def generate(self, text):
+        return [0.0]
+
+    def push(self, document):
+        self.pushed.append(document)
+
+    def search(self, query):
+        return {"results": [{"document_text": "Fever note", "score": 0.9, "metadata": {"title": "Fever"}}]}
+
+
+def test_vectorlake_corpus_is_pushed_only_on_request():
+    vectorlake = FakeVectorLake()
+    retriever = VectorLakeRetriever(vectorlake, HashingEmbedder())
+    assert vectorlake.pushed == []
+    assert retriever.reference_notes(["fever"], None) == []
+    assert retriever.push_reference_corpus() == "vl-1"
+    count = len(vectorlake.pushed)
+    assert count > 0
+    retriever.push_reference_corpus()
+    assert len(vectorlake.pushed) == count
+    assert [chunk.text for chunk in retriever.reference_notes(["fever"], None)] == ["Fever note"]
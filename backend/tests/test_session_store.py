@@ -0,0 +1,46 @@
+import threading
+
+import pytest
+
+from dialogue import DialogueState
+from session_store import SessionStore
+from sqlite_store import SQLiteDatabase, SQLiteSessionStore
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def sessions(request, tmp_path):
+    if request.param == 'memory':
+        return SessionStore()
+    return SQLiteSessionStore(SQLiteDatabase(str(tmp_path / 'sessions.db')))
+
+
+def count_turn(state):
+    state.turns += 1
+
+
+def test_dialogue_get_returns_a_copy(sessions):
+    sessions['token'] = 'test'
+    sessions.dialogue['token'] = DialogueState(topic='fever')
+    state = sessions.dialogue.get('token')
+    state.topic = 'cough'
+    assert sessions.dialogue.get('token').topic == 'fever'
+
+
+def test_dialogue_update(sessions):
+    sessions['token'] = 'test'
+    assert sessions.dialogue.get('token') is None
+    sessions.dialogue.update('token', count_turn)
+    assert sessions.dialogue.get('token').turns == 1
+    sessions.dialogue.update('missing', count_turn)
+    assert sessions.dialogue.get('missing') is None
+
+
+def test_concurrent_dialogue_updates_all_apply(sessions):
+    sessions['token'] = 'test'
+    threads = [threading.Thread(target=lambda: [sessions.dialogue.update('token', count_turn) for _ in range(25)])
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sessions.dialogue.get('token').turns == 100
@@ -0,0 +1,19 @@
+import io
+import os
+
+
+def test_empty_upload_is_a_bad_request(client, token):
+    response = client.post('/api/analyze-report', headers={"Authorization": token},
+                           data={"file": (io.BytesIO(b''), 'empty.txt')})
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Could not extract text from file"}
+
+
+def test_upload_is_spooled_once_and_renamed(app_module, client, token):
+    response = client.post('/api/analyze-report?async=1', headers={"Authorization": token},
+                           data={"file": (io.BytesIO(b'Sodium 140 mmol/L\n'), 'sodium.txt'),
+                                 "extra": (io.BytesIO(b'not used'), 'extra.txt')})
+    assert response.status_code == 202
+    root = app_module.upload_store.root
+    # The stored copy is the spooled file; the unused part was removed with the request
+    assert not [name for name in os.listdir(root) if name.endswith('.part')]
@@ -0,0 +1,9 @@
+"""WSGI entry point for production servers.
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+The Werkzeug development server (python app.py) is for local use only.
+"""
+from app import app as application
+
+app = application